@@ -1,18 +1,32 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.hashers import make_password, check_password
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db.models import Count, Prefetch
+from django.db import IntegrityError
+from django.utils.dateparse import parse_datetime
+import hashlib
+import json
+import time
 import requests
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework.decorators import api_view
-from deep_translator import GoogleTranslator
 from .models import (
     Usuario, Paciente, Medico, Medicamento,
     Tratamiento, TratamientoMedicamento,
-    HistorialAdherencia, Notificacion, PacienteCuidador
+    HistorialAdherencia, Notificacion, PacienteCuidador, TomaProgramada,
+    RegistroToma
 )
 from .serializers import (
     UsuarioSerializer, PacienteSerializer, MedicoSerializer,
@@ -20,8 +34,25 @@ from .serializers import (
     TratamientoMedicamentoSerializer,
     HistorialAdherenciaSerializer, NotificacionSerializer,
     PacienteCuidadorSerializer, CrearMedicoSerializer, CrearPacienteSerializer,
-    CrearRecetaSerializer
+    CrearRecetaSerializer, TomaProgramadaSerializer, RegistroTomaSerializer,
+    arbol_de_rutas
 )
+from .paginacion import PaginacionCursorPK, listar_paginado
+from .openfda import obtener_etiqueta, obtener_etiquetas, ErrorOpenFDA
+from .traduccion import traducir_lote
+from .interacciones import BuscadorTerminos, indexar_texto
+from .busqueda import CLAVE_VERSION_CATALOGO, buscar_medicamentos, buscar_pacientes, version_catalogo
+from .tomas import tomas_del_dia
+from .adherencia import puede_registrar, registrar_toma
+from . import contadores
+from .eventos import canal_usuario, mensaje_notificacion, obtener_broker
+from .estadisticas import resumen_admin, resumen_medico
+from .historial import historial, historial_stream
+from .recetas import ReferenciasReceta, crear_recetas, receta_a_dict
+from .importacion import FORMATOS, TAMANO_LOTE, formato_de_archivo, importar
+from . import exportacion, sesiones
+from .sesiones import token_de_request
+from .flujos import respuesta_en_flujo
 
 
 # ==================== AUTENTICACIÓN ====================
@@ -34,79 +65,76 @@ class LoginAPIView(APIView):
         if not email or not password:
             return Response({'error': 'Email y contraseña son requeridos'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            usuario = Usuario.objects.get(email=email)
-
-            if check_password(password, usuario.password_hash):
-                usuario.ultima_conexion = timezone.now()
-                usuario.save()
+        # Usuario y perfil (médico o paciente) en una sola consulta
+        usuario = Usuario.objects.con_perfil().filter(email=email).first()
+        if usuario is None:
+            return Response({'error': 'No existe un usuario con ese correo'}, status=status.HTTP_404_NOT_FOUND)
 
-                serializer = UsuarioSerializer(usuario)
-                
-                # Obtener datos adicionales según el tipo de usuario
-                datos_adicionales = {}
-                if usuario.tipo_usuario == 'medico':
-                    try:
-                        medico = Medico.objects.get(id_usuario=usuario)
-                        medico_serializer = MedicoSerializer(medico)
-                        datos_adicionales = medico_serializer.data
-                    except Medico.DoesNotExist:
-                        pass
-                elif usuario.tipo_usuario == 'paciente':
-                    try:
-                        paciente = Paciente.objects.get(id_usuario=usuario)
-                        paciente_serializer = PacienteSerializer(paciente)
-                        datos_adicionales = paciente_serializer.data
-                    except Paciente.DoesNotExist:
-                        pass
-                
-                return Response(
-                    {
-                        'mensaje': f'Bienvenido {usuario.nombre} {usuario.apellido}',
-                        'usuario': serializer.data,
-                        'datos_adicionales': datos_adicionales,
-                    },
-                    status=status.HTTP_200_OK
-                )
-            else:
-                return Response({'error': 'Contraseña incorrecta'}, status=status.HTTP_401_UNAUTHORIZED)
+        def rehashear(password_plana):
+            # check_password() la llama si el hash usa otro algoritmo o parámetros
+            usuario.password_hash = make_password(password_plana)
+            Usuario.objects.filter(pk=usuario.pk).update(password_hash=usuario.password_hash)
+
+        if not check_password(password, usuario.password_hash, setter=rehashear):
+            return Response({'error': 'Contraseña incorrecta'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        if not usuario.activo:
+            return Response({'error': 'Usuario inactivo'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        # Solo se escribe ultima_conexion, y como mucho una vez por ULTIMA_CONEXION_GRANULARIDAD
+        ahora = timezone.now()
+        limite = ahora - timedelta(seconds=settings.ULTIMA_CONEXION_GRANULARIDAD)
+        if usuario.ultima_conexion < limite:
+            Usuario.objects.filter(pk=usuario.pk, ultima_conexion__lt=limite).update(ultima_conexion=ahora)
+            usuario.ultima_conexion = ahora
+
+        token, sesion = sesiones.crear_sesion(usuario)
+        serializer = UsuarioSerializer(usuario)
+        perfil = usuario.perfil()
+        datos_adicionales = {}
+        if isinstance(perfil, Medico):
+            datos_adicionales = MedicoSerializer(perfil).data
+        elif isinstance(perfil, Paciente):
+            datos_adicionales = PacienteSerializer(perfil).data
 
-        except Usuario.DoesNotExist:
-            return Response({'error': 'No existe un usuario con ese correo'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(
+            {
+                'mensaje': f'Bienvenido {usuario.nombre} {usuario.apellido}',
+                'usuario': serializer.data,
+                'datos_adicionales': datos_adicionales,
+                'token': token,
+                'expira': datetime.fromtimestamp(sesion['expira'], tz=dt_timezone.utc),
+            },
+            status=status.HTTP_200_OK
+        )
 
 
 class LogoutAPIView(APIView):
+    """
+    Cierra la sesión del token enviado en `Authorization: Token <token>`
+    POST /api/auth/logout/
+    """
     def post(self, request):
-        usuario_id = request.data.get('usuario_id')
+        token = token_de_request(request)
+        if not token:
+            return Response({'error': 'Token de sesión requerido'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        if not usuario_id:
-            return Response({'error': 'usuario_id es requerido'}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            usuario = Usuario.objects.get(id_usuario=usuario_id)
-            return Response({'mensaje': f'Sesión cerrada para {usuario.nombre}'}, status=status.HTTP_200_OK)
-        except Usuario.DoesNotExist:
-            return Response({'error': 'Usuario no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        if not sesiones.revocar(token):
+            return Response({'error': 'Sesión inválida o expirada'}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response({'mensaje': 'Sesión cerrada'}, status=status.HTTP_200_OK)
 
 
 class VerificarSesionAPIView(APIView):
+    """
+    Valida el token de `Authorization: Token <token>` y devuelve el usuario de la
+    sesión. Normalmente se resuelve en caché, sin consultar la base de datos.
+    POST /api/auth/verificar-sesion/
+    """
     def post(self, request):
-        usuario_id = request.data.get('usuario_id')
-
-        if not usuario_id:
-            return Response({'error': 'usuario_id es requerido'}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            usuario = Usuario.objects.get(id_usuario=usuario_id)
-
-            if usuario.activo:
-                serializer = UsuarioSerializer(usuario)
-                return Response({'mensaje': 'Sesión válida', 'usuario': serializer.data}, status=status.HTTP_200_OK)
-            else:
-                return Response({'error': 'Usuario inactivo'}, status=status.HTTP_401_UNAUTHORIZED)
-
-        except Usuario.DoesNotExist:
-            return Response({'error': 'Usuario no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        sesion = sesiones.validar(token_de_request(request))
+        if sesion is None:
+            return Response({'error': 'Sesión inválida o expirada'}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response({'mensaje': 'Sesión válida', 'usuario': sesion['usuario']}, status=status.HTTP_200_OK)
 
 
 class RegistroUsuarioAPIView(APIView):
@@ -130,16 +158,21 @@ class RegistroUsuarioAPIView(APIView):
 
 class CambiarPasswordAPIView(APIView):
     def post(self, request):
-        usuario_id = request.data.get('usuario_id')
+        # El usuario sale de la sesión (Authorization: Token <token>), no del cuerpo
+        sesion = sesiones.validar(token_de_request(request))
+        if sesion is None:
+            return Response({'error': 'Sesión inválida o expirada'}, status=status.HTTP_401_UNAUTHORIZED)
         password_actual = request.data.get('password_actual')
         password_nueva = request.data.get('password_nueva')
 
         try:
-            usuario = Usuario.objects.get(id_usuario=usuario_id)
+            usuario = Usuario.objects.get(id_usuario=sesion['usuario']['id_usuario'])
 
             if check_password(password_actual, usuario.password_hash):
                 usuario.password_hash = make_password(password_nueva)
                 usuario.save()
+                # Las demás sesiones abiertas dejan de valer; la de esta petición se conserva
+                sesiones.revocar_sesiones_usuario(usuario.id_usuario, excepto=token_de_request(request))
                 return Response({'mensaje': 'Contraseña cambiada exitosamente'}, status=status.HTTP_200_OK)
 
             return Response({'error': 'Contraseña actual incorrecta'}, status=status.HTTP_401_UNAUTHORIZED)
@@ -237,112 +270,275 @@ class CrearMedicoAPIView(APIView):
             return Response({'mensaje': f'Médico {usuario.nombre} {usuario.apellido} creado exitosamente', 'data': response_serializer.data}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class ImportarUsuariosAPIView(APIView):
+    """
+    Importación masiva de pacientes o médicos (ver appweb/importacion.py)
+    POST /api/paciente/importar/  y  POST /api/medico/importar/
+    multipart: archivo=<.csv o .jsonl>, formato=csv|jsonl (opcional), lote=<filas por lote>
+    
+    Responde en JSON Lines a medida que avanza: una línea por lote con los totales
+    acumulados y los errores de sus filas, y una línea final con el resumen.
+    Las contraseñas se hashean en este proceso; para archivos grandes, usar
+    `manage.py importar_usuarios`, que las reparte en un pool de procesos.
+    """
+    tipo = None
+    LOTE_MAXIMO = 5000
+    
+    def post(self, request):
+        archivo = request.FILES.get('archivo')
+        if archivo is None:
+            return Response({'error': "Debe enviar el archivo en el campo 'archivo'"}, status=status.HTTP_400_BAD_REQUEST)
+        formato = request.data.get('formato') or formato_de_archivo(archivo.name)
+        if formato not in FORMATOS:
+            return Response({'error': f"Formato no soportado. Use: {', '.join(FORMATOS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            lote = min(max(int(request.data.get('lote', TAMANO_LOTE)), 1), self.LOTE_MAXIMO)
+        except (TypeError, ValueError):
+            return Response({'error': "'lote' debe ser un número entero"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        def lineas():
+            resumen = {'procesadas': 0, 'creadas': 0, 'con_errores': 0}
+            for informe in importar(archivo, self.tipo, formato, tamano_lote=lote, procesos=1):
+                resumen['procesadas'] = informe['procesadas']
+                resumen['creadas'] = informe['creadas']
+                resumen['con_errores'] += len(informe['errores'])
+                yield json.dumps(informe, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+            yield json.dumps({'mensaje': 'Importación terminada', **resumen}, ensure_ascii=False) + '\n'
+        
+        return respuesta_en_flujo(request, lineas(), content_type='application/x-ndjson')
+
 # ========== VIEWSETS ==========
 
-class UsuarioViewSet(viewsets.ModelViewSet):
+class ListadoPaginadoMixin:
+    """Serializa los listados de las acciones con la paginación por cursor del ViewSet"""
+    def responder_listado(self, queryset):
+        pagina = self.paginate_queryset(queryset)
+        if pagina is not None:
+            serializer = self.get_serializer(pagina, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+
+class CamposExpandiblesMixin:
+    """
+    Respuestas compactas: las relaciones se devuelven como ids y solo se anidan las
+    pedidas con ?expand= (rutas con punto, p. ej. expand=tratamiento.paciente.usuario).
+    ?fields= limita los campos de cada nivel en las lecturas. El select_related del
+    queryset se arma con exactamente las relaciones expandidas.
+    """
+    def expansiones(self):
+        if not hasattr(self, '_expansiones'):
+            self._expansiones = arbol_de_rutas(self.request.query_params.get('expand'))
+        return self._expansiones
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        rutas = self.get_serializer_class().rutas_select_related(self.expansiones())
+        return queryset.select_related(*rutas) if rutas else queryset
+
+    def get_serializer_context(self):
+        contexto = super().get_serializer_context()
+        contexto['expansiones'] = self.expansiones()
+        if self.request.method in ('GET', 'HEAD'):
+            contexto['campos'] = arbol_de_rutas(self.request.query_params.get('fields'))
+        return contexto
+
+
+class UsuarioViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
     queryset = Usuario.objects.all()
     serializer_class = UsuarioSerializer
     
     @action(detail=False, methods=['get'])
     def activos(self, request):
-        usuarios_activos = Usuario.objects.filter(activo=True)
-        serializer = self.get_serializer(usuarios_activos, many=True)
-        return Response(serializer.data)
+        usuarios_activos = self.get_queryset().filter(activo=True)
+        return self.responder_listado(usuarios_activos)
     
     @action(detail=False, methods=['get'])
     def por_tipo(self, request):
         tipo = request.query_params.get('tipo', None)
         if tipo:
-            usuarios = Usuario.objects.filter(tipo_usuario=tipo)
-            serializer = self.get_serializer(usuarios, many=True)
-            return Response(serializer.data)
+            usuarios = self.get_queryset().filter(tipo_usuario=tipo)
+            return self.responder_listado(usuarios)
         return Response({"error": "Debe proporcionar el parámetro 'tipo'"}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MedicoViewSet(viewsets.ModelViewSet):
-    queryset = Medico.objects.select_related('id_usuario').all()
+class MedicoViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
+    queryset = Medico.objects.all()
     serializer_class = MedicoSerializer
     
     @action(detail=False, methods=['get'])
     def por_especialidad(self, request):
         especialidad = request.query_params.get('especialidad', None)
         if especialidad:
-            medicos = Medico.objects.filter(especialidad__icontains=especialidad)
-            serializer = self.get_serializer(medicos, many=True)
-            return Response(serializer.data)
+            medicos = self.get_queryset().filter(especialidad__icontains=especialidad)
+            return self.responder_listado(medicos)
         return Response({"error": "Debe proporcionar el parámetro 'especialidad'"}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['get'])
     def pacientes(self, request, pk=None):
         medico = self.get_object()
-        tratamientos = Tratamiento.objects.filter(id_medico=medico).select_related('id_paciente')
+        rutas = PacienteSerializer.rutas_select_related(self.expansiones(), 'id_paciente__')
+        tratamientos = Tratamiento.objects.filter(id_medico=medico).select_related('id_paciente', *rutas)
         pacientes = [t.id_paciente for t in tratamientos]
-        serializer = PacienteSerializer(pacientes, many=True)
+        serializer = PacienteSerializer(pacientes, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-class PacienteViewSet(viewsets.ModelViewSet):
+class PacienteViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
     # Asegurar que solo se devuelvan pacientes cuyo usuario tenga tipo 'paciente'
-    queryset = Paciente.objects.select_related('id_usuario').filter(id_usuario__tipo_usuario='paciente')
+    queryset = Paciente.objects.filter(id_usuario__tipo_usuario='paciente')
     serializer_class = PacienteSerializer
     
     @action(detail=True, methods=['get'])
     def tratamientos(self, request, pk=None):
         paciente = self.get_object()
-        tratamientos = Tratamiento.objects.filter(id_paciente=paciente)
-        serializer = TratamientoSerializer(tratamientos, many=True)
+        rutas = TratamientoSerializer.rutas_select_related(self.expansiones())
+        tratamientos = Tratamiento.objects.filter(id_paciente=paciente).select_related(*rutas)
+        serializer = TratamientoSerializer(tratamientos, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-class MedicamentoViewSet(viewsets.ModelViewSet):
+class MedicamentoViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
     queryset = Medicamento.objects.all()
     serializer_class = MedicamentoSerializer
     
+    def clave_catalogo(self, request):
+        """
+        Parte de la clave de caché que depende de la petición: la ruta y solo los
+        parámetros que cambian la respuesta, normalizados (?fields= ordenado y
+        reducido a campos existentes, ?limite= como entero acotado). Los demás
+        parámetros no crean entradas nuevas. None si la respuesta no se cachea:
+        las páginas con ?cursor= (consultas por llave, baratas) o parámetros inválidos.
+        """
+        parametros = request.query_params
+        paginador = self.paginator
+        if parametros.get(paginador.cursor_query_param):
+            return None
+        partes = [request.path]
+        if paginador.limite_query_param in parametros:
+            try:
+                partes.append(f'limite={paginador.obtener_limite(parametros)}')
+            except ValidationError:
+                return None
+        campos = arbol_de_rutas(parametros.get('fields'))
+        if campos:
+            # Medicamento no tiene relaciones: ?expand= no cambia la respuesta
+            validos = sorted(set(campos) & set(self.get_serializer_class().Meta.fields))
+            partes.append(f"fields={','.join(validos)}")
+        return hashlib.sha1('&'.join(partes).encode('utf-8')).hexdigest()
+
+    def responder_catalogo(self, request, generar):
+        """
+        Guarda en caché los bytes JSON de la respuesta por versión del catálogo y
+        clave_catalogo(), con un ETag fuerte (hash del contenido). Mientras el catálogo
+        no cambie, la lectura no toca la base ni serializa, y con If-None-Match responde 304.
+        """
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            return generar()
+        ruta = self.clave_catalogo(request)
+        if ruta is None:
+            return generar()
+
+        clave = f'{CLAVE_VERSION_CATALOGO}:{version_catalogo()}:{ruta}'
+        guardada = cache.get(clave)
+        if guardada is None:
+            response = generar()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            contenido = renderer.render(response.data, request.accepted_media_type, self.get_renderer_context())
+            encabezados = {k: v for k, v in response.items() if k.lower() != 'content-type'}
+            guardada = (f'"{hashlib.sha1(contenido).hexdigest()}"', contenido, encabezados)
+            cache.set(clave, guardada, getattr(settings, 'MEDICAMENTOS_CATALOGO_CACHE_TTL', 60 * 60))
+
+        etag, contenido, encabezados = guardada
+        etags_cliente = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in etags_cliente or '*' in etags_cliente:
+            respuesta = HttpResponseNotModified()
+        else:
+            respuesta = HttpResponse(contenido, content_type=renderer.media_type)
+            for nombre, valor in encabezados.items():
+                respuesta[nombre] = valor
+        respuesta['ETag'] = etag
+        # El navegador guarda la respuesta pero la revalida en cada carga
+        respuesta['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(respuesta, ['Accept'])
+        return respuesta
+    
+    def list(self, request, *args, **kwargs):
+        return self.responder_catalogo(request, lambda: super(MedicamentoViewSet, self).list(request, *args, **kwargs))
+    
+    def retrieve(self, request, *args, **kwargs):
+        return self.responder_catalogo(request, lambda: super(MedicamentoViewSet, self).retrieve(request, *args, **kwargs))
+    
+    LIMITE_BUSQUEDA = 20
+    LIMITE_BUSQUEDA_MAXIMO = 100
+    
+    def obtener_limite_busqueda(self, request):
+        try:
+            limite = int(request.query_params.get('limite', self.LIMITE_BUSQUEDA))
+        except ValueError:
+            limite = self.LIMITE_BUSQUEDA
+        return max(1, min(limite, self.LIMITE_BUSQUEDA_MAXIMO))
+    
     @action(detail=False, methods=['get'])
     def buscar(self, request):
-        query = request.query_params.get('q', None)
+        """
+        Búsqueda por prefijo y similitud en nombre comercial o genérico, ordenada por relevancia
+        GET /api/medicamentos/buscar/?q=ibupro&limite=10
+        GET /api/medicamentos/buscar/?codigo_barra=7501234567890
+        """
+        codigo_barra = request.query_params.get('codigo_barra', '').strip()
+        query = request.query_params.get('q', '').strip()
+        
+        # Camino rápido: búsqueda exacta por código de barras (índice único)
+        if codigo_barra or query.isdigit():
+            medicamento = Medicamento.objects.filter(codigo_barra=codigo_barra or query).first()
+            if medicamento is not None or codigo_barra:
+                serializer = self.get_serializer([medicamento] if medicamento else [], many=True)
+                return Response(serializer.data)
+        
         if query:
-            medicamentos = Medicamento.objects.filter(nombre_comercial__icontains=query) | Medicamento.objects.filter(nombre_generico__icontains=query)
+            medicamentos = buscar_medicamentos(query, 'nombre', self.obtener_limite_busqueda(request))
             serializer = self.get_serializer(medicamentos, many=True)
             return Response(serializer.data)
         return Response({"error": "Debe proporcionar el parámetro 'q' para buscar"}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
     def por_laboratorio(self, request):
-        laboratorio = request.query_params.get('laboratorio', None)
+        laboratorio = request.query_params.get('laboratorio', '').strip()
         if laboratorio:
-            medicamentos = Medicamento.objects.filter(laboratorio__icontains=laboratorio)
+            medicamentos = buscar_medicamentos(laboratorio, 'laboratorio', self.obtener_limite_busqueda(request))
             serializer = self.get_serializer(medicamentos, many=True)
             return Response(serializer.data)
         return Response({"error": "Debe proporcionar el parámetro 'laboratorio'"}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TratamientoViewSet(viewsets.ModelViewSet):
-    queryset = Tratamiento.objects.select_related('id_paciente__id_usuario', 'id_medico__id_usuario').all()
+class TratamientoViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
+    queryset = Tratamiento.objects.all()
     serializer_class = TratamientoSerializer
     
     @action(detail=False, methods=['get'])
     def activos(self, request):
-        tratamientos = Tratamiento.objects.filter(estado='activo')
-        serializer = self.get_serializer(tratamientos, many=True)
-        return Response(serializer.data)
+        tratamientos = self.get_queryset().filter(estado='activo')
+        return self.responder_listado(tratamientos)
     
     @action(detail=False, methods=['get'])
     def por_paciente(self, request):
         paciente_id = request.query_params.get('paciente_id', None)
         if paciente_id:
-            tratamientos = Tratamiento.objects.filter(id_paciente=paciente_id)
-            serializer = self.get_serializer(tratamientos, many=True)
-            return Response(serializer.data)
+            tratamientos = self.get_queryset().filter(id_paciente=paciente_id)
+            return self.responder_listado(tratamientos)
         return Response({"error": "Debe proporcionar el parámetro 'paciente_id'"}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
     def por_medico(self, request):
         medico_id = request.query_params.get('medico_id', None)
         if medico_id:
-            tratamientos = Tratamiento.objects.filter(id_medico=medico_id)
-            serializer = self.get_serializer(tratamientos, many=True)
-            return Response(serializer.data)
+            tratamientos = self.get_queryset().filter(id_medico=medico_id)
+            return self.responder_listado(tratamientos)
         return Response({"error": "Debe proporcionar el parámetro 'medico_id'"}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'])
@@ -354,21 +550,78 @@ class TratamientoViewSet(viewsets.ModelViewSet):
         return Response({'mensaje': 'Tratamiento finalizado exitosamente', 'data': serializer.data})
 
 
-class TratamientoMedicamentoViewSet(viewsets.ModelViewSet):
-    queryset = TratamientoMedicamento.objects.select_related('id_tratamiento', 'id_medicamento').all()
+class TratamientoMedicamentoViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
+    queryset = TratamientoMedicamento.objects.all()
     serializer_class = TratamientoMedicamentoSerializer
     
     @action(detail=False, methods=['get'])
     def por_tratamiento(self, request):
         tratamiento_id = request.query_params.get('tratamiento_id', None)
         if tratamiento_id:
-            tm = TratamientoMedicamento.objects.filter(id_tratamiento=tratamiento_id)
-            serializer = self.get_serializer(tm, many=True)
-            return Response(serializer.data)
+            tm = self.get_queryset().filter(id_tratamiento=tratamiento_id)
+            return self.responder_listado(tm)
         return Response({"error": "Debe proporcionar el parámetro 'tratamiento_id'"}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class HistorialAdherenciaViewSet(viewsets.ModelViewSet):
+class TomaProgramadaViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ReadOnlyModelViewSet):
+    """Tomas generadas por `manage.py generar_tomas`; no se editan a mano"""
+    queryset = TomaProgramada.objects.all()
+    serializer_class = TomaProgramadaSerializer
+    
+    @action(detail=False, methods=['get'])
+    def hoy(self, request):
+        paciente_id = request.query_params.get('paciente_id', None)
+        if not paciente_id:
+            return Response({"error": "Debe proporcionar el parámetro 'paciente_id'"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        dia = None
+        fecha = request.query_params.get('fecha')
+        if fecha:
+            try:
+                dia = date.fromisoformat(fecha)
+            except ValueError:
+                return Response({"error": "El parámetro 'fecha' debe tener formato AAAA-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = self.get_serializer(tomas_del_dia(paciente_id, dia), many=True)
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'])
+    def registrar(self, request, pk=None):
+        """
+        Registra la toma como hecha u omitida.
+        Body: usuario_id (paciente o cuidador autorizado), estado ('tomada' u 'omitida'),
+        fecha_hora_toma (opcional, ISO 8601) y notas (opcional).
+        """
+        toma = self.get_object()
+        usuario_id = request.data.get('usuario_id')
+        estado = request.data.get('estado', 'tomada')
+        
+        if not usuario_id:
+            return Response({'error': 'usuario_id es requerido'}, status=status.HTTP_400_BAD_REQUEST)
+        if estado not in dict(RegistroToma.ESTADO_CHOICES):
+            return Response({'error': "estado debe ser 'tomada' u 'omitida'"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        fecha_hora_toma = None
+        if request.data.get('fecha_hora_toma'):
+            fecha_hora_toma = parse_datetime(str(request.data['fecha_hora_toma']))
+            if fecha_hora_toma is None:
+                return Response({'error': 'fecha_hora_toma debe tener formato ISO 8601'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(fecha_hora_toma):
+                fecha_hora_toma = timezone.make_aware(fecha_hora_toma)
+        
+        usuario = get_object_or_404(Usuario, id_usuario=usuario_id, activo=True)
+        if not puede_registrar(usuario, toma.id_paciente):
+            return Response({'error': 'No tiene permiso para registrar tomas de este paciente'}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            registro = registrar_toma(toma, usuario, estado, fecha_hora_toma, request.data.get('notas', ''))
+        except IntegrityError:
+            return Response({'error': 'Esta toma ya fue registrada'}, status=status.HTTP_409_CONFLICT)
+        
+        return Response(RegistroTomaSerializer(registro).data, status=status.HTTP_201_CREATED)
+
+
+class HistorialAdherenciaViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
     queryset = HistorialAdherencia.objects.all()
     serializer_class = HistorialAdherenciaSerializer
     
@@ -376,19 +629,17 @@ class HistorialAdherenciaViewSet(viewsets.ModelViewSet):
     def por_paciente(self, request):
         paciente_id = request.query_params.get('paciente_id', None)
         if paciente_id:
-            historiales = HistorialAdherencia.objects.filter(id_paciente=paciente_id)
-            serializer = self.get_serializer(historiales, many=True)
-            return Response(serializer.data)
+            historiales = self.get_queryset().filter(id_paciente=paciente_id)
+            return self.responder_listado(historiales)
         return Response({"error": "Debe proporcionar el parámetro 'paciente_id'"}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
     def adherencia_baja(self, request):
-        historiales = HistorialAdherencia.objects.filter(clasificacion_adherencia='baja')
-        serializer = self.get_serializer(historiales, many=True)
-        return Response(serializer.data)
+        historiales = self.get_queryset().filter(clasificacion_adherencia='baja')
+        return self.responder_listado(historiales)
 
 
-class NotificacionViewSet(viewsets.ModelViewSet):
+class NotificacionViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
     queryset = Notificacion.objects.all()
     serializer_class = NotificacionSerializer
     
@@ -396,18 +647,28 @@ class NotificacionViewSet(viewsets.ModelViewSet):
     def no_leidas(self, request):
         usuario_id = request.query_params.get('usuario_id', None)
         if usuario_id:
-            notificaciones = Notificacion.objects.filter(id_usuario_destino=usuario_id, estado__in=['pendiente', 'enviada'])
-            serializer = self.get_serializer(notificaciones, many=True)
-            return Response(serializer.data)
+            notificaciones = self.get_queryset().filter(id_usuario_destino=usuario_id, estado__in=['pendiente', 'enviada'])
+            return self.responder_listado(notificaciones)
         return Response({"error": "Debe proporcionar el parámetro 'usuario_id'"}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def contador(self, request):
+        """Cantidad de notificaciones no leídas, para el indicador del dashboard"""
+        usuario_id = request.query_params.get('usuario_id', None)
+        if not usuario_id:
+            return Response({"error": "Debe proporcionar el parámetro 'usuario_id'"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            usuario_id = int(usuario_id)
+        except ValueError:
+            return Response({"error": "El parámetro 'usuario_id' debe ser un número"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'usuario_id': usuario_id, 'no_leidas': contadores.no_leidas(usuario_id)})
+    
     @action(detail=False, methods=['get'])
     def recordatorios_pendientes(self, request):
         usuario_id = request.query_params.get('usuario_id', None)
         if usuario_id:
-            recordatorios = Notificacion.objects.filter(id_usuario_destino=usuario_id, tipo_notificacion='recordatorio_medicamento', estado='pendiente')
-            serializer = self.get_serializer(recordatorios, many=True)
-            return Response(serializer.data)
+            recordatorios = self.get_queryset().filter(id_usuario_destino=usuario_id, tipo_notificacion='recordatorio_medicamento', estado='pendiente')
+            return self.responder_listado(recordatorios)
         return Response({"error": "Debe proporcionar el parámetro 'usuario_id'"}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'])
@@ -424,8 +685,61 @@ class NotificacionViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(notificacion)
         return Response({'mensaje': 'Notificación marcada como enviada', 'data': serializer.data})
 
-
-class PacienteCuidadorViewSet(viewsets.ModelViewSet):
+    def _seleccion_masiva(self, request):
+        """
+        Notificaciones indicadas en el cuerpo: una lista `ids`, o un filtro con
+        `usuario_id` y opcionalmente `tipo_notificacion`, `estado` y `hasta` (fecha de creación).
+        Devuelve (queryset, error).
+        """
+        ids = request.data.get('ids')
+        usuario_id = request.data.get('usuario_id')
+        if ids is None and not usuario_id:
+            return None, "Debe proporcionar 'ids' o 'usuario_id'"
+
+        notificaciones = Notificacion.objects.all()
+        if ids is not None:
+            if not isinstance(ids, list):
+                return None, "'ids' debe ser una lista"
+            try:
+                ids = [int(i) for i in ids]
+            except (TypeError, ValueError):
+                return None, "'ids' debe contener solo números"
+            notificaciones = notificaciones.filter(pk__in=ids)
+        if usuario_id:
+            notificaciones = notificaciones.filter(id_usuario_destino=usuario_id)
+        if request.data.get('tipo_notificacion'):
+            notificaciones = notificaciones.filter(tipo_notificacion=request.data['tipo_notificacion'])
+        if request.data.get('estado'):
+            notificaciones = notificaciones.filter(estado=request.data['estado'])
+        if request.data.get('hasta'):
+            hasta = parse_datetime(str(request.data['hasta']))
+            if hasta is None:
+                return None, "'hasta' debe ser una fecha y hora ISO 8601"
+            if timezone.is_naive(hasta):
+                hasta = timezone.make_aware(hasta)
+            notificaciones = notificaciones.filter(fecha_creacion__lte=hasta)
+        return notificaciones, None
+
+    @action(detail=False, methods=['post'])
+    def marcar_leidas(self, request):
+        """Marca como leídas varias notificaciones con un solo UPDATE"""
+        notificaciones, error = self._seleccion_masiva(request)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        actualizadas = notificaciones.marcar_como_leidas()
+        return Response({'mensaje': f'{actualizadas} notificaciones marcadas como leídas', 'actualizadas': actualizadas})
+
+    @action(detail=False, methods=['post'])
+    def marcar_enviadas(self, request):
+        """Marca como enviadas varias notificaciones con un solo UPDATE"""
+        notificaciones, error = self._seleccion_masiva(request)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        actualizadas = notificaciones.marcar_como_enviadas()
+        return Response({'mensaje': f'{actualizadas} notificaciones marcadas como enviadas', 'actualizadas': actualizadas})
+
+
+class PacienteCuidadorViewSet(CamposExpandiblesMixin, ListadoPaginadoMixin, viewsets.ModelViewSet):
     queryset = PacienteCuidador.objects.all()
     serializer_class = PacienteCuidadorSerializer
     
@@ -433,18 +747,16 @@ class PacienteCuidadorViewSet(viewsets.ModelViewSet):
     def por_paciente(self, request):
         paciente_id = request.query_params.get('paciente_id', None)
         if paciente_id:
-            relaciones = PacienteCuidador.objects.filter(id_paciente=paciente_id)
-            serializer = self.get_serializer(relaciones, many=True)
-            return Response(serializer.data)
+            relaciones = self.get_queryset().filter(id_paciente=paciente_id)
+            return self.responder_listado(relaciones)
         return Response({"error": "Debe proporcionar el parámetro 'paciente_id'"}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
     def por_cuidador(self, request):
         usuario_id = request.query_params.get('usuario_id', None)
         if usuario_id:
-            relaciones = PacienteCuidador.objects.filter(id_usuario=usuario_id)
-            serializer = self.get_serializer(relaciones, many=True)
-            return Response(serializer.data)
+            relaciones = self.get_queryset().filter(id_usuario=usuario_id)
+            return self.responder_listado(relaciones)
         return Response({"error": "Debe proporcionar el parámetro 'usuario_id'"}, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -492,8 +804,7 @@ class EliminarMedicoAPIView(APIView):
 class ListarMedicosAPIView(APIView):
     def get(self, request):
         medicos = Medico.objects.select_related('id_usuario').all()
-        serializer = MedicoSerializer(medicos, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return listar_paginado(request, medicos, MedicoSerializer, view=self)
 
 
 class EditarPacienteAPIView(APIView):
@@ -538,81 +849,52 @@ class EliminarPacienteAPIView(APIView):
 class ListarPacientesAPIView(APIView):
     def get(self, request):
         pacientes = Paciente.objects.select_related('id_usuario').filter(id_usuario__tipo_usuario='paciente')
-        serializer = PacienteSerializer(pacientes, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return listar_paginado(request, pacientes, PacienteSerializer, view=self)
     
 class BuscarPacientesAPIView(APIView):
     """Buscar pacientes por nombre, apellido o número de identificación.
+    La búsqueda ignora acentos y mayúsculas y devuelve hasta `limite` resultados (20 por defecto)
+    ordenados por relevancia.
     Si no se pasa `q`, devuelve todos los pacientes (comportamiento similar a listar).
     """
+    LIMITE = 20
+    LIMITE_MAXIMO = 100
+    
     def get(self, request):
         q = request.GET.get('q', '').strip()
 
         if not q:
             pacientes = Paciente.objects.select_related('id_usuario').filter(id_usuario__tipo_usuario='paciente')
-        else:
-            pacientes = Paciente.objects.select_related('id_usuario').filter(
-                (Q(id_usuario__nombre__icontains=q) |
-                 Q(id_usuario__apellido__icontains=q) |
-                 Q(numero_identificacion__icontains=q)) &
-                Q(id_usuario__tipo_usuario='paciente')
-            )
+            return listar_paginado(request, pacientes, PacienteSerializer, view=self)
+
+        try:
+            limite = int(request.GET.get('limite', self.LIMITE))
+        except ValueError:
+            limite = self.LIMITE
+        limite = max(1, min(limite, self.LIMITE_MAXIMO))
 
-        serializer = PacienteSerializer(pacientes, many=True)
+        serializer = PacienteSerializer(buscar_pacientes(q, limite), many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
-# ==================== OPENFDA API ====================
+# ==================== DASHBOARDS ====================
 
-def traducir_texto(texto, idioma_destino='es'):
-    """
-    Traduce texto de inglés a español usando deep-translator
-    Divide textos largos en fragmentos para evitar límites de la API
-    """
-    if not texto or texto == 'No disponible':
-        return texto
-    
-    try:
-        # Límite seguro por fragmento (Google Translate gratis soporta ~5000 caracteres)
-        MAX_CHARS = 4500
-        
-        # Si el texto es corto, traducir directamente
-        if len(texto) <= MAX_CHARS:
-            traductor = GoogleTranslator(source='en', target=idioma_destino)
-            return traductor.translate(texto)
-        
-        # Si el texto es largo, dividirlo en fragmentos
-        fragmentos = []
-        texto_restante = texto
-        
-        while len(texto_restante) > 0:
-            # Tomar un fragmento
-            if len(texto_restante) <= MAX_CHARS:
-                fragmento = texto_restante
-                texto_restante = ""
-            else:
-                # Buscar un punto o salto de línea para dividir de forma natural
-                punto_corte = texto_restante[:MAX_CHARS].rfind('. ')
-                if punto_corte == -1:
-                    punto_corte = texto_restante[:MAX_CHARS].rfind('\n')
-                if punto_corte == -1:
-                    punto_corte = MAX_CHARS
-                
-                fragmento = texto_restante[:punto_corte + 1]
-                texto_restante = texto_restante[punto_corte + 1:]
-            
-            # Traducir el fragmento
-            traductor = GoogleTranslator(source='en', target=idioma_destino)
-            fragmento_traducido = traductor.translate(fragmento.strip())
-            fragmentos.append(fragmento_traducido)
-        
-        # Unir todos los fragmentos traducidos
-        return ' '.join(fragmentos)
-        
-    except Exception as e:
-        print(f"Error al traducir: {e}")
-        return texto  # Si falla, devolver texto original
+class DashboardAdminAPIView(APIView):
+    def get(self, request):
+        """Conteos del dashboard de administrador (usuarios por tipo, tratamientos por estado, alertas)"""
+        return Response(resumen_admin(), status=status.HTTP_200_OK)
 
 
+class DashboardMedicoAPIView(APIView):
+    def get(self, request, medico_id):
+        """Conteos del dashboard de un médico sobre sus tratamientos y pacientes"""
+        try:
+            return Response(resumen_medico(medico_id), status=status.HTTP_200_OK)
+        except Medico.DoesNotExist:
+            return Response({'error': 'Médico no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
+
+# ==================== OPENFDA API ====================
+
 # Modificar la función buscar_medicamento_fda
 @api_view(['GET'])
 def buscar_medicamento_fda(request):
@@ -630,11 +912,10 @@ def buscar_medicamento_fda(request):
         )
     
     try:
-        # Llamar a OpenFDA API
-        url = f'https://api.fda.gov/drug/label.json?search=openfda.brand_name:"{nombre_medicamento}"&limit=1'
-        response = requests.get(url, timeout=10)
+        # Obtener la etiqueta de OpenFDA (pasando por la caché)
+        resultado = obtener_etiqueta(nombre_medicamento)
         
-        if response.status_code == 404:
+        if resultado is None:
             return Response(
                 {
                     'mensaje': 'Medicamento no encontrado en FDA',
@@ -643,25 +924,7 @@ def buscar_medicamento_fda(request):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        if response.status_code != 200:
-            return Response(
-                {'error': 'Error al conectar con OpenFDA'}, 
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
-        
-        data = response.json()
-        
-        if not data.get('results'):
-            return Response(
-                {
-                    'mensaje': 'No se encontraron resultados',
-                    'nombre_buscado': nombre_medicamento
-                }, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
         # Extraer información relevante
-        resultado = data['results'][0]
         openfda = resultado.get('openfda', {})
         
         # Preparar respuesta estructurada
@@ -677,17 +940,15 @@ def buscar_medicamento_fda(request):
             'interacciones': resultado.get('drug_interactions', ['No disponible'])[0] if resultado.get('drug_interactions') else 'No disponible',
         }
         
-        # Si se solicita traducción, traducir los campos
+        # Si se solicita traducción, traducir todos los campos en un solo lote
         if traducir:
-            info_medicamento_traducida = {}
-            for campo, valor in info_medicamento.items():
-                # No traducir nombres propios
-                if campo in ['nombre_comercial', 'nombre_generico', 'fabricante']:
-                    info_medicamento_traducida[campo] = valor
-                else:
-                    info_medicamento_traducida[campo] = traducir_texto(valor)
-            
-            info_medicamento = info_medicamento_traducida
+            # No traducir nombres propios
+            campos = [
+                campo for campo in info_medicamento
+                if campo not in ['nombre_comercial', 'nombre_generico', 'fabricante']
+            ]
+            traducidos = traducir_lote([info_medicamento[campo] for campo in campos])
+            info_medicamento.update(zip(campos, traducidos))
         
         return Response({
             'mensaje': 'Medicamento encontrado exitosamente',
@@ -701,6 +962,11 @@ def buscar_medicamento_fda(request):
             {'error': 'Timeout al conectar con OpenFDA'}, 
             status=status.HTTP_504_GATEWAY_TIMEOUT
         )
+    except ErrorOpenFDA:
+        return Response(
+            {'error': 'Error al conectar con OpenFDA'}, 
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except requests.exceptions.RequestException as e:
         return Response(
             {'error': f'Error de conexión: {str(e)}'}, 
@@ -735,25 +1001,20 @@ def verificar_interacciones_fda(request):
         # Obtener información de ambos medicamentos
         medicamentos_info = {}
         
+        # Ambas etiquetas se consultan en paralelo
+        etiquetas = obtener_etiquetas([medicamento1, medicamento2])
+        
         for nombre in [medicamento1, medicamento2]:
-            url = f'https://api.fda.gov/drug/label.json?search=openfda.brand_name:"{nombre}"&limit=1'
-            response = requests.get(url, timeout=10)
+            resultado = etiquetas[nombre]
+            if isinstance(resultado, Exception):
+                # OpenFDA no respondió: no es lo mismo que un medicamento sin etiqueta
+                raise resultado
             
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('results'):
-                    resultado = data['results'][0]
-                    interacciones_texto = resultado.get('drug_interactions', [''])[0] if resultado.get('drug_interactions') else ''
-                    
-                    medicamentos_info[nombre] = {
-                        'encontrado': True,
-                        'interacciones_completas': interacciones_texto
-                    }
-                else:
-                    medicamentos_info[nombre] = {
-                        'encontrado': False,
-                        'interacciones_completas': ''
-                    }
+            if isinstance(resultado, dict):
+                medicamentos_info[nombre] = {
+                    'encontrado': True,
+                    'interacciones_completas': texto_interacciones(resultado)
+                }
             else:
                 medicamentos_info[nombre] = {
                     'encontrado': False,
@@ -785,50 +1046,41 @@ def verificar_interacciones_fda(request):
         interaccion_especifica_encontrada = False
         resultado_interaccion = []
         
-        # Buscar si med2 se menciona en las interacciones de med1
-        texto_med1 = medicamentos_info[medicamento1]['interacciones_completas'].lower()
-        texto_med2 = medicamentos_info[medicamento2]['interacciones_completas'].lower()
-        
-        # Términos relacionados a buscar
-        terminos_med1 = [medicamento1.lower(), medicamento1.replace('-', '').lower()]
-        terminos_med2 = [medicamento2.lower(), medicamento2.replace('-', '').lower()]
+        # Un solo recorrido por etiqueta encuentra las menciones de ambos medicamentos
+        buscador = BuscadorTerminos({
+            medicamento1: terminos_medicamento(medicamento1),
+            medicamento2: terminos_medicamento(medicamento2),
+        })
+        texto_med1 = indexar_texto(medicamentos_info[medicamento1]['interacciones_completas'])
+        texto_med2 = indexar_texto(medicamentos_info[medicamento2]['interacciones_completas'])
         
         # Buscar menciones específicas
-        mencion_en_med1 = any(termino in texto_med1 for termino in terminos_med2)
-        mencion_en_med2 = any(termino in texto_med2 for termino in terminos_med1)
+        posicion_en_med1 = buscador.buscar(texto_med1).get(medicamento2)
+        posicion_en_med2 = buscador.buscar(texto_med2).get(medicamento1)
         
-        if mencion_en_med1 or mencion_en_med2:
+        if posicion_en_med1 is not None or posicion_en_med2 is not None:
             # Hay interacción específica mencionada
             interaccion_especifica_encontrada = True
             
-            if mencion_en_med1:
+            if posicion_en_med1 is not None:
                 # Extraer el párrafo relevante donde se menciona
-                fragmento = extraer_fragmento_relevante(
-                    texto_med1, 
-                    terminos_med2
-                )
-                if traducir:
-                    fragmento = traducir_texto(fragmento)
-                
                 resultado_interaccion.append({
                     'encontrado_en': medicamento1,
                     'menciona_a': medicamento2,
-                    'descripcion': fragmento
+                    'descripcion': texto_med1.fragmento(posicion_en_med1)
                 })
             
-            if mencion_en_med2:
-                fragmento = extraer_fragmento_relevante(
-                    texto_med2, 
-                    terminos_med1
-                )
-                if traducir:
-                    fragmento = traducir_texto(fragmento)
-                
+            if posicion_en_med2 is not None:
                 resultado_interaccion.append({
                     'encontrado_en': medicamento2,
                     'menciona_a': medicamento1,
-                    'descripcion': fragmento
+                    'descripcion': texto_med2.fragmento(posicion_en_med2)
                 })
+            
+            if traducir:
+                traducidos = traducir_lote([r['descripcion'] for r in resultado_interaccion])
+                for interaccion, descripcion in zip(resultado_interaccion, traducidos):
+                    interaccion['descripcion'] = descripcion
         
         # Preparar respuesta
         if interaccion_especifica_encontrada:
@@ -863,6 +1115,21 @@ def verificar_interacciones_fda(request):
                 'nota': 'Puede consultar las interacciones completas de cada medicamento por separado usando la búsqueda individual.'
             }, status=status.HTTP_200_OK)
         
+    except requests.exceptions.Timeout:
+        return Response(
+            {'error': 'Timeout al conectar con OpenFDA'}, 
+            status=status.HTTP_504_GATEWAY_TIMEOUT
+        )
+    except ErrorOpenFDA:
+        return Response(
+            {'error': 'Error al conectar con OpenFDA'}, 
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    except requests.exceptions.RequestException as e:
+        return Response(
+            {'error': f'Error de conexión: {str(e)}'}, 
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except Exception as e:
         return Response(
             {'error': f'Error al verificar interacciones: {str(e)}'}, 
@@ -875,29 +1142,119 @@ def extraer_fragmento_relevante(texto, terminos_buscar, caracteres_contexto=500)
     """
     Extrae el fragmento del texto donde se menciona alguno de los términos
     """
-    texto_lower = texto.lower()
-    
-    for termino in terminos_buscar:
-        posicion = texto_lower.find(termino)
-        if posicion != -1:
-            # Encontrar inicio del párrafo (punto anterior o inicio del texto)
-            inicio = max(0, posicion - caracteres_contexto)
-            # Buscar el punto anterior más cercano
-            punto_anterior = texto[:posicion].rfind('. ', inicio, posicion)
-            if punto_anterior != -1 and punto_anterior > inicio:
-                inicio = punto_anterior + 2
-            
-            # Encontrar fin del párrafo (siguiente punto o fin del texto)
-            fin = min(len(texto), posicion + caracteres_contexto)
-            punto_siguiente = texto.find('. ', posicion, fin)
-            if punto_siguiente != -1:
-                fin = punto_siguiente + 1
-            
-            return texto[inicio:fin].strip()
+    indexado = indexar_texto(texto)
+    menciones = BuscadorTerminos({'termino': terminos_buscar}).buscar(indexado)
+    if 'termino' in menciones:
+        return indexado.fragmento(menciones['termino'], caracteres_contexto)
     
     # Si no se encuentra, devolver los primeros caracteres
     return texto[:500] + "..." if len(texto) > 500 else texto
 
+def texto_interacciones(resultado):
+    """Texto de la sección `drug_interactions` de una etiqueta de OpenFDA"""
+    return resultado.get('drug_interactions', [''])[0] if resultado.get('drug_interactions') else ''
+
+
+def terminos_medicamento(nombre):
+    """Variantes con las que un medicamento puede aparecer en el texto de otra etiqueta"""
+    return [nombre.lower(), nombre.replace('-', '').lower()]
+
+
+@api_view(['GET'])
+def matriz_interacciones_fda(request):
+    """
+    Verifica las interacciones entre todos los pares de una lista de medicamentos
+    GET /api/medicamento/matriz-interacciones/?medicamentos=aspirin,ibuprofen,warfarin&traducir=true
+    
+    Cada etiqueta se consulta una sola vez y en paralelo; los pares se comparan en memoria.
+    Los medicamentos cuya consulta a OpenFDA falló van en `errores`, no en `no_encontrados`.
+    """
+    MAX_MEDICAMENTOS = 12
+    
+    nombres = []
+    for valor in request.query_params.getlist('medicamentos'):
+        nombres.extend(nombre.strip() for nombre in valor.split(',') if nombre.strip())
+    nombres = list(dict.fromkeys(nombres))
+    traducir = request.query_params.get('traducir', 'false').lower() == 'true'
+    
+    if len(nombres) < 2:
+        return Response(
+            {'error': 'Debe proporcionar al menos dos medicamentos en "medicamentos" (separados por comas)'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(nombres) > MAX_MEDICAMENTOS:
+        return Response(
+            {'error': f'Se pueden verificar como máximo {MAX_MEDICAMENTOS} medicamentos a la vez'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        etiquetas = obtener_etiquetas(nombres)
+        
+        encontrados = [nombre for nombre in nombres if isinstance(etiquetas[nombre], dict)]
+        no_encontrados = [nombre for nombre in nombres if etiquetas[nombre] is None]
+        errores = [
+            {
+                'medicamento': nombre,
+                'error': 'Timeout al conectar con OpenFDA'
+                if isinstance(etiquetas[nombre], requests.exceptions.Timeout)
+                else 'Error al conectar con OpenFDA'
+            }
+            for nombre in nombres if isinstance(etiquetas[nombre], Exception)
+        ]
+        textos = {nombre: texto_interacciones(etiquetas[nombre]) for nombre in encontrados}
+        
+        matriz = {nombre: {otro: False for otro in nombres if otro != nombre} for nombre in nombres}
+        interacciones = []
+        
+        # Una sola expresión con los términos de todos los medicamentos: un recorrido por etiqueta
+        buscador = BuscadorTerminos({nombre: terminos_medicamento(nombre) for nombre in nombres})
+        
+        for nombre in encontrados:
+            if not textos[nombre]:
+                continue
+            texto = indexar_texto(textos[nombre])
+            for otro, posicion in buscador.buscar(texto).items():
+                if otro == nombre:
+                    continue
+                matriz[nombre][otro] = True
+                interacciones.append({
+                    'encontrado_en': nombre,
+                    'menciona_a': otro,
+                    'descripcion': texto.fragmento(posicion)
+                })
+        
+        if traducir and interacciones:
+            traducidos = traducir_lote([i['descripcion'] for i in interacciones])
+            for interaccion, descripcion in zip(interacciones, traducidos):
+                interaccion['descripcion'] = descripcion
+        
+        if interacciones:
+            mensaje = f'⚠️ Se encontraron {len(interacciones)} mención(es) de interacción entre los medicamentos consultados'
+        elif errores:
+            mensaje = '⚠️ No se pudo consultar OpenFDA para todos los medicamentos; el resultado está incompleto.'
+        else:
+            mensaje = 'ℹ️ No se encontraron interacciones específicas documentadas entre los medicamentos consultados en la base de datos de la FDA.'
+        
+        return Response({
+            'mensaje': mensaje,
+            'medicamentos_consultados': nombres,
+            'no_encontrados': no_encontrados,
+            'errores': errores,
+            'traducido': traducir,
+            'interaccion_especifica': bool(interacciones),
+            'advertencia': '⚠️ Esta información es referencial. Consulte con su médico. La ausencia de información no garantiza seguridad.',
+            'matriz': matriz,
+            'datos': interacciones
+        }, status=status.HTTP_200_OK)
+        
+    except Exception as e:
+        return Response(
+            {'error': f'Error al verificar interacciones: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 # También actualizar efectos_adversos_fda
 @api_view(['GET'])
 def efectos_adversos_fda(request):
@@ -915,24 +1272,14 @@ def efectos_adversos_fda(request):
         )
     
     try:
-        url = f'https://api.fda.gov/drug/label.json?search=openfda.brand_name:"{nombre_medicamento}"&limit=1'
-        response = requests.get(url, timeout=10)
+        resultado = obtener_etiqueta(nombre_medicamento)
         
-        if response.status_code != 200:
+        if resultado is None:
             return Response(
                 {'error': 'Medicamento no encontrado'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        data = response.json()
-        
-        if not data.get('results'):
-            return Response(
-                {'error': 'No se encontraron resultados'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        resultado = data['results'][0]
         
         efectos_info = {
             'medicamento': nombre_medicamento,
@@ -943,8 +1290,9 @@ def efectos_adversos_fda(request):
         
         # Traducir si se solicita
         if traducir:
-            for campo in ['efectos_adversos', 'advertencias', 'precauciones']:
-                efectos_info[campo] = traducir_texto(efectos_info[campo])
+            campos = ['efectos_adversos', 'advertencias', 'precauciones']
+            traducidos = traducir_lote([efectos_info[campo] for campo in campos])
+            efectos_info.update(zip(campos, traducidos))
         
         return Response({
             'mensaje': 'Información de efectos adversos obtenida',
@@ -952,6 +1300,11 @@ def efectos_adversos_fda(request):
             'datos': efectos_info
         }, status=status.HTTP_200_OK)
         
+    except requests.exceptions.RequestException:
+        return Response(
+            {'error': 'Error al conectar con OpenFDA'}, 
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except Exception as e:
         return Response(
             {'error': f'Error al obtener efectos adversos: {str(e)}'}, 
@@ -965,10 +1318,25 @@ class CrearRecetaAPIView(APIView):
     """
     Crea una receta médica (Tratamiento + TratamientoMedicamento)
     POST /api/receta/crear/
+    POST /api/receta/crear/  {"recetas": [{...}, {...}]}  (lote, todo o nada)
+    
+    Médicos, pacientes y medicamentos se cargan con un in_bulk por modelo para todas
+    las recetas, y tratamientos, líneas y avisos se insertan con un bulk_create por
+    tabla en una sola transacción.
     """
+    LOTE_MAXIMO = 500
+    
     def post(self, request):
-        serializer = CrearRecetaSerializer(data=request.data)
+        lote = isinstance(request.data, dict) and 'recetas' in request.data
+        datos = request.data['recetas'] if lote else request.data
+        if lote:
+            if not isinstance(datos, list) or not datos:
+                return Response({'error': "'recetas' debe ser una lista no vacía"}, status=status.HTTP_400_BAD_REQUEST)
+            if len(datos) > self.LOTE_MAXIMO:
+                return Response({'error': f'Se admiten hasta {self.LOTE_MAXIMO} recetas por petición'}, status=status.HTTP_400_BAD_REQUEST)
         
+        referencias = ReferenciasReceta(datos if lote else [datos])
+        serializer = CrearRecetaSerializer(data=datos, many=lote, context={'referencias': referencias})
         if not serializer.is_valid():
             return Response(
                 {'error': serializer.errors},
@@ -976,96 +1344,22 @@ class CrearRecetaAPIView(APIView):
             )
         
         try:
-            datos = serializer.validated_data
-            
-            # Obtener médico y paciente
-            medico = Medico.objects.get(id_medico=datos['id_medico'])
-            paciente = Paciente.objects.get(id_paciente=datos['id_paciente'])
-            
-            # Calcular fecha de fin según vigencia
-            from datetime import timedelta
-            fecha_fin = datos['fecha_emision'] + timedelta(days=datos['vigencia_dias'])
-            
-            # Crear tratamiento
-            tratamiento = Tratamiento.objects.create(
-                id_paciente=paciente,
-                id_medico=medico,
-                diagnostico=datos['diagnostico'],
-                fecha_inicio=datos['fecha_emision'],
-                fecha_fin=fecha_fin,
-                duracion_dias=datos['vigencia_dias'],
-                tipo_tratamiento='Receta Médica',
-                objetivo_terapeutico=datos.get('instrucciones', ''),
-                estado='activo',
-                observaciones=''
-            )
-            
-            # Crear medicamentos del tratamiento
-            medicamentos_creados = []
-            for med_data in datos['medicamentos']:
-                medicamento = Medicamento.objects.get(id_medicamento=med_data['id_medicamento'])
-                
-                tratamiento_medicamento = TratamientoMedicamento.objects.create(
-                    id_tratamiento=tratamiento,
-                    id_medicamento=medicamento,
-                    dosis=med_data['dosis'],
-                    frecuencia=med_data['frecuencia'],
-                    via_administracion=med_data['via_administracion'],
-                    duracion_dias=med_data['duracion_dias'],
-                    horarios=med_data.get('horarios', []),
-                    instrucciones_especiales=med_data.get('instrucciones_especiales', ''),
-                    activo=True
-                )
-                
-                medicamentos_creados.append({
-                    'id_tratamiento_medicamento': tratamiento_medicamento.id_tratamiento_medicamento,
-                    'medicamento': medicamento.nombre_comercial,
-                    'dosis': med_data['dosis'],
-                    'frecuencia': med_data['frecuencia']
-                })
-            
-            # Crear notificación para el paciente
-            Notificacion.objects.create(
-                id_usuario_destino=paciente.id_usuario,
-                tipo_notificacion='mensaje_medico',
-                titulo='Nueva Receta Médica',
-                mensaje=f'El Dr. {medico.id_usuario.nombre} {medico.id_usuario.apellido} ha emitido una nueva receta.',
-                estado='pendiente'
-            )
-            
-            return Response({
-                'mensaje': 'Receta médica creada exitosamente',
-                'data': {
-                    'id_tratamiento': tratamiento.id_tratamiento,
-                    'paciente': f"{paciente.id_usuario.nombre} {paciente.id_usuario.apellido}",
-                    'medico': f"Dr. {medico.id_usuario.nombre} {medico.id_usuario.apellido}",
-                    'diagnostico': tratamiento.diagnostico,
-                    'fecha_emision': tratamiento.fecha_inicio,
-                    'fecha_vencimiento': tratamiento.fecha_fin,
-                    'medicamentos': medicamentos_creados
-                }
-            }, status=status.HTTP_201_CREATED)
-            
-        except Medico.DoesNotExist:
-            return Response(
-                {'error': 'El médico especificado no existe'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        except Paciente.DoesNotExist:
-            return Response(
-                {'error': 'El paciente especificado no existe'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        except Medicamento.DoesNotExist:
-            return Response(
-                {'error': 'Uno o más medicamentos no existen'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            tratamientos = crear_recetas(serializer.validated_data if lote else [serializer.validated_data])
         except Exception as e:
             return Response(
                 {'error': f'Error al crear la receta: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        
+        if lote:
+            return Response({
+                'mensaje': f'{len(tratamientos)} recetas médicas creadas exitosamente',
+                'data': [receta_a_dict(t) for t in tratamientos]
+            }, status=status.HTTP_201_CREATED)
+        return Response({
+            'mensaje': 'Receta médica creada exitosamente',
+            'data': receta_a_dict(tratamientos[0])
+        }, status=status.HTTP_201_CREATED)
 
 
 class ListarRecetasAPIView(APIView):
@@ -1073,51 +1367,225 @@ class ListarRecetasAPIView(APIView):
     Lista recetas médicas por paciente o médico
     GET /api/receta/listar/?paciente_id=1
     GET /api/receta/listar/?medico_id=1
+    GET /api/receta/listar/?medico_id=1&limite=20&cursor=340
+    GET /api/receta/listar/?medico_id=1&incluir_medicamentos=true
+    
+    El conteo de medicamentos sale de un COUNT agregado y los nombres de paciente y
+    médico del mismo JOIN; con `incluir_medicamentos=true` las líneas de la receta se
+    traen en una sola consulta adicional.
     """
     def get(self, request):
         paciente_id = request.query_params.get('paciente_id')
         medico_id = request.query_params.get('medico_id')
+        incluir_medicamentos = request.query_params.get('incluir_medicamentos', 'false').lower() == 'true'
         
-        try:
-            if paciente_id:
-                tratamientos = Tratamiento.objects.filter(
-                    id_paciente_id=paciente_id,
-                    tipo_tratamiento='Receta Médica'
-                )
-            elif medico_id:
-                tratamientos = Tratamiento.objects.filter(
-                    id_medico_id=medico_id,
-                    tipo_tratamiento='Receta Médica'
-                )
-            else:
-                tratamientos = Tratamiento.objects.filter(
-                    tipo_tratamiento='Receta Médica'
+        tratamientos = Tratamiento.objects.con_relaciones().filter(
+            tipo_tratamiento='Receta Médica'
+        ).annotate(
+            medicamentos_count=Count('tratamientomedicamento')
+        )
+        if paciente_id:
+            tratamientos = tratamientos.filter(id_paciente_id=paciente_id)
+        elif medico_id:
+            tratamientos = tratamientos.filter(id_medico_id=medico_id)
+        
+        if incluir_medicamentos:
+            tratamientos = tratamientos.prefetch_related(
+                Prefetch(
+                    'tratamientomedicamento_set',
+                    queryset=TratamientoMedicamento.objects.select_related('id_medicamento'),
+                    to_attr='lineas_receta'
                 )
-            
+            )
+        
+        paginador = PaginacionCursorPK()
+        pagina = paginador.paginate_queryset(tratamientos, request, view=self)
+        if pagina is not None:
+            tratamientos = pagina
+        
+        try:
             recetas = []
             for tratamiento in tratamientos:
-                medicamentos = TratamientoMedicamento.objects.filter(
-                    id_tratamiento=tratamiento
-                )
-                
-                recetas.append({
+                usuario_paciente = tratamiento.id_paciente.id_usuario
+                usuario_medico = tratamiento.id_medico.id_usuario
+                receta = {
                     'id_tratamiento': tratamiento.id_tratamiento,
-                    'paciente': f"{tratamiento.id_paciente.id_usuario.nombre} {tratamiento.id_paciente.id_usuario.apellido}",
-                    'medico': f"Dr. {tratamiento.id_medico.id_usuario.nombre} {tratamiento.id_medico.id_usuario.apellido}",
+                    'paciente': f"{usuario_paciente.nombre} {usuario_paciente.apellido}",
+                    'medico': f"Dr. {usuario_medico.nombre} {usuario_medico.apellido}",
                     'diagnostico': tratamiento.diagnostico,
                     'fecha_emision': tratamiento.fecha_inicio,
                     'fecha_vencimiento': tratamiento.fecha_fin,
                     'estado': tratamiento.estado,
-                    'medicamentos_count': medicamentos.count()
-                })
+                    'medicamentos_count': tratamiento.medicamentos_count
+                }
+                if incluir_medicamentos:
+                    receta['medicamentos'] = [
+                        {
+                            'id_tratamiento_medicamento': linea.id_tratamiento_medicamento,
+                            'id_medicamento': linea.id_medicamento_id,
+                            'medicamento': linea.id_medicamento.nombre_comercial,
+                            'dosis': linea.dosis,
+                            'frecuencia': linea.frecuencia,
+                            'via_administracion': linea.via_administracion,
+                            'duracion_dias': linea.duracion_dias,
+                            'horarios': linea.horarios,
+                            'instrucciones_especiales': linea.instrucciones_especiales,
+                            'activo': linea.activo
+                        }
+                        for linea in tratamiento.lineas_receta
+                    ]
+                recetas.append(receta)
             
-            return Response({
+            respuesta = {
                 'mensaje': f'{len(recetas)} receta(s) encontrada(s)',
                 'data': recetas
-            }, status=status.HTTP_200_OK)
+            }
+            if pagina is None:
+                return Response(respuesta, status=status.HTTP_200_OK)
+            
+            respuesta['siguiente_cursor'] = paginador.siguiente_cursor
+            return Response(respuesta, status=status.HTTP_200_OK, headers=paginador.get_encabezados())
             
         except Exception as e:
             return Response(
                 {'error': f'Error al listar recetas: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+
+# ==================== HISTORIAL DEL PACIENTE ====================
+
+class HistorialPacienteAPIView(APIView):
+    """
+    Línea de tiempo de un paciente: tratamientos con sus medicamentos y períodos de
+    adherencia, y las notificaciones recibidas, en un número fijo de consultas.
+    GET /api/paciente/historial/1/
+    GET /api/paciente/historial/1/?desde=2025-01-01&hasta=2025-06-30
+    GET /api/paciente/historial/1/?stream=true  (mismo JSON, enviado por partes)
+    """
+    def get(self, request, paciente_id):
+        paciente = get_object_or_404(Paciente.objects.select_related('id_usuario'), id_paciente=paciente_id)
+        
+        rango = {}
+        for parametro in ('desde', 'hasta'):
+            valor = request.query_params.get(parametro)
+            if valor:
+                try:
+                    rango[parametro] = date.fromisoformat(valor)
+                except ValueError:
+                    return Response({'error': f"El parámetro '{parametro}' debe tener formato AAAA-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if request.query_params.get('stream', 'false').lower() == 'true':
+            return respuesta_en_flujo(request, historial_stream(paciente, **rango), content_type='application/json')
+        return Response(historial(paciente, **rango), status=status.HTTP_200_OK)
+
+
+# ==================== EXPORTACIÓN ====================
+
+class ExportarDatosAPIView(APIView):
+    """
+    Extracto de una tabla en CSV o JSON Lines, enviado fila por fila (ver appweb/exportacion.py)
+    GET /api/exportar/pacientes/?formato=csv
+    GET /api/exportar/adherencia/?formato=jsonl&desde=2025-06-01T00:00:00Z
+    
+    Tablas: pacientes, tratamientos, tratamiento_medicamentos, adherencia. Se exportan
+    las filas con marca de agua (fecha de creación / cálculo) en (desde, hasta]; `hasta`
+    es por defecto el momento de la petición y vuelve en la cabecera X-Marca-Agua,
+    para usarlo como `desde` en la siguiente exportación incremental.
+    """
+    def get(self, request, tabla):
+        if tabla not in exportacion.EXPORTACIONES:
+            return Response({'error': f"Tabla no exportable. Use: {', '.join(exportacion.EXPORTACIONES)}"}, status=status.HTTP_404_NOT_FOUND)
+        formato = request.query_params.get('formato', 'csv')
+        if formato not in exportacion.FORMATOS:
+            return Response({'error': f"Formato no soportado. Use: {', '.join(exportacion.FORMATOS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        rango = {'desde': None, 'hasta': timezone.now()}
+        for parametro in rango:
+            valor = request.query_params.get(parametro)
+            if valor:
+                try:
+                    rango[parametro] = exportacion.parse_marca(valor)
+                except ValueError:
+                    return Response({'error': f"El parámetro '{parametro}' debe ser una fecha u hora ISO 8601"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = respuesta_en_flujo(
+            request, exportacion.exportar(tabla, formato, **rango),
+            content_type='text/csv; charset=utf-8' if formato == 'csv' else 'application/x-ndjson'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{tabla}.{formato}"'
+        response['X-Marca-Agua'] = rango['hasta'].isoformat()
+        return response
+
+
+# ==================== NOTIFICACIONES EN TIEMPO REAL ====================
+
+def _evento_sse(evento, datos, id_evento=None):
+    lineas = [f'event: {evento}']
+    if id_evento is not None:
+        lineas.append(f'id: {id_evento}')
+    lineas.append(f'data: {json.dumps(datos)}')
+    return ('\n'.join(lineas) + '\n\n').encode('utf-8')
+
+
+def _notificaciones_posteriores(usuario_id, ultimo_id):
+    return [
+        mensaje_notificacion(n)
+        for n in Notificacion.objects.filter(
+            id_usuario_destino=usuario_id,
+            id_notificacion__gt=ultimo_id,
+            estado__in=Notificacion.ESTADOS_NO_LEIDAS
+        ).order_by('id_notificacion')[:100]
+    ]
+
+
+async def stream_notificaciones(request):
+    """
+    Server-Sent Events con las notificaciones nuevas del usuario de la sesión
+    GET /api/notificaciones/stream/  (cabecera Authorization: Token <token>)
+    GET /api/notificaciones/stream/?token=<token>  (EventSource no envía cabeceras)
+    
+    Envía primero el contador de no leídas ('contador') y luego cada notificación
+    nueva ('notificacion', con su id como id del evento). Al reconectar, el
+    navegador manda Last-Event-ID y se reenvían las notificaciones posteriores.
+    Debe servirse con basedb.asgi.application.
+    """
+    sesion = await sync_to_async(sesiones.validar)(token_de_request(request) or request.GET.get('token'))
+    if sesion is None:
+        return JsonResponse({'error': 'Sesión inválida o expirada'}, status=401)
+    usuario_id = sesion['usuario']['id_usuario']
+    
+    try:
+        ultimo_id = int(request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        ultimo_id = 0
+    heartbeat = getattr(settings, 'NOTIFICACIONES_STREAM_HEARTBEAT', 15)
+    duracion = getattr(settings, 'NOTIFICACIONES_STREAM_DURACION', 300)
+    
+    async def eventos():
+        # Suscribirse antes de leer la base, para no perder lo que llegue entre medio
+        async with obtener_broker().suscribir(canal_usuario(usuario_id)) as suscripcion:
+            yield b'retry: 5000\n\n'
+            no_leidas = await sync_to_async(contadores.no_leidas)(usuario_id)
+            yield _evento_sse('contador', {'no_leidas': no_leidas})
+            
+            enviados = set()
+            if ultimo_id:
+                for mensaje in await sync_to_async(_notificaciones_posteriores)(usuario_id, ultimo_id):
+                    enviados.add(mensaje['id_notificacion'])
+                    yield _evento_sse('notificacion', mensaje, mensaje['id_notificacion'])
+            
+            # La conexión se cierra al cumplir su duración y el navegador reconecta solo;
+            # así ninguna suscripción queda viva si el servidor no detecta la desconexión
+            fin = time.monotonic() + duracion
+            while (restante := fin - time.monotonic()) > 0:
+                mensaje = await suscripcion.recibir(min(heartbeat, restante))
+                if mensaje is None:
+                    yield b': ping\n\n'
+                elif mensaje['id_notificacion'] not in enviados:
+                    yield _evento_sse('notificacion', mensaje, mensaje['id_notificacion'])
+    
+    response = StreamingHttpResponse(eventos(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,313 @@
+"""
+Registro de tomas y cálculo de adherencia.
+
+Los pacientes (y los cuidadores con `puede_registrar_tomas`) registran cada toma en
+REGISTRO_TOMAS, que solo recibe inserciones. `agregar_registros()` procesa los
+registros nuevos desde la última marca de agua guardada en PROGRESO_PROCESOS y
+recalcula solo las semanas de HistorialAdherencia que esos registros tocan, sin
+volver a leer el historial completo. Cuando la clasificación de un período baja,
+se crean notificaciones `adherencia_baja` para el paciente y su médico.
+
+`recalcular_bloque()` reconstruye todos los resúmenes de un rango de pacientes
+(manage.py recalcular_adherencia). Ambos caminos cuentan desde los registros, de
+modo que escribir el mismo período dos veces da el mismo resultado.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from . import contadores
+from .eventos import publicar_notificaciones
+from .models import (
+    HistorialAdherencia, Notificacion, PacienteCuidador, ProgresoProceso,
+    RegistroToma, TomaProgramada, Tratamiento
+)
+
+CLAVE_MARCA = 'adherencia_incremental'
+
+# Porcentaje mínimo de cada clasificación
+UMBRAL_ALTA = 80
+UMBRAL_MEDIA = 50
+
+NIVELES = {'baja': 0, 'media': 1, 'alta': 2}
+
+CAMPOS_RESUMEN = [
+    'id_paciente', 'fecha_fin_periodo', 'tomas_programadas', 'tomas_realizadas', 'tomas_omitidas',
+    'tomas_tardias', 'porcentaje_adherencia', 'clasificacion_adherencia', 'fecha_calculo'
+]
+
+
+def _configuracion(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+# ==================== REGISTRO DE TOMAS ====================
+
+def puede_registrar(usuario, paciente):
+    """El propio paciente o un cuidador activo con permiso para registrar tomas"""
+    if usuario.id_usuario == paciente.id_usuario_id:
+        return True
+    return PacienteCuidador.objects.filter(
+        id_paciente=paciente,
+        id_usuario=usuario,
+        estado_relacion='activa',
+        puede_registrar_tomas=True
+    ).exists()
+
+
+def registrar_toma(toma, usuario, estado='tomada', fecha_hora_toma=None, notas=''):
+    """Crea el registro de una toma programada; `toma` debe traer su línea con select_related"""
+    if estado == 'tomada':
+        fecha_hora_toma = fecha_hora_toma or timezone.now()
+    else:
+        fecha_hora_toma = None
+
+    tolerancia = timedelta(minutes=_configuracion('ADHERENCIA_TOLERANCIA_MINUTOS', 60))
+    # Savepoint propio: si la toma ya tenía registro, el IntegrityError no rompe la transacción exterior
+    with transaction.atomic():
+        return RegistroToma.objects.create(
+            id_toma=toma,
+            id_paciente_id=toma.id_paciente_id,
+            id_tratamiento_id=toma.id_tratamiento_medicamento.id_tratamiento_id,
+            id_tratamiento_medicamento_id=toma.id_tratamiento_medicamento_id,
+            registrado_por=usuario,
+            estado=estado,
+            fecha_hora_programada=toma.fecha_hora,
+            fecha_hora_toma=fecha_hora_toma,
+            tardia=fecha_hora_toma is not None and fecha_hora_toma > toma.fecha_hora + tolerancia,
+            notas=notas,
+        )
+
+
+# ==================== RESÚMENES ====================
+
+def inicio_periodo(fecha_hora):
+    """Lunes de la semana (en la zona horaria local) de una fecha y hora"""
+    dia = timezone.localtime(fecha_hora).date()
+    return dia - timedelta(days=dia.weekday())
+
+
+def clasificar(porcentaje):
+    if porcentaje >= UMBRAL_ALTA:
+        return 'alta'
+    if porcentaje >= UMBRAL_MEDIA:
+        return 'media'
+    return 'baja'
+
+
+def aplicar_resumen(historial, programadas, realizadas, tardias, ahora):
+    """Completa los contadores, el porcentaje y la clasificación de un período"""
+    programadas = max(programadas, realizadas)
+    porcentaje = Decimal(100) if not programadas else min(
+        Decimal(100), (Decimal(realizadas) * 100 / programadas).quantize(Decimal('0.01'))
+    )
+    historial.fecha_fin_periodo = historial.fecha_inicio_periodo + timedelta(days=6)
+    historial.tomas_programadas = programadas
+    historial.tomas_realizadas = realizadas
+    historial.tomas_tardias = tardias
+    historial.tomas_omitidas = programadas - realizadas
+    historial.porcentaje_adherencia = porcentaje
+    historial.clasificacion_adherencia = clasificar(porcentaje)
+    historial.fecha_calculo = ahora
+
+
+def bajo_la_clasificacion(anterior, nueva):
+    if anterior is None:
+        return nueva == 'baja'
+    return NIVELES[nueva] < NIVELES[anterior]
+
+
+def contar_por_periodo(tomas, registros):
+    """
+    {(id_paciente, id_tratamiento, lunes): [programadas, realizadas, tardías]} a partir
+    de un queryset de TomaProgramada (ya vencidas) y otro de RegistroToma, con un
+    GROUP BY por semana en cada uno.
+    """
+    conteos = {}
+    filas_tomas = tomas.annotate(periodo=TruncWeek('fecha_hora')).values(
+        'id_paciente', 'id_tratamiento_medicamento__id_tratamiento', 'periodo'
+    ).annotate(total=Count('id_toma')).order_by()
+    for fila in filas_tomas:
+        clave = (fila['id_paciente'], fila['id_tratamiento_medicamento__id_tratamiento'], fila['periodo'].date())
+        conteos.setdefault(clave, [0, 0, 0])[0] = fila['total']
+
+    filas_registros = registros.filter(estado='tomada').annotate(
+        periodo=TruncWeek('fecha_hora_programada')
+    ).values('id_paciente', 'id_tratamiento', 'periodo').annotate(
+        realizadas=Count('id_registro'),
+        tardias=Count('id_registro', filter=Q(tardia=True)),
+    ).order_by()
+    for fila in filas_registros:
+        conteo = conteos.setdefault((fila['id_paciente'], fila['id_tratamiento'], fila['periodo'].date()), [0, 0, 0])
+        conteo[1] = fila['realizadas']
+        conteo[2] = fila['tardias']
+    return conteos
+
+
+def construir_resumenes(conteos, ahora):
+    resumenes = []
+    for (id_paciente, id_tratamiento, periodo), (programadas, realizadas, tardias) in conteos.items():
+        historial = HistorialAdherencia(
+            id_paciente_id=id_paciente,
+            id_tratamiento_id=id_tratamiento,
+            fecha_inicio_periodo=periodo,
+        )
+        aplicar_resumen(historial, programadas, realizadas, tardias, ahora)
+        resumenes.append(historial)
+    return resumenes
+
+
+def guardar_resumenes(resumenes):
+    """INSERT ... ON CONFLICT (id_tratamiento, fecha_inicio_periodo) DO UPDATE en lotes"""
+    HistorialAdherencia.objects.bulk_create(
+        resumenes,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['id_tratamiento', 'fecha_inicio_periodo'],
+        update_fields=CAMPOS_RESUMEN,
+    )
+
+
+def crear_alertas_adherencia(bajas, ahora):
+    """Una notificación `adherencia_baja` para el paciente y otra para el médico por cada período"""
+    if not bajas:
+        return 0
+
+    usuarios = {
+        id_tratamiento: (id_usuario_paciente, id_usuario_medico)
+        for id_tratamiento, id_usuario_paciente, id_usuario_medico in Tratamiento.objects.filter(
+            pk__in={h.id_tratamiento_id for h, _ in bajas}
+        ).values_list('id_tratamiento', 'id_paciente__id_usuario', 'id_medico__id_usuario')
+    }
+
+    notificaciones = []
+    for historial, anterior in bajas:
+        for id_usuario in usuarios.get(historial.id_tratamiento_id, ()):
+            notificaciones.append(Notificacion(
+                id_usuario_destino_id=id_usuario,
+                tipo_notificacion='adherencia_baja',
+                titulo='Adherencia en descenso',
+                mensaje=(
+                    f'La adherencia del tratamiento #{historial.id_tratamiento_id} en la semana del '
+                    f'{historial.fecha_inicio_periodo:%d/%m/%Y} es {historial.clasificacion_adherencia} '
+                    f'({historial.porcentaje_adherencia}%).'
+                ),
+                prioridad='alta',
+                notificar_cuidador=True,
+                fecha_creacion=ahora,
+                datos_adicionales={
+                    'id_tratamiento': historial.id_tratamiento_id,
+                    'fecha_inicio_periodo': historial.fecha_inicio_periodo.isoformat(),
+                    'porcentaje_adherencia': str(historial.porcentaje_adherencia),
+                    'clasificacion_anterior': anterior,
+                },
+            ))
+    Notificacion.objects.bulk_create(notificaciones)
+    contadores.registrar_creadas(notificaciones)
+    publicar_notificaciones(notificaciones)
+    return len(notificaciones)
+
+
+def agregar_registros(tamano_lote=1000):
+    """
+    Aplica a HistorialAdherencia los registros de tomas posteriores a la marca de
+    agua. El lote se corta en el primer registro de los últimos
+    ADHERENCIA_MARGEN_SEGUNDOS: la marca de agua queda justo antes de él, por si una
+    transacción con un id menor aún no terminó, y se retoma en la siguiente pasada.
+    """
+    ahora = timezone.now()
+    limite = ahora - timedelta(seconds=_configuracion('ADHERENCIA_MARGEN_SEGUNDOS', 5))
+    resumen = {'registros': 0, 'periodos': 0, 'alertas': 0}
+
+    with transaction.atomic():
+        marca, _ = ProgresoProceso.objects.select_for_update().get_or_create(nombre=CLAVE_MARCA)
+        registros = list(
+            RegistroToma.objects.filter(id_registro__gt=marca.posicion).order_by('id_registro').values(
+                'id_registro', 'id_paciente', 'id_tratamiento', 'fecha_hora_programada', 'estado', 'tardia',
+                'fecha_creacion'
+            )[:tamano_lote]
+        )
+        # Filtrar por fecha saltaría para siempre un id menor creado dentro del margen
+        for posicion, registro in enumerate(registros):
+            if registro['fecha_creacion'] > limite:
+                registros = registros[:posicion]
+                break
+        if not registros:
+            return resumen
+
+        # Solo se recalculan las semanas que tocan los registros nuevos
+        tocados = {
+            (r['id_paciente'], r['id_tratamiento'], inicio_periodo(r['fecha_hora_programada']))
+            for r in registros
+        }
+        tratamientos = {id_tratamiento for _, id_tratamiento, _ in tocados}
+        periodos = {periodo for _, _, periodo in tocados}
+        zona = timezone.get_current_timezone()
+        desde = timezone.make_aware(datetime.combine(min(periodos), time.min), zona)
+        hasta = timezone.make_aware(datetime.combine(max(periodos) + timedelta(days=7), time.min), zona)
+
+        conteos = contar_por_periodo(
+            TomaProgramada.objects.filter(
+                id_tratamiento_medicamento__id_tratamiento__in=tratamientos,
+                fecha_hora__gte=desde, fecha_hora__lt=hasta, fecha_hora__lte=ahora,
+            ),
+            RegistroToma.objects.filter(
+                id_tratamiento__in=tratamientos,
+                fecha_hora_programada__gte=desde, fecha_hora_programada__lt=hasta,
+            ),
+        )
+        resumenes = construir_resumenes(
+            {clave: conteos.get(clave, [0, 0, 0]) for clave in tocados}, ahora
+        )
+
+        anteriores = dict(
+            ((id_tratamiento, periodo), clasificacion)
+            for id_tratamiento, periodo, clasificacion in HistorialAdherencia.objects.select_for_update().filter(
+                id_tratamiento__in=tratamientos, fecha_inicio_periodo__in=periodos
+            ).values_list('id_tratamiento', 'fecha_inicio_periodo', 'clasificacion_adherencia')
+        )
+        bajas = []
+        for historial in resumenes:
+            anterior = anteriores.get((historial.id_tratamiento_id, historial.fecha_inicio_periodo))
+            if bajo_la_clasificacion(anterior, historial.clasificacion_adherencia):
+                bajas.append((historial, anterior))
+
+        guardar_resumenes(resumenes)
+        resumen['alertas'] = crear_alertas_adherencia(bajas, ahora)
+
+        marca.posicion = registros[-1]['id_registro']
+        marca.save()
+
+    resumen['registros'] = len(registros)
+    resumen['periodos'] = len(resumenes)
+    return resumen
+
+
+# ==================== RECÁLCULO COMPLETO ====================
+
+def recalcular_bloque(desde_id, hasta_id, ahora=None):
+    """
+    Reconstruye los resúmenes de los tratamientos activos de los pacientes con id en
+    [desde_id, hasta_id). Devuelve la cantidad de filas escritas.
+    """
+    ahora = ahora or timezone.now()
+    conteos = contar_por_periodo(
+        TomaProgramada.objects.filter(
+            id_paciente__gte=desde_id, id_paciente__lt=hasta_id,
+            id_tratamiento_medicamento__id_tratamiento__estado='activo',
+            fecha_hora__lte=ahora,
+        ),
+        RegistroToma.objects.filter(
+            id_paciente__gte=desde_id, id_paciente__lt=hasta_id,
+            id_tratamiento__estado='activo',
+        ),
+    )
+    resumenes = construir_resumenes(conteos, ahora)
+    with transaction.atomic():
+        guardar_resumenes(resumenes)
+    return len(resumenes)
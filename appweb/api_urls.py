@@ -12,9 +12,13 @@ router.register(r'tratamientos', APIviews.TratamientoViewSet, basename='tratamie
 router.register(r'tratamiento-medicamentos', APIviews.TratamientoMedicamentoViewSet, basename='tratamiento-medicamento')
 router.register(r'notificaciones', APIviews.NotificacionViewSet, basename='notificacion')
 router.register(r'historial-adherencia', APIviews.HistorialAdherenciaViewSet, basename='historial-adherencia')
+router.register(r'tomas-programadas', APIviews.TomaProgramadaViewSet, basename='toma-programada')
 router.register(r'paciente-cuidador', APIviews.PacienteCuidadorViewSet, basename='paciente-cuidador')
 
 urlpatterns = [
+    # --- Notificaciones en tiempo real (SSE, antes del router para no chocar con notificaciones/<pk>/) ---
+    path('notificaciones/stream/', APIviews.stream_notificaciones, name='stream-notificaciones'),
+    
     # --- ViewSets (Router de Django REST Framework) ---
     path('', include(router.urls)),
     
@@ -27,23 +31,34 @@ urlpatterns = [
     
     # --- APIs de Médicos (CRUD) ---
     path('medico/crear/', APIviews.CrearMedicoAPIView.as_view(), name='api-crear-medico'),
+    path('medico/importar/', APIviews.ImportarUsuariosAPIView.as_view(tipo='medico'), name='api-importar-medicos'),
     path('medico/listar/', APIviews.ListarMedicosAPIView.as_view(), name='api-listar-medicos'),
     path('medico/editar/<int:medico_id>/', APIviews.EditarMedicoAPIView.as_view(), name='api-editar-medico'),
     path('medico/eliminar/<int:medico_id>/', APIviews.EliminarMedicoAPIView.as_view(), name='api-eliminar-medico'),
     
     # --- APIs de Pacientes (CRUD) ---
     path('paciente/crear/', APIviews.CrearPacienteAPIView.as_view(), name='api-crear-paciente'),
+    path('paciente/importar/', APIviews.ImportarUsuariosAPIView.as_view(tipo='paciente'), name='api-importar-pacientes'),
     path('paciente/listar/', APIviews.ListarPacientesAPIView.as_view(), name='api-listar-pacientes'),
     path('paciente/buscar/', APIviews.BuscarPacientesAPIView.as_view(), name='api-buscar-pacientes'),
     path('paciente/editar/<int:paciente_id>/', APIviews.EditarPacienteAPIView.as_view(), name='api-editar-paciente'),
     path('paciente/eliminar/<int:paciente_id>/', APIviews.EliminarPacienteAPIView.as_view(), name='api-eliminar-paciente'),
+    path('paciente/historial/<int:paciente_id>/', APIviews.HistorialPacienteAPIView.as_view(), name='api-historial-paciente'),
     
     # --- APIs de Recetas Médicas ---
     path('receta/crear/', APIviews.CrearRecetaAPIView.as_view(), name='api-crear-receta'),
     path('receta/listar/', APIviews.ListarRecetasAPIView.as_view(), name='api-listar-recetas'),
     
+    # --- Dashboards (conteos agregados) ---
+    path('dashboard/admin/', APIviews.DashboardAdminAPIView.as_view(), name='api-dashboard-admin'),
+    path('dashboard/medico/<int:medico_id>/', APIviews.DashboardMedicoAPIView.as_view(), name='api-dashboard-medico'),
+    
+    # --- Exportación (CSV / JSON Lines por streaming) ---
+    path('exportar/<str:tabla>/', APIviews.ExportarDatosAPIView.as_view(), name='api-exportar'),
+    
     #  OPENFDA 
     path('medicamento/buscar-fda/', APIviews.buscar_medicamento_fda, name='buscar-medicamento-fda'),
     path('medicamento/verificar-interacciones/', APIviews.verificar_interacciones_fda, name='verificar-interacciones-fda'),
     path('medicamento/efectos-adversos/', APIviews.efectos_adversos_fda, name='efectos-adversos-fda'),
+    path('medicamento/matriz-interacciones/', APIviews.matriz_interacciones_fda, name='matriz-interacciones-fda'),
 ]
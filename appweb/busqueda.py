@@ -0,0 +1,228 @@
+"""
+Búsqueda por prefijo y trigramas.
+
+En PostgreSQL con la extensión pg_trgm se usa `similarity()` sobre los índices GIN
+que crea `manage.py crear_indices_busqueda`. En otros motores se usa un índice de
+trigramas en memoria, reconstruido cuando cambia la versión del catálogo.
+"""
+import threading
+import time
+import unicodedata
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import BooleanField, Case, Func, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Medicamento, Paciente
+
+# Similitud mínima (0-1) del índice en memoria; en PostgreSQL rige pg_trgm.similarity_threshold
+UMBRAL_SIMILITUD = 0.2
+
+
+def normalizar_texto(texto):
+    """Minúsculas, sin acentos y con los espacios colapsados"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+def trigramas(texto):
+    """Trigramas de cada palabra, con el mismo relleno que usa pg_trgm"""
+    resultado = set()
+    for palabra in normalizar_texto(texto).split():
+        palabra = f'  {palabra} '
+        resultado.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return resultado
+
+
+_pg_trgm = None
+
+
+def pg_trgm_disponible():
+    global _pg_trgm
+    if connection.vendor != 'postgresql':
+        return False
+    if _pg_trgm is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _pg_trgm = cursor.fetchone() is not None
+    return _pg_trgm
+
+
+class SimilarPorTrigramas(Func):
+    """
+    `campo % consulta` de pg_trgm, que sí aprovecha el índice GIN gin_trgm_ops
+    (a diferencia de filtrar por similarity() >= umbral).
+    """
+    arg_joiner = ' %% '
+    template = '(%(expressions)s)'
+    output_field = BooleanField()
+
+
+class IndiceTrigramas:
+    """Índice invertido trigrama -> ids, sobre uno o varios textos por documento"""
+
+    def __init__(self, documentos):
+        self.textos = {}
+        self.trigramas = {}
+        self.listas = {}
+        for id_documento, textos in documentos:
+            textos = [normalizar_texto(t) for t in textos if t]
+            self.textos[id_documento] = textos
+            trigramas_documento = [trigramas(t) for t in textos]
+            self.trigramas[id_documento] = trigramas_documento
+            for trigrama in set().union(*trigramas_documento):
+                self.listas.setdefault(trigrama, []).append(id_documento)
+
+    def buscar(self, consulta, limite):
+        """Ids ordenados: primero coincidencias por prefijo, luego por similitud"""
+        consulta = normalizar_texto(consulta)
+        trigramas_consulta = trigramas(consulta)
+        if not trigramas_consulta:
+            return []
+
+        candidatos = set()
+        for trigrama in trigramas_consulta:
+            candidatos.update(self.listas.get(trigrama, ()))
+
+        puntajes = []
+        for id_documento in candidatos:
+            # Prefijo de cualquier palabra del texto
+            prefijo = any(f' {consulta}' in f' {texto}' for texto in self.textos[id_documento])
+            similitud = max(
+                len(trigramas_consulta & t) / len(trigramas_consulta | t)
+                for t in self.trigramas[id_documento]
+            )
+            if prefijo or similitud >= UMBRAL_SIMILITUD:
+                puntajes.append((not prefijo, -similitud, id_documento))
+
+        puntajes.sort()
+        return [id_documento for _, _, id_documento in puntajes[:limite]]
+
+
+# ==================== CATÁLOGO DE MEDICAMENTOS ====================
+
+CLAVE_VERSION_CATALOGO = 'medicamentos:catalogo:version'
+
+CAMPOS_BUSQUEDA_MEDICAMENTO = {
+    'nombre': ('nombre_comercial', 'nombre_generico'),
+    'laboratorio': ('laboratorio',),
+}
+
+_indices_medicamentos = {}
+_indices_lock = threading.Lock()
+
+
+def _version_inicial():
+    # Si la clave sale de la caché, la versión no vuelve a un valor ya usado
+    return time.time_ns()
+
+
+def version_catalogo():
+    return cache.get_or_set(CLAVE_VERSION_CATALOGO, _version_inicial, None)
+
+
+def invalidar_catalogo():
+    """Marca como obsoletos los índices en memoria y las respuestas en caché de todos los procesos"""
+    cache.add(CLAVE_VERSION_CATALOGO, _version_inicial(), None)
+    try:
+        cache.incr(CLAVE_VERSION_CATALOGO)
+    except ValueError:
+        cache.set(CLAVE_VERSION_CATALOGO, _version_inicial(), None)
+
+
+def catalogo_modificado():
+    """
+    Invalida ahora y otra vez al confirmar la transacción: una lectura concurrente
+    no puede quedar guardada bajo la versión nueva con datos todavía sin confirmar.
+    """
+    invalidar_catalogo()
+    transaction.on_commit(invalidar_catalogo)
+
+
+def _indice_medicamentos(criterio):
+    version = version_catalogo()
+    with _indices_lock:
+        guardado = _indices_medicamentos.get(criterio)
+        if guardado is not None and guardado[0] == version:
+            return guardado[1]
+
+    campos = CAMPOS_BUSQUEDA_MEDICAMENTO[criterio]
+    filas = Medicamento.objects.values_list('id_medicamento', *campos)
+    indice = IndiceTrigramas((fila[0], fila[1:]) for fila in filas.iterator(chunk_size=2000))
+    with _indices_lock:
+        _indices_medicamentos[criterio] = (version, indice)
+    return indice
+
+
+def _buscar_medicamentos_pg(consulta, campos, limite):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    similitudes = [TrigramSimilarity(campo, consulta) for campo in campos]
+    prefijo = Q()
+    similar = Q()
+    alias = {}
+    for campo in campos:
+        prefijo |= Q(**{f'{campo}__istartswith': consulta})
+        alias[f'{campo}_similar'] = SimilarPorTrigramas(campo, Value(consulta))
+        similar |= Q(**{f'{campo}_similar': True})
+
+    return list(
+        Medicamento.objects.alias(**alias).filter(prefijo | similar).annotate(
+            similitud=Greatest(*similitudes) if len(similitudes) > 1 else similitudes[0],
+            es_prefijo=Case(When(prefijo, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        ).order_by('-es_prefijo', '-similitud', 'nombre_comercial')[:limite]
+    )
+
+
+def buscar_medicamentos(consulta, criterio='nombre', limite=20):
+    """
+    Medicamentos que coinciden con `consulta`, ordenados por relevancia.
+    `criterio` es 'nombre' (comercial o genérico) o 'laboratorio'.
+    """
+    campos = CAMPOS_BUSQUEDA_MEDICAMENTO[criterio]
+    if pg_trgm_disponible():
+        return _buscar_medicamentos_pg(consulta, campos, limite)
+
+    ids = _indice_medicamentos(criterio).buscar(consulta, limite)
+    medicamentos = Medicamento.objects.in_bulk(ids)
+    return [medicamentos[i] for i in ids if i in medicamentos]
+
+
+# ==================== PACIENTES ====================
+
+def buscar_pacientes(consulta, limite=20):
+    """
+    Pacientes cuyo nombre, apellido o identificación contienen todas las palabras
+    de `consulta`, sin distinguir acentos ni mayúsculas (José = jose).
+    Orden: identificación exacta, luego prefijo de palabra, luego similitud.
+    """
+    texto = normalizar_texto(consulta)
+    palabras = texto.split()
+    if not palabras:
+        return []
+
+    pacientes = Paciente.objects.select_related('id_usuario').filter(id_usuario__tipo_usuario='paciente')
+    for palabra in palabras:
+        # LIKE '%palabra%' sobre la columna normalizada (índice GIN de trigramas en PostgreSQL)
+        pacientes = pacientes.filter(texto_busqueda__contains=palabra)
+
+    pacientes = pacientes.annotate(
+        relevancia=Case(
+            When(numero_identificacion__iexact=consulta.strip(), then=Value(2)),
+            When(Q(texto_busqueda__startswith=texto) | Q(texto_busqueda__contains=f' {texto}'), then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+    if pg_trgm_disponible():
+        from django.contrib.postgres.search import TrigramSimilarity
+        pacientes = pacientes.annotate(
+            similitud=TrigramSimilarity('texto_busqueda', texto)
+        ).order_by('-relevancia', '-similitud', 'id_paciente')
+    else:
+        pacientes = pacientes.order_by('-relevancia', 'id_paciente')
+
+    return list(pacientes[:limite])
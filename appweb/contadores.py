@@ -0,0 +1,106 @@
+"""
+Contador de notificaciones no leídas por usuario (CONTADORES_NOTIFICACIONES).
+
+El contador se ajusta con `UPDATE ... SET no_leidas = no_leidas + n`. Los cambios
+de estado (marcar_como_leida / marcar_como_enviada y sus versiones en bloque del
+QuerySet) son UPDATE condicionados al estado anterior y ajustan el contador en el
+mismo atomic(), según las filas que realmente cambiaron. Las altas, bajas y los
+save() directos se ajustan desde las señales, en una consulta aparte que solo
+comparte transacción si quien guarda abrió una. Si un usuario todavía no tiene
+fila, no se ajusta nada: la fila se crea al leerla, con un COUNT sobre el índice
+(id_usuario_destino, estado). `reconstruir()` corrige cualquier desviación.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import ContadorNotificaciones, Notificacion, Usuario
+
+NO_LEIDAS = Notificacion.ESTADOS_NO_LEIDAS
+
+
+def reconstruir(usuario_ids=None):
+    """Recalcula los contadores de `usuario_ids` (o de todos) desde la tabla de notificaciones"""
+    notificaciones = Notificacion.objects.filter(estado__in=NO_LEIDAS)
+    if usuario_ids is not None:
+        notificaciones = notificaciones.filter(id_usuario_destino__in=usuario_ids)
+    conteos = dict(
+        notificaciones.values('id_usuario_destino').annotate(
+            total=Count('id_notificacion')
+        ).order_by().values_list('id_usuario_destino', 'total')
+    )
+
+    with transaction.atomic():
+        if usuario_ids is None:
+            ContadorNotificaciones.objects.exclude(pk__in=list(conteos)).update(no_leidas=0)
+        else:
+            existentes = Usuario.objects.filter(pk__in=usuario_ids).values_list('pk', flat=True)
+            conteos = {usuario_id: conteos.get(usuario_id, 0) for usuario_id in existentes}
+        ahora = timezone.now()
+        ContadorNotificaciones.objects.bulk_create(
+            [
+                ContadorNotificaciones(id_usuario_id=usuario_id, no_leidas=total, fecha_actualizacion=ahora)
+                for usuario_id, total in conteos.items()
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['id_usuario'],
+            update_fields=['no_leidas', 'fecha_actualizacion'],
+        )
+    return conteos
+
+
+def no_leidas(usuario_id):
+    valor = ContadorNotificaciones.objects.filter(pk=usuario_id).values_list('no_leidas', flat=True).first()
+    if valor is None:
+        valor = reconstruir([usuario_id]).get(usuario_id, 0)
+    return valor
+
+
+def ajustar(cambios):
+    """Aplica {usuario_id: diferencia} con un UPDATE por cada diferencia distinta"""
+    por_diferencia = {}
+    for usuario_id, diferencia in cambios.items():
+        if diferencia:
+            por_diferencia.setdefault(diferencia, []).append(usuario_id)
+    for diferencia, usuario_ids in por_diferencia.items():
+        ContadorNotificaciones.objects.filter(pk__in=usuario_ids).update(
+            no_leidas=F('no_leidas') + diferencia,
+            fecha_actualizacion=timezone.now()
+        )
+
+
+def invalidar(usuario_ids):
+    """Descarta los contadores; se reconstruyen en la siguiente lectura"""
+    ContadorNotificaciones.objects.filter(pk__in=usuario_ids).delete()
+
+
+def registrar_creadas(notificaciones):
+    """Suma las notificaciones no leídas creadas con bulk_create (que no emite señales)"""
+    ajustar(Counter(n.id_usuario_destino_id for n in notificaciones if n.estado in NO_LEIDAS))
+
+
+def registrar_cambio(antes, despues):
+    """
+    Ajusta por una notificación que pasó de `antes` a `despues`, ambos
+    (id_usuario_destino, estado) o None si no existía / ya no existe.
+    """
+    cambios = Counter()
+    if antes is not None and antes[1] in NO_LEIDAS:
+        cambios[antes[0]] -= 1
+    if despues is not None and despues[1] in NO_LEIDAS:
+        cambios[despues[0]] += 1
+    ajustar(cambios)
+
+
+def cambios_por_transicion(filas, nuevo_estado):
+    """
+    Diferencias por usuario al pasar a `nuevo_estado` las filas
+    (id_usuario_destino, estado_actual) indicadas.
+    """
+    cambios = Counter()
+    for usuario_id, estado in filas:
+        cambios[usuario_id] += (nuevo_estado in NO_LEIDAS) - (estado in NO_LEIDAS)
+    return cambios
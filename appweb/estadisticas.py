@@ -0,0 +1,85 @@
+"""
+Resúmenes de los dashboards de administrador y médico.
+
+Cada número sale de una consulta de agregación (COUNT / GROUP BY) en lugar de
+descargar los listados completos y contarlos en el navegador. El resultado se
+guarda en caché DASHBOARD_CACHE_TTL segundos por rol (y por médico), así que una
+carga del dashboard es una petición y, como mucho, unas pocas consultas.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q
+from django.utils import timezone
+
+from . import contadores
+from .adherencia import inicio_periodo
+from .models import HistorialAdherencia, Medico, Notificacion, Tratamiento, Usuario
+
+
+def _en_cache(clave, calcular):
+    return cache.get_or_set(clave, calcular, getattr(settings, 'DASHBOARD_CACHE_TTL', 30))
+
+
+def _conteo_por(queryset, campo):
+    return dict(queryset.values(campo).annotate(total=Count('pk')).order_by().values_list(campo, 'total'))
+
+
+def _adherencia_reciente(tratamientos):
+    """
+    Pacientes distintos con adherencia baja y adherencia promedio, sobre los resúmenes
+    de la semana actual y la anterior de los tratamientos activos. Una sola consulta.
+    """
+    desde = inicio_periodo(timezone.now()) - timedelta(days=7)
+    resultado = HistorialAdherencia.objects.filter(
+        id_tratamiento__in=tratamientos.filter(estado='activo'),
+        fecha_inicio_periodo__gte=desde,
+    ).aggregate(
+        pacientes_baja=Count('id_paciente', distinct=True, filter=Q(clasificacion_adherencia='baja')),
+        promedio=Avg('porcentaje_adherencia'),
+    )
+    promedio = resultado['promedio']
+    return resultado['pacientes_baja'], round(float(promedio), 1) if promedio is not None else None
+
+
+def resumen_admin():
+    def calcular():
+        usuarios = _conteo_por(Usuario.objects.all(), 'tipo_usuario')
+        adherencia_baja, adherencia_promedio = _adherencia_reciente(Tratamiento.objects.all())
+        return {
+            'usuarios_por_tipo': usuarios,
+            'total_usuarios': sum(usuarios.values()),
+            'tratamientos_por_estado': _conteo_por(Tratamiento.objects.all(), 'estado'),
+            'pacientes_adherencia_baja': adherencia_baja,
+            'adherencia_promedio': adherencia_promedio,
+            'notificaciones_no_leidas': Notificacion.objects.filter(
+                estado__in=Notificacion.ESTADOS_NO_LEIDAS
+            ).count(),
+            'fecha_calculo': timezone.now(),
+        }
+    return _en_cache('dashboard:admin', calcular)
+
+
+def resumen_medico(medico_id):
+    """Lanza Medico.DoesNotExist si el médico no existe"""
+    def calcular():
+        usuario_id = Medico.objects.values_list('id_usuario', flat=True).get(id_medico=medico_id)
+        tratamientos = Tratamiento.objects.filter(id_medico=medico_id)
+        por_estado = {
+            fila['estado']: fila
+            for fila in tratamientos.values('estado').annotate(
+                total=Count('pk'), pacientes=Count('id_paciente', distinct=True)
+            ).order_by()
+        }
+        adherencia_baja, adherencia_promedio = _adherencia_reciente(tratamientos)
+        return {
+            'id_medico': medico_id,
+            'tratamientos_por_estado': {estado: fila['total'] for estado, fila in por_estado.items()},
+            'pacientes_activos': por_estado.get('activo', {}).get('pacientes', 0),
+            'pacientes_adherencia_baja': adherencia_baja,
+            'adherencia_promedio': adherencia_promedio,
+            'notificaciones_no_leidas': contadores.no_leidas(usuario_id),
+            'fecha_calculo': timezone.now(),
+        }
+    return _en_cache(f'dashboard:medico:{medico_id}', calcular)
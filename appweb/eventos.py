@@ -0,0 +1,214 @@
+"""
+Publicación en tiempo real de notificaciones (Server-Sent Events).
+
+Una notificación sin fecha programada se publica en el canal `usuario:<id>` al
+crearse; una programada, cuando el despachador la entrega por el canal 'app'. La vista
+`stream_notificaciones` mantiene abierta una respuesta SSE por cliente: cada
+conexión es una corrutina con una cola pequeña, sin hilo propio, por lo que debe
+servirse con un servidor ASGI (el Procfile usa basedb.asgi con workers de uvicorn).
+
+El broker se elige con NOTIFICACIONES_BROKER. BrokerMemoria solo reparte dentro
+del proceso; con varios workers o con el despachador en otro proceso se usa
+BrokerRedis (requiere el paquete `redis` y REDIS_URL).
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Mensajes que se guardan por conexión si el cliente lee más lento de lo que llegan
+CAPACIDAD_COLA = 100
+
+
+def canal_usuario(usuario_id):
+    return f'usuario:{usuario_id}'
+
+
+def mensaje_notificacion(notificacion):
+    """Datos mínimos de la notificación para el cliente, sin el árbol de serializadores"""
+    return {
+        'id_notificacion': notificacion.id_notificacion,
+        'tipo_notificacion': notificacion.tipo_notificacion,
+        'titulo': notificacion.titulo,
+        'mensaje': notificacion.mensaje,
+        'prioridad': notificacion.prioridad,
+        'estado': notificacion.estado,
+        'enlace': notificacion.enlace,
+        'fecha_creacion': notificacion.fecha_creacion.isoformat() if notificacion.fecha_creacion else None,
+    }
+
+
+# ==================== BROKER EN MEMORIA ====================
+
+class SuscripcionMemoria:
+
+    def __init__(self, broker, canal):
+        self.broker = broker
+        self.canal = canal
+        self.loop = None
+        self.cola = None
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(CAPACIDAD_COLA)
+        self.broker._agregar(self)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.broker._quitar(self)
+
+    def entregar(self, mensaje):
+        # Puede llamarse desde cualquier hilo (vistas síncronas, señales)
+        try:
+            self.loop.call_soon_threadsafe(self._encolar, mensaje)
+        except RuntimeError:
+            pass  # El loop de la conexión ya se cerró
+
+    def _encolar(self, mensaje):
+        if self.cola.full():
+            self.cola.get_nowait()  # Se descarta el más antiguo
+        self.cola.put_nowait(mensaje)
+
+    async def recibir(self, timeout):
+        """Siguiente mensaje, o None si no llegó ninguno en `timeout` segundos"""
+        try:
+            return await asyncio.wait_for(self.cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class BrokerMemoria:
+    """Pub/sub dentro del proceso"""
+
+    def __init__(self):
+        self.suscripciones = {}
+        self.lock = threading.Lock()
+
+    def _agregar(self, suscripcion):
+        with self.lock:
+            self.suscripciones.setdefault(suscripcion.canal, set()).add(suscripcion)
+
+    def _quitar(self, suscripcion):
+        with self.lock:
+            suscripciones = self.suscripciones.get(suscripcion.canal, set())
+            suscripciones.discard(suscripcion)
+            if not suscripciones:
+                self.suscripciones.pop(suscripcion.canal, None)
+
+    def publicar(self, canal, mensaje):
+        with self.lock:
+            destinatarios = list(self.suscripciones.get(canal, ()))
+        for suscripcion in destinatarios:
+            suscripcion.entregar(mensaje)
+
+    def suscribir(self, canal):
+        return SuscripcionMemoria(self, canal)
+
+
+# ==================== BROKER REDIS ====================
+
+class SuscripcionRedis(SuscripcionMemoria):
+    """Cola local de la conexión SSE; el canal se suscribe en la conexión compartida del broker"""
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        await self.broker._suscribir_canal(self.canal)
+        return self
+
+    async def __aexit__(self, *exc):
+        await super().__aexit__(*exc)
+        await self.broker._liberar_canal(self.canal)
+
+
+class BrokerRedis(BrokerMemoria):
+    """
+    Pub/sub de Redis, compartido entre procesos. Cada proceso abre una sola conexión
+    de suscripción: una tarea la lee y reparte los mensajes a las colas locales de
+    las conexiones SSE, igual que BrokerMemoria.
+    """
+
+    def __init__(self):
+        import redis
+
+        super().__init__()
+        self.url = settings.REDIS_URL
+        self.cliente = redis.Redis.from_url(self.url)
+        self.pubsub = None
+        self.loop = None
+        self.lock_canales = None
+
+    def publicar(self, canal, mensaje):
+        self.cliente.publish(canal, json.dumps(mensaje))
+
+    def suscribir(self, canal):
+        return SuscripcionRedis(self, canal)
+
+    def _conectar(self):
+        # El cliente async queda atado al loop que lo creó (uno por worker ASGI)
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        import redis.asyncio
+
+        self.loop = loop
+        self.lock_canales = asyncio.Lock()
+        self.pubsub = redis.asyncio.Redis.from_url(self.url, decode_responses=True).pubsub()
+        loop.create_task(self._leer(self.pubsub))
+
+    async def _leer(self, pubsub):
+        while self.pubsub is pubsub:
+            try:
+                mensaje = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                print(f"Error al leer de Redis: {e}")
+                await asyncio.sleep(1)
+                continue
+            if mensaje:
+                super().publicar(mensaje['channel'], json.loads(mensaje['data']))
+
+    async def _suscribir_canal(self, canal):
+        self._conectar()
+        async with self.lock_canales:
+            await self.pubsub.subscribe(canal)
+
+    async def _liberar_canal(self, canal):
+        async with self.lock_canales:
+            with self.lock:
+                en_uso = canal in self.suscripciones
+            if not en_uso:
+                await self.pubsub.unsubscribe(canal)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def obtener_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'NOTIFICACIONES_BROKER', 'appweb.eventos.BrokerMemoria'))()
+        return _broker
+
+
+# ==================== PUBLICACIÓN ====================
+
+def publicar_notificaciones(notificaciones):
+    """Publica las notificaciones cuando la transacción actual se confirma"""
+    mensajes = [(canal_usuario(n.id_usuario_destino_id), mensaje_notificacion(n)) for n in notificaciones]
+    if not mensajes:
+        return
+
+    def publicar():
+        broker = obtener_broker()
+        for canal, mensaje in mensajes:
+            try:
+                broker.publicar(canal, mensaje)
+            except Exception as e:
+                print(f"Error al publicar notificación en '{canal}': {e}")
+
+    transaction.on_commit(publicar)
+
@@ -0,0 +1,161 @@
+"""
+Exportación de tablas clínicas en CSV o JSON Lines, fila por fila.
+
+Cada tabla se lee con `values_list` (columnas planas, sin instancias de modelo ni
+serializadores) e `iterator(chunk_size=...)`, que en PostgreSQL usa un cursor del
+lado del servidor: la memoria no depende del tamaño de la tabla. Las exportaciones
+incrementales filtran por una marca de agua (fecha de creación o de cálculo): las
+filas con marca en (desde, hasta].
+"""
+import csv
+import json
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import HistorialAdherencia, Paciente, Tratamiento, TratamientoMedicamento
+
+TAMANO_LOTE = 2000
+FORMATOS = ('csv', 'jsonl')
+
+# tabla -> modelo, campo de la marca de agua y columnas (nombre, ruta para values_list)
+EXPORTACIONES = {
+    'pacientes': {
+        'modelo': Paciente,
+        'marca': 'id_usuario__fecha_registro',
+        'columnas': (
+            ('id_paciente', 'id_paciente'),
+            ('id_usuario', 'id_usuario'),
+            ('email', 'id_usuario__email'),
+            ('nombre', 'id_usuario__nombre'),
+            ('apellido', 'id_usuario__apellido'),
+            ('fecha_nacimiento', 'id_usuario__fecha_nacimiento'),
+            ('numero_identificacion', 'numero_identificacion'),
+            ('genero', 'genero'),
+            ('grupo_sanguineo', 'grupo_sanguineo'),
+            ('alergias', 'alergias'),
+            ('enfermedades_cronicas', 'enfermedades_cronicas'),
+            ('direccion', 'direccion'),
+            ('activo', 'id_usuario__activo'),
+            ('fecha_registro', 'id_usuario__fecha_registro'),
+        ),
+    },
+    'tratamientos': {
+        'modelo': Tratamiento,
+        'marca': 'fecha_creacion',
+        'columnas': (
+            ('id_tratamiento', 'id_tratamiento'),
+            ('id_paciente', 'id_paciente'),
+            ('id_medico', 'id_medico'),
+            ('diagnostico', 'diagnostico'),
+            ('fecha_inicio', 'fecha_inicio'),
+            ('fecha_fin', 'fecha_fin'),
+            ('duracion_dias', 'duracion_dias'),
+            ('tipo_tratamiento', 'tipo_tratamiento'),
+            ('objetivo_terapeutico', 'objetivo_terapeutico'),
+            ('estado', 'estado'),
+            ('fecha_creacion', 'fecha_creacion'),
+        ),
+    },
+    'tratamiento_medicamentos': {
+        'modelo': TratamientoMedicamento,
+        # La tabla no tiene fecha propia: se exporta con la del tratamiento
+        'marca': 'id_tratamiento__fecha_creacion',
+        'columnas': (
+            ('id_tratamiento_medicamento', 'id_tratamiento_medicamento'),
+            ('id_tratamiento', 'id_tratamiento'),
+            ('id_medicamento', 'id_medicamento'),
+            ('medicamento', 'id_medicamento__nombre_comercial'),
+            ('dosis', 'dosis'),
+            ('frecuencia', 'frecuencia'),
+            ('via_administracion', 'via_administracion'),
+            ('duracion_dias', 'duracion_dias'),
+            ('horarios', 'horarios'),
+            ('activo', 'activo'),
+            ('fecha_creacion', 'id_tratamiento__fecha_creacion'),
+        ),
+    },
+    'adherencia': {
+        'modelo': HistorialAdherencia,
+        'marca': 'fecha_calculo',
+        'columnas': (
+            ('id_historial', 'id_historial'),
+            ('id_paciente', 'id_paciente'),
+            ('id_tratamiento', 'id_tratamiento'),
+            ('fecha_inicio_periodo', 'fecha_inicio_periodo'),
+            ('fecha_fin_periodo', 'fecha_fin_periodo'),
+            ('tomas_programadas', 'tomas_programadas'),
+            ('tomas_realizadas', 'tomas_realizadas'),
+            ('tomas_omitidas', 'tomas_omitidas'),
+            ('tomas_tardias', 'tomas_tardias'),
+            ('porcentaje_adherencia', 'porcentaje_adherencia'),
+            ('clasificacion_adherencia', 'clasificacion_adherencia'),
+            ('fecha_calculo', 'fecha_calculo'),
+        ),
+    },
+}
+
+
+def parse_marca(valor):
+    """Fecha o fecha y hora ISO 8601 como datetime con zona; ValueError si no es válida"""
+    marca = parse_datetime(valor)
+    if marca is None:
+        fecha = parse_date(valor)
+        if fecha is None:
+            raise ValueError(valor)
+        marca = datetime.combine(fecha, time.min)
+    if timezone.is_naive(marca):
+        marca = timezone.make_aware(marca)
+    return marca
+
+
+def filas(tabla, desde=None, hasta=None, tamano_lote=TAMANO_LOTE):
+    """Tuplas de las columnas de `tabla` con marca de agua en (desde, hasta], en orden de pk"""
+    exportacion = EXPORTACIONES[tabla]
+    marca = exportacion['marca']
+    queryset = exportacion['modelo'].objects.all()
+    if desde is not None:
+        queryset = queryset.filter(**{f'{marca}__gt': desde})
+    if hasta is not None:
+        # En una exportación completa también salen las filas sin marca
+        condicion = Q(**{f'{marca}__lte': hasta})
+        queryset = queryset.filter(condicion if desde is not None else condicion | Q(**{f'{marca}__isnull': True}))
+    rutas = [ruta for _, ruta in exportacion['columnas']]
+    return queryset.order_by('pk').values_list(*rutas).iterator(chunk_size=tamano_lote)
+
+
+class _Eco:
+    """Archivo falso para csv.writer: write() devuelve la línea en lugar de guardarla"""
+    def write(self, valor):
+        return valor
+
+
+def _celda_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, (list, dict)):
+        return json.dumps(valor, ensure_ascii=False)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+def exportar(tabla, formato='csv', desde=None, hasta=None, tamano_lote=TAMANO_LOTE):
+    """Genera el archivo de exportación línea por línea"""
+    if tabla not in EXPORTACIONES:
+        raise ValueError(f"Tabla no exportable: {tabla}")
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}")
+
+    nombres = [nombre for nombre, _ in EXPORTACIONES[tabla]['columnas']]
+    if formato == 'csv':
+        escritor = csv.writer(_Eco())
+        yield escritor.writerow(nombres)
+        for fila in filas(tabla, desde, hasta, tamano_lote):
+            yield escritor.writerow([_celda_csv(valor) for valor in fila])
+    else:
+        for fila in filas(tabla, desde, hasta, tamano_lote):
+            yield json.dumps(dict(zip(nombres, fila)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
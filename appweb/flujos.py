@@ -0,0 +1,38 @@
+"""
+Respuestas en flujo que no se acumulan en memoria bajo ASGI.
+
+Servido con ASGI (Procfile: basedb.asgi con uvicorn), Django lee un
+StreamingHttpResponse construido con un generador síncrono entero con
+`sync_to_async(list)` antes de enviar el primer byte. `respuesta_en_flujo()`
+envuelve el generador en un iterador asíncrono que pide las partes por bloques al
+hilo de la petición (donde viven la conexión y los cursores de la base); con WSGI
+devuelve el generador tal cual.
+"""
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+PARTES_POR_BLOQUE = 100
+
+
+async def iterar_en_hilo(partes, tamano_bloque=PARTES_POR_BLOQUE):
+    """Recorre el iterador síncrono `partes` desde código asíncrono, un bloque por llamada"""
+    partes = iter(partes)
+    siguiente_bloque = sync_to_async(lambda: list(islice(partes, tamano_bloque)))
+    try:
+        while bloque := await siguiente_bloque():
+            for parte in bloque:
+                yield parte
+    finally:
+        # Cierra el generador (y su cursor) también si el cliente se desconecta
+        if hasattr(partes, 'close'):
+            await sync_to_async(partes.close)()
+
+
+def respuesta_en_flujo(request, partes, **kwargs):
+    """StreamingHttpResponse con `partes`, asíncrono si la petición llegó por ASGI"""
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        partes = iterar_en_hilo(partes)
+    return StreamingHttpResponse(partes, **kwargs)
@@ -0,0 +1,41 @@
+"""
+Argon2 con el costo definido en settings.ARGON2_COSTO (time_cost, memory_cost en KiB
+y parallelism), para elegirlo midiendo con `manage.py medir_costo_password`.
+
+Conserva el algoritmo 'argon2': los hashes existentes se siguen verificando y, si
+se generaron con otros parámetros, check_password() los marca para rehashear.
+"""
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class Argon2Configurable(Argon2PasswordHasher):
+
+    def _costo(self, parametro):
+        return getattr(settings, 'ARGON2_COSTO', {}).get(parametro, getattr(Argon2PasswordHasher, parametro))
+
+    @property
+    def time_cost(self):
+        return self._costo('time_cost')
+
+    @property
+    def memory_cost(self):
+        return self._costo('memory_cost')
+
+    @property
+    def parallelism(self):
+        return self._costo('parallelism')
+
+
+def inicializar_proceso(hashers, costo_argon2):
+    """
+    Inicializador de los procesos 'spawn' que hashean (importación masiva): el hijo
+    arranca sin Django configurado y debe usar los mismos hashers y costo que el
+    padre. Vive aquí porque este módulo no importa modelos.
+    """
+    if not apps.ready:
+        django.setup()
+    settings.PASSWORD_HASHERS = hashers
+    settings.ARGON2_COSTO = costo_argon2
@@ -0,0 +1,142 @@
+"""
+Historial (línea de tiempo) de un paciente: tratamientos con sus medicamentos y
+períodos de adherencia, más las notificaciones recibidas.
+
+Se arma con un número fijo de consultas: los tratamientos (con médico y usuario por
+JOIN), un Prefetch para las líneas con su medicamento, otro para los resúmenes de
+adherencia y una consulta para las notificaciones. `historial_stream()` produce el
+mismo documento JSON por partes, leyendo los tratamientos por lotes (cada lote trae
+sus propios Prefetch) para no cargar historiales largos en memoria.
+"""
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .eventos import mensaje_notificacion
+from .models import HistorialAdherencia, Notificacion, Tratamiento, TratamientoMedicamento
+
+TAMANO_LOTE = 200
+
+
+def tratamientos_del_historial(paciente_id, desde=None, hasta=None):
+    """Tratamientos que se superponen con [desde, hasta], con líneas y adherencia precargadas"""
+    tratamientos = Tratamiento.objects.select_related('id_medico__id_usuario').filter(id_paciente=paciente_id)
+    adherencia = HistorialAdherencia.objects.order_by('fecha_inicio_periodo')
+    if desde:
+        tratamientos = tratamientos.filter(fecha_fin__gte=desde)
+        adherencia = adherencia.filter(fecha_inicio_periodo__gte=desde)
+    if hasta:
+        tratamientos = tratamientos.filter(fecha_inicio__lte=hasta)
+        adherencia = adherencia.filter(fecha_inicio_periodo__lte=hasta)
+
+    return tratamientos.prefetch_related(
+        Prefetch(
+            'tratamientomedicamento_set',
+            queryset=TratamientoMedicamento.objects.select_related('id_medicamento').order_by('id_tratamiento_medicamento'),
+            to_attr='lineas_historial'
+        ),
+        Prefetch('historialadherencia_set', queryset=adherencia, to_attr='adherencia_historial'),
+    ).order_by('-fecha_inicio', '-id_tratamiento')
+
+
+def notificaciones_del_historial(usuario_id, desde=None, hasta=None):
+    # Rango de fechas y horas en la zona local, sin convertir cada fila con __date
+    zona = timezone.get_current_timezone()
+    notificaciones = Notificacion.objects.filter(id_usuario_destino=usuario_id)
+    if desde:
+        notificaciones = notificaciones.filter(
+            fecha_creacion__gte=timezone.make_aware(datetime.combine(desde, time.min), zona)
+        )
+    if hasta:
+        notificaciones = notificaciones.filter(
+            fecha_creacion__lt=timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min), zona)
+        )
+    return notificaciones.order_by('-fecha_creacion', '-id_notificacion')
+
+
+def tratamiento_a_dict(tratamiento):
+    usuario_medico = tratamiento.id_medico.id_usuario
+    return {
+        'id_tratamiento': tratamiento.id_tratamiento,
+        'diagnostico': tratamiento.diagnostico,
+        'tipo_tratamiento': tratamiento.tipo_tratamiento,
+        'estado': tratamiento.estado,
+        'objetivo_terapeutico': tratamiento.objetivo_terapeutico,
+        'fecha_inicio': tratamiento.fecha_inicio,
+        'fecha_fin': tratamiento.fecha_fin,
+        'id_medico': tratamiento.id_medico_id,
+        'medico': f"Dr. {usuario_medico.nombre} {usuario_medico.apellido}",
+        'medicamentos': [
+            {
+                'id_tratamiento_medicamento': linea.id_tratamiento_medicamento,
+                'id_medicamento': linea.id_medicamento_id,
+                'medicamento': linea.id_medicamento.nombre_comercial,
+                'dosis': linea.dosis,
+                'frecuencia': linea.frecuencia,
+                'via_administracion': linea.via_administracion,
+                'duracion_dias': linea.duracion_dias,
+                'horarios': linea.horarios,
+                'instrucciones_especiales': linea.instrucciones_especiales,
+                'activo': linea.activo,
+            }
+            for linea in tratamiento.lineas_historial
+        ],
+        'adherencia': [
+            {
+                'fecha_inicio_periodo': periodo.fecha_inicio_periodo,
+                'fecha_fin_periodo': periodo.fecha_fin_periodo,
+                'tomas_programadas': periodo.tomas_programadas,
+                'tomas_realizadas': periodo.tomas_realizadas,
+                'tomas_omitidas': periodo.tomas_omitidas,
+                'tomas_tardias': periodo.tomas_tardias,
+                'porcentaje_adherencia': (
+                    float(periodo.porcentaje_adherencia) if periodo.porcentaje_adherencia is not None else None
+                ),
+                'clasificacion_adherencia': periodo.clasificacion_adherencia,
+            }
+            for periodo in tratamiento.adherencia_historial
+        ],
+    }
+
+
+def _encabezado(paciente, desde, hasta):
+    usuario = paciente.id_usuario
+    return {
+        'id_paciente': paciente.id_paciente,
+        'paciente': f"{usuario.nombre} {usuario.apellido}",
+        'desde': desde,
+        'hasta': hasta,
+    }
+
+
+def historial(paciente, desde=None, hasta=None):
+    """Historial completo como diccionario (paciente con id_usuario ya cargado)"""
+    return {
+        **_encabezado(paciente, desde, hasta),
+        'tratamientos': [
+            tratamiento_a_dict(t) for t in tratamientos_del_historial(paciente.id_paciente, desde, hasta)
+        ],
+        'notificaciones': [
+            mensaje_notificacion(n) for n in notificaciones_del_historial(paciente.id_usuario_id, desde, hasta)
+        ],
+    }
+
+
+def historial_stream(paciente, desde=None, hasta=None):
+    """Genera el mismo JSON que historial(), por partes"""
+    def codificar(valor):
+        return json.dumps(valor, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+    encabezado = codificar(_encabezado(paciente, desde, hasta))
+    yield encabezado[:-1] + ', "tratamientos": ['
+    tratamientos = tratamientos_del_historial(paciente.id_paciente, desde, hasta)
+    for i, tratamiento in enumerate(tratamientos.iterator(chunk_size=TAMANO_LOTE)):
+        yield (', ' if i else '') + codificar(tratamiento_a_dict(tratamiento))
+    yield '], "notificaciones": ['
+    notificaciones = notificaciones_del_historial(paciente.id_usuario_id, desde, hasta)
+    for i, notificacion in enumerate(notificaciones.iterator(chunk_size=TAMANO_LOTE)):
+        yield (', ' if i else '') + codificar(mensaje_notificacion(notificacion))
+    yield ']}'
@@ -0,0 +1,207 @@
+"""
+Importación masiva de pacientes y médicos desde CSV o JSON Lines.
+
+El archivo se lee por lotes sin cargarlo entero. En cada lote los correos se
+comparan con los ya registrados en una sola consulta, las filas se validan con
+CrearPacienteSerializer / CrearMedicoSerializer, las contraseñas se hashean (en un
+pool de procesos si se pide, ya que Argon2 es deliberadamente lento) y los pares
+Usuario + perfil se insertan con un bulk_create por tabla. Una fila inválida se
+reporta y no detiene la importación.
+
+El endpoint hashea en el proceso que atiende la petición; el pool solo lo abre
+`manage.py importar_usuarios`, que es el camino para importaciones grandes.
+"""
+import csv
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .hashers import inicializar_proceso
+from .models import Medico, Paciente, Usuario
+from .serializers import CrearMedicoSerializer, CrearPacienteSerializer
+
+TAMANO_LOTE = 500
+PASSWORD_INICIAL = '123456'
+FORMATOS = ('csv', 'jsonl')
+SERIALIZADORES = {
+    'paciente': CrearPacienteSerializer,
+    'medico': CrearMedicoSerializer,
+}
+
+
+def formato_de_archivo(nombre):
+    return 'csv' if nombre.lower().endswith('.csv') else 'jsonl'
+
+
+def leer_filas(archivo, formato):
+    """
+    Genera (número de fila, datos) de un archivo binario o de texto. Las filas que
+    no se pueden interpretar llegan como (número, None).
+    """
+    if isinstance(archivo, io.TextIOBase):
+        texto = archivo
+    else:
+        texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+
+    if formato == 'csv':
+        for numero, fila in enumerate(csv.DictReader(texto), start=1):
+            # Celdas vacías = campo omitido (los opcionales no admiten '' en todos los casos)
+            yield numero, {k: v for k, v in fila.items() if k and v not in ('', None)}
+        return
+
+    numero = 0
+    for linea in texto:
+        if not linea.strip():
+            continue
+        numero += 1
+        try:
+            datos = json.loads(linea)
+        except ValueError:
+            datos = None
+        yield numero, datos if isinstance(datos, dict) else None
+
+
+class Hasheador:
+    """make_password() en el proceso actual o, si procesos > 1, en un pool de procesos"""
+
+    def __init__(self, procesos=1):
+        self.pool = None
+        if procesos > 1:
+            # 'spawn': los hijos no heredan las conexiones abiertas del proceso padre
+            self.pool = ProcessPoolExecutor(
+                procesos,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=inicializar_proceso,
+                initargs=(settings.PASSWORD_HASHERS, getattr(settings, 'ARGON2_COSTO', {})),
+            )
+
+    def hashear(self, passwords):
+        if self.pool is None:
+            return [make_password(p) for p in passwords]
+        return list(self.pool.map(make_password, passwords, chunksize=32))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def _nuevo_usuario(datos, tipo, password_hash, ahora):
+    return Usuario(
+        email=datos['email'],
+        nombre=datos['nombre'],
+        apellido=datos['apellido'],
+        telefono=datos['telefono'],
+        fecha_nacimiento=datos['fecha_nacimiento'],
+        tipo_usuario=tipo,
+        password_hash=password_hash,
+        activo=True,
+        fecha_registro=ahora,
+        ultima_conexion=ahora
+    )
+
+
+def _nuevo_perfil(datos, tipo, usuario):
+    if tipo == 'medico':
+        return Medico(
+            id_usuario=usuario,
+            especialidad=datos.get('especialidad', ''),
+            numero_colegiado=datos['numero_colegiado'],
+            institucion=datos['institucion'],
+            anos_experiencia=datos['anos_experiencia'],
+            consultorio=datos['consultorio'],
+            certificaciones=datos['certificaciones']
+        )
+    paciente = Paciente(
+        id_usuario=usuario,
+        numero_identificacion=datos.get('numero_identificacion', ''),
+        genero=datos.get('genero', ''),
+        grupo_sanguineo=datos['grupo_sanguineo'],
+        alergias=datos['alergias'],
+        enfermedades_cronicas=datos['enfermedades_cronicas'],
+        direccion=datos['direccion'],
+        contacto_emergencia=datos.get('contacto_emergencia', ''),
+        telefono_emergencia=datos.get('telefono_emergencia', '')
+    )
+    # bulk_create no pasa por Paciente.save()
+    paciente.texto_busqueda = paciente.construir_texto_busqueda(usuario)
+    return paciente
+
+
+def _importar_lote(filas, tipo, vistos, hasheador):
+    """Procesa un lote de (número, datos); devuelve (creadas, errores)"""
+    errores = []
+    emails = {d['email'] for _, d in filas if d and isinstance(d.get('email'), str)}
+    registrados = set(Usuario.objects.filter(email__in=emails).values_list('email', flat=True))
+
+    validas = []
+    for numero, datos in filas:
+        if datos is None:
+            errores.append({'fila': numero, 'errores': {'fila': ['No se pudo interpretar la fila.']}})
+            continue
+        serializer = SERIALIZADORES[tipo](data=datos, context={'emails_registrados': registrados | vistos})
+        if not serializer.is_valid():
+            errores.append({'fila': numero, 'email': datos.get('email'), 'errores': serializer.errors})
+            continue
+        vistos.add(serializer.validated_data['email'])
+        validas.append((numero, serializer.validated_data, str(datos.get('password') or PASSWORD_INICIAL)))
+
+    if not validas:
+        return 0, errores
+
+    hashes = hasheador.hashear([password for _, _, password in validas])
+    ahora = timezone.now()
+    try:
+        with transaction.atomic():
+            usuarios = Usuario.objects.bulk_create([
+                _nuevo_usuario(datos, tipo, password_hash, ahora)
+                for (_, datos, _), password_hash in zip(validas, hashes)
+            ])
+            modelo = Medico if tipo == 'medico' else Paciente
+            modelo.objects.bulk_create([
+                _nuevo_perfil(datos, tipo, usuario) for (_, datos, _), usuario in zip(validas, usuarios)
+            ])
+    except IntegrityError as e:
+        # p. ej. un correo registrado por otra petición entre la consulta y el INSERT
+        errores.extend(
+            {'fila': numero, 'email': datos['email'], 'errores': {'lote': [f'No se pudo guardar el lote: {e}']}}
+            for numero, datos, _ in validas
+        )
+        return 0, errores
+    return len(usuarios), errores
+
+
+def importar(archivo, tipo, formato='csv', tamano_lote=TAMANO_LOTE, procesos=1):
+    """
+    Importa `archivo` como usuarios de `tipo` ('paciente' o 'medico'). Genera un
+    informe por lote: {'lote', 'procesadas', 'creadas', 'errores'}, con los totales
+    acumulados y los errores (fila, email, errores) de ese lote.
+    """
+    if tipo not in SERIALIZADORES:
+        raise ValueError(f"Tipo de usuario no importable: {tipo}")
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}")
+
+    filas = leer_filas(archivo, formato)
+    vistos = set()
+    procesadas = creadas = 0
+    with Hasheador(procesos) as hasheador:
+        for lote in iter(lambda: list(islice(filas, tamano_lote)), []):
+            creadas_lote, errores = _importar_lote(lote, tipo, vistos, hasheador)
+            procesadas += len(lote)
+            creadas += creadas_lote
+            yield {
+                'lote': len(lote),
+                'procesadas': procesadas,
+                'creadas': creadas,
+                'errores': errores,
+            }
@@ -0,0 +1,78 @@
+"""
+Búsqueda de menciones de medicamentos en los textos de interacciones de OpenFDA.
+
+BuscadorTerminos compila todos los términos de los medicamentos consultados en una
+sola expresión regular con límites de palabra, de modo que cada etiqueta se recorre
+una sola vez sin importar cuántos medicamentos se busquen. TextoIndexado guarda las
+posiciones de fin de oración de una etiqueta para extraer el fragmento de cada
+mención con búsqueda binaria en lugar de volver a escanear el texto.
+"""
+import re
+from bisect import bisect_left
+from functools import lru_cache
+
+
+class TextoIndexado:
+    """Texto de una etiqueta con sus límites de oración ('. ') precalculados"""
+
+    def __init__(self, texto):
+        self.texto = texto
+        self.puntos = [m.start() for m in re.finditer(r'\. ', texto)]
+
+    def fragmento(self, posicion, caracteres_contexto=500):
+        """
+        Oración alrededor de `posicion`, acotada a `caracteres_contexto` caracteres
+        hacia cada lado.
+        """
+        texto = self.texto
+
+        # Inicio: el '. ' más cercano antes de la mención, dentro del contexto
+        inicio = max(0, posicion - caracteres_contexto)
+        i = bisect_left(self.puntos, posicion - 1) - 1
+        if i >= 0 and self.puntos[i] > inicio:
+            inicio = self.puntos[i] + 2
+
+        # Fin: el primer '. ' desde la mención, dentro del contexto
+        fin = min(len(texto), posicion + caracteres_contexto)
+        j = bisect_left(self.puntos, posicion)
+        if j < len(self.puntos) and self.puntos[j] + 2 <= fin:
+            fin = self.puntos[j] + 1
+
+        return texto[inicio:fin].strip()
+
+
+@lru_cache(maxsize=256)
+def indexar_texto(texto):
+    """Índice de oraciones de un texto, reutilizado mientras la etiqueta siga en memoria"""
+    return TextoIndexado(texto)
+
+
+class BuscadorTerminos:
+    """
+    Encuentra en una sola pasada todas las menciones de un conjunto de medicamentos.
+    `terminos_por_nombre` es {nombre: [variantes]}.
+    """
+
+    def __init__(self, terminos_por_nombre):
+        self.nombres_por_termino = {}
+        for nombre, terminos in terminos_por_nombre.items():
+            for termino in terminos:
+                termino = termino.strip().lower()
+                if termino:
+                    self.nombres_por_termino.setdefault(termino, []).append(nombre)
+
+        # Los términos más largos primero, para que la alternancia prefiera la coincidencia completa
+        alternativas = '|'.join(
+            re.escape(termino) for termino in sorted(self.nombres_por_termino, key=len, reverse=True)
+        )
+        self.patron = re.compile(rf'(?<!\w)(?:{alternativas})(?!\w)', re.IGNORECASE) if alternativas else None
+
+    def buscar(self, texto_indexado):
+        """Devuelve {nombre: posición de la primera mención} para los medicamentos mencionados"""
+        menciones = {}
+        if self.patron is None:
+            return menciones
+        for coincidencia in self.patron.finditer(texto_indexado.texto):
+            for nombre in self.nombres_por_termino.get(coincidencia.group(0).lower(), []):
+                menciones.setdefault(nombre, coincidencia.start())
+        return menciones
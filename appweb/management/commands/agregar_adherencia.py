@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appweb.adherencia import agregar_registros
+
+
+class Command(BaseCommand):
+    help = (
+        'Actualiza HistorialAdherencia con los registros de tomas nuevos desde la '
+        'última marca de agua y crea las alertas de adherencia baja.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Registros procesados por transacción')
+        parser.add_argument('--intervalo', type=float, default=30.0,
+                            help='Segundos de espera cuando no hay registros nuevos')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesar los registros pendientes y terminar (para cron)')
+
+    def handle(self, *args, **options):
+        totales = {'registros': 0, 'periodos': 0, 'alertas': 0}
+
+        try:
+            while True:
+                resumen = agregar_registros(options['lote'])
+                if resumen['registros']:
+                    for clave in totales:
+                        totales[clave] += resumen[clave]
+                    self.stdout.write(
+                        f"registros={resumen['registros']} periodos={resumen['periodos']} "
+                        f"alertas={resumen['alertas']}"
+                    )
+                    continue
+
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {totales['registros']} registros aplicados a {totales['periodos']} períodos, "
+            f"{totales['alertas']} alertas creadas"
+        ))
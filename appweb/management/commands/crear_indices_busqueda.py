@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# (nombre, tabla, expresión) de cada índice de búsqueda
+INDICES_TRIGRAMAS = [
+    ('medicamentos_nombre_comercial_trgm', 'MEDICAMENTOS', 'nombre_comercial gin_trgm_ops'),
+    ('medicamentos_nombre_generico_trgm', 'MEDICAMENTOS', 'nombre_generico gin_trgm_ops'),
+    ('medicamentos_laboratorio_trgm', 'MEDICAMENTOS', 'laboratorio gin_trgm_ops'),
+    ('pacientes_texto_busqueda_trgm', 'PACIENTES', 'texto_busqueda gin_trgm_ops'),
+]
+
+INDICES_PREFIJO = [
+    ('medicamentos_nombre_comercial_prefijo', 'MEDICAMENTOS', 'UPPER(nombre_comercial::text) text_pattern_ops'),
+    ('medicamentos_nombre_generico_prefijo', 'MEDICAMENTOS', 'UPPER(nombre_generico::text) text_pattern_ops'),
+    ('medicamentos_laboratorio_prefijo', 'MEDICAMENTOS', 'UPPER(laboratorio::text) text_pattern_ops'),
+    ('pacientes_texto_busqueda_prefijo', 'PACIENTES', 'texto_busqueda text_pattern_ops'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Crea la extensión pg_trgm y los índices de búsqueda por trigramas y prefijo (solo PostgreSQL)'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Los índices de trigramas requieren PostgreSQL; en otros motores se usa el índice en memoria.')
+
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for nombre, tabla, expresion in INDICES_TRIGRAMAS:
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {nombre} ON "{tabla}" USING gin ({expresion})')
+                self.stdout.write(f'✅ {nombre}')
+            for nombre, tabla, expresion in INDICES_PREFIJO:
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {nombre} ON "{tabla}" ({expresion})')
+                self.stdout.write(f'✅ {nombre}')
+
+        self.stdout.write(self.style.SUCCESS('Índices de búsqueda listos'))
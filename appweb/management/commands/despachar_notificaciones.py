@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appweb.notificaciones import despachar_lote
+
+
+class Command(BaseCommand):
+    help = (
+        'Envía las notificaciones programadas cuyo momento llegó. Se pueden ejecutar '
+        'varios procesos a la vez: cada lote se reclama con FOR UPDATE SKIP LOCKED.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help='Notificaciones reclamadas por transacción')
+        parser.add_argument('--intervalo', type=float, default=5.0,
+                            help='Segundos de espera cuando no hay notificaciones vencidas')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Despachar lo vencido y terminar (para cron)')
+
+    def handle(self, *args, **options):
+        totales = {'reclamadas': 0, 'enviadas': 0, 'fallidas': 0, 'repetidas': 0}
+        inicio = time.monotonic()
+
+        try:
+            while True:
+                inicio_lote = time.monotonic()
+                metricas = despachar_lote(options['lote'])
+                if metricas['reclamadas']:
+                    for clave in totales:
+                        totales[clave] += metricas[clave]
+                    duracion = time.monotonic() - inicio_lote
+                    self.stdout.write(
+                        f"reclamadas={metricas['reclamadas']} enviadas={metricas['enviadas']} "
+                        f"fallidas={metricas['fallidas']} repetidas={metricas['repetidas']} "
+                        f"retraso_promedio={metricas['retraso_promedio']:.1f}s "
+                        f"retraso_maximo={metricas['retraso_maximo']:.1f}s "
+                        f"({metricas['reclamadas'] / duracion if duracion else 0:.0f} filas/s)"
+                    )
+                    continue
+
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            pass
+
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {totales['enviadas']} enviadas, {totales['fallidas']} fallidas, "
+            f"{totales['repetidas']} reprogramadas de {totales['reclamadas']} reclamadas "
+            f"en {duracion:.1f}s"
+        ))
@@ -0,0 +1,67 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from appweb.exportacion import EXPORTACIONES, FORMATOS, TAMANO_LOTE, exportar, parse_marca
+from appweb.models import ProgresoProceso
+
+
+def _marca_a_posicion(marca):
+    return int(marca.timestamp() * 1_000_000)
+
+
+def _posicion_a_marca(posicion):
+    return datetime.fromtimestamp(posicion / 1_000_000, tz=dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta una tabla en CSV o JSON Lines leyendo por lotes (memoria constante). '
+        'Con --incremental solo exporta lo nuevo desde la última ejecución incremental.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tabla', choices=list(EXPORTACIONES), help='Tabla a exportar')
+        parser.add_argument('--formato', choices=FORMATOS, default='csv')
+        parser.add_argument('--salida', help='Archivo de salida (por defecto, la salida estándar)')
+        parser.add_argument('--desde', help='Solo filas con marca de agua posterior (ISO 8601)')
+        parser.add_argument('--hasta', help='Solo filas con marca de agua hasta este momento (por defecto, ahora)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Usar como --desde la marca guardada y guardarla al terminar')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Filas por lectura')
+
+    def handle(self, *args, **options):
+        tabla = options['tabla']
+        try:
+            desde = parse_marca(options['desde']) if options['desde'] else None
+            hasta = parse_marca(options['hasta']) if options['hasta'] else timezone.now()
+        except ValueError as e:
+            raise CommandError(f'Fecha inválida: {e}')
+
+        progreso = None
+        if options['incremental']:
+            progreso, _ = ProgresoProceso.objects.get_or_create(nombre=f'exportacion_{tabla}')
+            if progreso.posicion and desde is None:
+                desde = _posicion_a_marca(progreso.posicion)
+
+        salida = open(options['salida'], 'w', encoding='utf-8', newline='') if options['salida'] else None
+        filas = 0
+        try:
+            for linea in exportar(tabla, options['formato'], desde, hasta, options['lote']):
+                if salida is not None:
+                    salida.write(linea)
+                else:
+                    self.stdout.write(linea, ending='')
+                filas += 1
+        finally:
+            if salida is not None:
+                salida.close()
+
+        if progreso is not None:
+            progreso.posicion = _marca_a_posicion(hasta)
+            progreso.save(update_fields=['posicion', 'fecha_actualizacion'])
+
+        if options['formato'] == 'csv':
+            filas -= 1
+        self.stderr.write(self.style.SUCCESS(f'✅ {filas} filas de {tabla} exportadas (marca de agua: {hasta.isoformat()})'))
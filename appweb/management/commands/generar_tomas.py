@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from appweb.tomas import generar_tomas
+
+
+class Command(BaseCommand):
+    help = (
+        'Extiende las tomas programadas hasta el final de la ventana (TOMAS_VENTANA_DIAS) '
+        'y regenera las de las líneas cuyos horarios, estado o fechas cambiaron. '
+        'Pensado para ejecutarse una vez al día.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None, help='Tamaño de la ventana en días')
+
+    def handle(self, *args, **options):
+        resumen = generar_tomas(ventana_dias=options['dias'])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {resumen['lineas']} líneas actualizadas ({resumen['regeneradas']} regeneradas): "
+            f"{resumen['creadas']} tomas creadas, {resumen['borradas']} borradas"
+        ))
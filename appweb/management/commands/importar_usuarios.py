@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from appweb.importacion import FORMATOS, SERIALIZADORES, TAMANO_LOTE, formato_de_archivo, importar
+
+
+class Command(BaseCommand):
+    help = 'Importa pacientes o médicos desde un archivo CSV o JSON Lines (una fila inválida no detiene la importación)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=sorted(SERIALIZADORES), help='Tipo de usuario a crear')
+        parser.add_argument('archivo', help='Ruta del archivo .csv o .jsonl')
+        parser.add_argument('--formato', choices=FORMATOS, help='Por defecto, según la extensión del archivo')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Filas por lote')
+        parser.add_argument('--procesos', type=int, help='Procesos para hashear contraseñas (por defecto, IMPORTACION_PROCESOS)')
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or formato_de_archivo(options['archivo'])
+        try:
+            archivo = open(options['archivo'], 'rb')
+        except OSError as e:
+            raise CommandError(f'No se pudo abrir el archivo: {e}')
+
+        procesos = options['procesos'] or getattr(settings, 'IMPORTACION_PROCESOS', 1)
+        con_errores = 0
+        informe = {'procesadas': 0, 'creadas': 0}
+        with archivo:
+            for informe in importar(archivo, options['tipo'], formato, options['lote'], procesos):
+                for error in informe['errores']:
+                    self.stderr.write(f"Fila {error['fila']} ({error.get('email') or '-'}): {error['errores']}")
+                con_errores += len(informe['errores'])
+                self.stdout.write(f"{informe['procesadas']} filas procesadas, {informe['creadas']} creadas...")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {informe['creadas']} usuarios ({options['tipo']}) creados de {informe['procesadas']} filas ({con_errores} con errores)"
+        ))
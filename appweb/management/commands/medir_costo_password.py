@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from appweb.hashers import Argon2Configurable
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide cuánto tarda hashear y verificar una contraseña con Argon2 para el costo '
+        'actual (ARGON2_COSTO) o el indicado, para elegir el costo por login'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-cost', type=int, help='Iteraciones')
+        parser.add_argument('--memory-cost', type=int, help='Memoria en KiB')
+        parser.add_argument('--parallelism', type=int, help='Hilos')
+        parser.add_argument('--repeticiones', type=int, default=10)
+
+    def handle(self, *args, **options):
+        costo = dict(getattr(settings, 'ARGON2_COSTO', {}))
+        for parametro in ('time_cost', 'memory_cost', 'parallelism'):
+            if options[parametro] is not None:
+                costo[parametro] = options[parametro]
+
+        with override_settings(ARGON2_COSTO=costo):
+            hasher = Argon2Configurable()
+            costo = {p: getattr(hasher, p) for p in ('time_cost', 'memory_cost', 'parallelism')}
+            encoded = hasher.encode('contraseña-de-prueba', hasher.salt())
+            inicio = time.perf_counter()
+            for _ in range(options['repeticiones']):
+                hasher.verify('contraseña-de-prueba', encoded)
+            duracion = (time.perf_counter() - inicio) / options['repeticiones']
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Argon2 time_cost={costo['time_cost']} memory_cost={costo['memory_cost']} KiB "
+            f"parallelism={costo['parallelism']}: {duracion * 1000:.1f} ms por login"
+        ))
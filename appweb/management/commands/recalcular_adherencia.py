@@ -0,0 +1,96 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from appweb.adherencia import recalcular_bloque
+from appweb.models import ProgresoProceso, Tratamiento
+
+CLAVE_PROGRESO = 'adherencia_recalculo'
+
+
+def _inicializar_proceso():
+    # Con el método 'spawn' el proceso hijo arranca sin Django configurado
+    if not apps.ready:
+        django.setup()
+
+
+def _recalcular_en_proceso(bloque):
+    desde_id, hasta_id, ahora = bloque
+    try:
+        return desde_id, hasta_id, recalcular_bloque(desde_id, hasta_id, ahora)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye HistorialAdherencia para todos los tratamientos activos, por bloques '
+        'de ids de paciente procesados en paralelo. Si se interrumpe, la siguiente '
+        'ejecución continúa desde el último bloque terminado.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamano-bloque', type=int, default=500, help='Ids de paciente por bloque')
+        parser.add_argument('--procesos', type=int, default=None,
+                            help='Procesos en paralelo (por defecto, uno por CPU; 1 = sin pool)')
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='Ignorar el progreso guardado y empezar desde el primer paciente')
+
+    def handle(self, *args, **options):
+        rango = Tratamiento.objects.filter(estado='activo').aggregate(
+            minimo=Min('id_paciente'), maximo=Max('id_paciente')
+        )
+        if rango['minimo'] is None:
+            self.stdout.write('No hay tratamientos activos')
+            return
+
+        progreso, _ = ProgresoProceso.objects.get_or_create(nombre=CLAVE_PROGRESO)
+        inicio_id = rango['minimo']
+        if progreso.posicion and not options['reiniciar']:
+            inicio_id = max(inicio_id, progreso.posicion)
+            self.stdout.write(f'Continuando desde el paciente {inicio_id}')
+
+        ahora = timezone.now()
+        tamano = options['tamano_bloque']
+        bloques = [
+            (desde, min(desde + tamano, rango['maximo'] + 1), ahora)
+            for desde in range(inicio_id, rango['maximo'] + 1, tamano)
+        ]
+
+        filas = 0
+        inicio = time.monotonic()
+        for desde_id, hasta_id, escritas in self._procesar(bloques, options['procesos']):
+            filas += escritas
+            # Los resultados llegan en orden: todo lo anterior a hasta_id ya terminó
+            progreso.posicion = hasta_id
+            progreso.save(update_fields=['posicion', 'fecha_actualizacion'])
+            duracion = time.monotonic() - inicio
+            self.stdout.write(
+                f'pacientes [{desde_id}, {hasta_id}): {escritas} filas '
+                f'({filas / duracion if duracion else 0:.0f} filas/s)'
+            )
+
+        progreso.posicion = 0
+        progreso.save(update_fields=['posicion', 'fecha_actualizacion'])
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {filas} resúmenes escritos en {duracion:.1f}s '
+            f'({filas / duracion if duracion else 0:.0f} filas/s)'
+        ))
+
+    def _procesar(self, bloques, procesos):
+        if procesos == 1 or len(bloques) <= 1:
+            for desde_id, hasta_id, ahora in bloques:
+                yield desde_id, hasta_id, recalcular_bloque(desde_id, hasta_id, ahora)
+            return
+
+        # Cada proceso abre su propia conexión: no deben heredar la del proceso padre
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso) as ejecutor:
+            yield from ejecutor.map(_recalcular_en_proceso, bloques)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from appweb.contadores import reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el contador de notificaciones no leídas de todos los usuarios'
+
+    def handle(self, *args, **options):
+        conteos = reconstruir()
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {len(conteos)} usuarios con notificaciones sin leer, {sum(conteos.values())} en total'
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from appweb.models import Paciente
+
+
+class Command(BaseCommand):
+    help = 'Recalcula PACIENTES.texto_busqueda (nombre, apellido e identificación normalizados)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por bulk_update')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        pendientes = []
+        total = 0
+
+        for paciente in Paciente.objects.select_related('id_usuario').iterator(chunk_size=lote):
+            paciente.texto_busqueda = paciente.construir_texto_busqueda()
+            pendientes.append(paciente)
+            if len(pendientes) >= lote:
+                Paciente.objects.bulk_update(pendientes, ['texto_busqueda'])
+                total += len(pendientes)
+                pendientes = []
+                self.stdout.write(f'{total} pacientes reindexados...')
+
+        if pendientes:
+            Paciente.objects.bulk_update(pendientes, ['texto_busqueda'])
+            total += len(pendientes)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} pacientes reindexados'))
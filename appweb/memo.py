@@ -0,0 +1,34 @@
+"""LRU en memoria del proceso, compartido por los memos de traducciones y sesiones"""
+import threading
+from collections import OrderedDict
+
+
+class MemoLRU:
+    """Diccionario acotado que descarta la entrada usada hace más tiempo"""
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self.datos = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, clave):
+        with self.lock:
+            if clave not in self.datos:
+                return None
+            self.datos.move_to_end(clave)
+            return self.datos[clave]
+
+    def set(self, clave, valor):
+        with self.lock:
+            self.datos[clave] = valor
+            self.datos.move_to_end(clave)
+            while len(self.datos) > self.capacidad:
+                self.datos.popitem(last=False)
+
+    def delete(self, clave):
+        with self.lock:
+            self.datos.pop(clave, None)
+
+    def clear(self):
+        with self.lock:
+            self.datos.clear()
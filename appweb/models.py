@@ -1,7 +1,22 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils import timezone
 
+
+class UsuarioQuerySet(models.QuerySet):
+    def con_perfil(self):
+        """
+        Trae las columnas del Medico y del Paciente del usuario en la misma consulta
+        (LEFT JOIN); Usuario.perfil() arma el perfil con ellas sin volver a consultar.
+        """
+        anotaciones = {}
+        for modelo in (Medico, Paciente):
+            nombre = modelo._meta.model_name
+            for campo in modelo._meta.concrete_fields:
+                anotaciones[f'perfil_{nombre}_{campo.attname}'] = models.F(f'{nombre}__{campo.attname}')
+        return self.annotate(**anotaciones)
+
+
 class Usuario(models.Model):
     TIPO_USUARIO_CHOICES = [
         ('paciente', 'Paciente'),
@@ -22,6 +37,8 @@ class Usuario(models.Model):
     ultima_conexion = models.DateTimeField(default=timezone.now)
     activo = models.BooleanField(default=True)
     
+    objects = UsuarioQuerySet.as_manager()
+    
     class Meta:
         db_table = 'USUARIOS'
         verbose_name = 'Usuario'
@@ -29,6 +46,22 @@ class Usuario(models.Model):
     
     def __str__(self):
         return f"{self.nombre} {self.apellido} ({self.email})"
+    
+    def perfil(self):
+        """Medico o Paciente según tipo_usuario (None si no tiene), sin consulta si vino de con_perfil()"""
+        modelo = {'medico': Medico, 'paciente': Paciente}.get(self.tipo_usuario)
+        if modelo is None:
+            return None
+        nombre = modelo._meta.model_name
+        columnas = [campo.attname for campo in modelo._meta.concrete_fields]
+        if not hasattr(self, f'perfil_{nombre}_{modelo._meta.pk.attname}'):
+            return modelo.objects.filter(id_usuario=self).first()
+        valores = [getattr(self, f'perfil_{nombre}_{columna}') for columna in columnas]
+        if valores[columnas.index(modelo._meta.pk.attname)] is None:
+            return None
+        perfil = modelo.from_db(self._state.db, columnas, valores)
+        perfil.id_usuario = self
+        return perfil
 
 
 class Paciente(models.Model):
@@ -48,6 +81,8 @@ class Paciente(models.Model):
     direccion = models.CharField(max_length=255)
     contacto_emergencia = models.CharField(max_length=100, null=True, blank=True)
     telefono_emergencia = models.CharField(max_length=20, null=True, blank=True)
+    # Nombre, apellido e identificación en minúsculas y sin acentos, para BuscarPacientesAPIView
+    texto_busqueda = models.CharField(max_length=255, blank=True, default='', editable=False)
     
     class Meta:
         db_table = 'PACIENTES'
@@ -56,6 +91,18 @@ class Paciente(models.Model):
     
     def __str__(self):
         return f"Paciente: {self.id_usuario.nombre} {self.id_usuario.apellido}"
+    
+    def construir_texto_busqueda(self, usuario=None):
+        from .busqueda import normalizar_texto
+        usuario = usuario or self.id_usuario
+        return normalizar_texto(f"{usuario.nombre} {usuario.apellido} {self.numero_identificacion or ''}")
+    
+    def save(self, *args, **kwargs):
+        self.texto_busqueda = self.construir_texto_busqueda()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'texto_busqueda'}
+        super().save(*args, **kwargs)
 
 
 class Medico(models.Model):
@@ -77,6 +124,21 @@ class Medico(models.Model):
         return f"Dr. {self.id_usuario.nombre} {self.id_usuario.apellido} - {self.especialidad}"
 
 
+class MedicamentoQuerySet(models.QuerySet):
+    """update() y bulk_create() no emiten señales: invalidan el catálogo aquí"""
+    def update(self, **kwargs):
+        from .busqueda import catalogo_modificado
+        filas = super().update(**kwargs)
+        catalogo_modificado()
+        return filas
+
+    def bulk_create(self, *args, **kwargs):
+        from .busqueda import catalogo_modificado
+        creados = super().bulk_create(*args, **kwargs)
+        catalogo_modificado()
+        return creados
+
+
 class Medicamento(models.Model):
     id_medicamento = models.AutoField(primary_key=True)
     nombre_comercial = models.CharField(max_length=100)
@@ -90,6 +152,8 @@ class Medicamento(models.Model):
     contraindicaciones = models.TextField()
     codigo_barra = models.CharField(max_length=50, unique=True)
     
+    objects = MedicamentoQuerySet.as_manager()
+    
     class Meta:
         db_table = 'MEDICAMENTOS'
         verbose_name = 'Medicamento'
@@ -99,6 +163,16 @@ class Medicamento(models.Model):
         return f"{self.nombre_comercial} ({self.nombre_generico})"
 
 
+class TratamientoQuerySet(models.QuerySet):
+    def con_relaciones(self):
+        """
+        Precarga paciente y médico junto con sus usuarios, que es lo que recorre
+        TratamientoSerializer completo. Las APIView que listan tratamientos deben pasar por
+        aquí; los ViewSets arman el select_related según ?expand=.
+        """
+        return self.select_related('id_paciente__id_usuario', 'id_medico__id_usuario')
+
+
 class Tratamiento(models.Model):
     ESTADO_CHOICES = [
         ('activo', 'Activo'),
@@ -119,6 +193,8 @@ class Tratamiento(models.Model):
     observaciones = models.TextField()
     fecha_creacion = models.DateTimeField(default=timezone.now)
     
+    objects = TratamientoQuerySet.as_manager()
+    
     class Meta:
         db_table = 'TRATAMIENTOS'
         verbose_name = 'Tratamiento'
@@ -140,6 +216,10 @@ class TratamientoMedicamento(models.Model):
     instrucciones_especiales = models.TextField()
     activo = models.BooleanField(default=True)
     
+    # Estado del generador de tomas (appweb/tomas.py)
+    firma_horario = models.CharField(max_length=40, blank=True, default='', editable=False)
+    tomas_generadas_hasta = models.DateField(null=True, blank=True, editable=False)
+    
     class Meta:
         db_table = 'TRATAMIENTO_MEDICAMENTOS'
         verbose_name = 'Tratamiento-Medicamento'
@@ -147,6 +227,51 @@ class TratamientoMedicamento(models.Model):
     
     def __str__(self):
         return f"{self.id_tratamiento} - {self.id_medicamento}"
+    
+    def save(self, *args, **kwargs):
+        # Los campos del generador de tomas solo los escribe el generador (con bulk_update);
+        # una instancia leída antes de generar no debe pisarlos al guardarse
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in ('firma_horario', 'tomas_generadas_hasta')
+            ]
+        super().save(*args, **kwargs)
+
+
+class NotificacionQuerySet(models.QuerySet):
+    def _transicionar(self, estado, desde, **campos):
+        """
+        Pasa a `estado` las notificaciones del queryset que estén en alguno de los
+        estados `desde` con un solo UPDATE, y ajusta los contadores de no leídas con
+        los estados bloqueados antes del cambio. Devuelve la cantidad de filas
+        actualizadas.
+        """
+        from .contadores import ajustar, cambios_por_transicion
+
+        with transaction.atomic(using=self.db):
+            filas = list(
+                self.filter(estado__in=desde).select_for_update(of=('self',)).order_by()
+                .values_list('id_notificacion', 'id_usuario_destino', 'estado')
+            )
+            if not filas:
+                return 0
+            actualizadas = self.model.objects.filter(
+                pk__in=[fila[0] for fila in filas]
+            ).update(estado=estado, **campos)
+            ajustar(cambios_por_transicion([fila[1:] for fila in filas], estado))
+        return actualizadas
+
+    def marcar_como_leidas(self):
+        return self._transicionar('leida', self.model.ESTADOS_NO_LEIDAS, fecha_lectura=timezone.now())
+
+    def marcar_como_enviadas(self):
+        # Una leída no vuelve a enviada: solo se envían las pendientes
+        return self._transicionar('enviada', ('pendiente',), fecha_envio=timezone.now())
+
+    def marcar_como_fallidas(self):
+        # Solo las que se reclamaron como enviadas y nadie leyó mientras tanto
+        return self._transicionar('fallida', ('enviada',))
 
 
 class Notificacion(models.Model):
@@ -176,6 +301,9 @@ class Notificacion(models.Model):
         ('fallida', 'Fallida'),
     ]
     
+    # Estados que cuentan como no leídas (acción no_leidas y ContadorNotificaciones)
+    ESTADOS_NO_LEIDAS = ('pendiente', 'enviada')
+    
     CANAL_ENVIO_CHOICES = [
         ('app', 'Aplicación'),
         ('email', 'Email'),
@@ -272,6 +400,8 @@ class Notificacion(models.Model):
         help_text='Datos adicionales en formato JSON'
     )
     
+    objects = NotificacionQuerySet.as_manager()
+    
     class Meta:
         db_table = 'NOTIFICACIONES'
         verbose_name = 'Notificación'
@@ -283,20 +413,70 @@ class Notificacion(models.Model):
             models.Index(fields=['tipo_notificacion']),
         ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Estado leído de la base, para ajustar el contador de no leídas al guardar
+        instancia._estado_original = instancia.__dict__.get('estado')
+        instancia._destino_original = instancia.__dict__.get('id_usuario_destino_id')
+        return instancia
+    
     def __str__(self):
         return f"{self.get_tipo_notificacion_display()} - {self.titulo} (Para: {self.id_usuario_destino})"
     
+    def _cambiar_estado(self, estado, desde, **campos):
+        """
+        Pasa la notificación a `estado` con un UPDATE condicionado a que siga en
+        alguno de los estados `desde`, y ajusta el contador solo si la fila cambió:
+        dos peticiones simultáneas sobre la misma notificación la cuentan una vez.
+        """
+        from .contadores import ajustar, cambios_por_transicion
+
+        with transaction.atomic():
+            anterior = Notificacion.objects.filter(pk=self.pk, estado__in=desde).values_list('estado', flat=True).first()
+            actualizadas = anterior is not None and Notificacion.objects.filter(
+                pk=self.pk, estado=anterior
+            ).update(estado=estado, **campos)
+            if actualizadas:
+                ajustar(cambios_por_transicion([(self.id_usuario_destino_id, anterior)], estado))
+        if actualizadas:
+            for campo, valor in campos.items():
+                setattr(self, campo, valor)
+            self.estado = self._estado_original = estado
+        return bool(actualizadas)
+    
     def marcar_como_enviada(self):
-        """Marca la notificación como enviada"""
-        self.estado = 'enviada'
-        self.fecha_envio = timezone.now()
-        self.save()
+        """Marca la notificación como enviada (solo si está pendiente)"""
+        return self._cambiar_estado('enviada', ('pendiente',), fecha_envio=timezone.now())
     
     def marcar_como_leida(self):
-        """Marca la notificación como leída"""
-        self.estado = 'leida'
-        self.fecha_lectura = timezone.now()
-        self.save()
+        """Marca la notificación como leída (solo si todavía no lo estaba)"""
+        return self._cambiar_estado('leida', self.ESTADOS_NO_LEIDAS, fecha_lectura=timezone.now())
+
+
+class ContadorNotificaciones(models.Model):
+    """
+    Cantidad de notificaciones no leídas de cada usuario, para el indicador del
+    dashboard. Se mantiene en appweb/contadores.py y se puede reconstruir con un
+    COUNT sobre el índice (id_usuario_destino, estado).
+    """
+    id_usuario = models.OneToOneField(
+        Usuario,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='contador_notificaciones',
+        db_column='id_usuario'
+    )
+    no_leidas = models.IntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'CONTADORES_NOTIFICACIONES'
+        verbose_name = 'Contador de Notificaciones'
+        verbose_name_plural = 'Contadores de Notificaciones'
+    
+    def __str__(self):
+        return f"{self.id_usuario_id}: {self.no_leidas} sin leer"
 
 
 class HistorialAdherencia(models.Model):
@@ -328,6 +508,13 @@ class HistorialAdherencia(models.Model):
         db_table = 'HISTORIAL_ADHERENCIA'
         verbose_name = 'Historial de Adherencia'
         verbose_name_plural = 'Historiales de Adherencia'
+        constraints = [
+            # Un resumen por tratamiento y período (ver appweb/adherencia.py)
+            models.UniqueConstraint(
+                fields=['id_tratamiento', 'fecha_inicio_periodo'],
+                name='adherencia_unica_por_periodo'
+            ),
+        ]
     
     def __str__(self):
         return f"Adherencia - {self.id_paciente} - {self.porcentaje_adherencia}%"
@@ -364,4 +551,160 @@ class PacienteCuidador(models.Model):
         verbose_name_plural = 'Pacientes-Cuidadores'
     
     def __str__(self):
-        return f"Cuidador de {self.id_paciente} - {self.id_usuario}"
\ No newline at end of file
+        return f"Cuidador de {self.id_paciente} - {self.id_usuario}"
+
+
+class TomaProgramada(models.Model):
+    """
+    Cada dosis que el paciente debe tomar, generada a partir de
+    TratamientoMedicamento.horarios para una ventana de días hacia adelante.
+    """
+    id_toma = models.AutoField(primary_key=True)
+    id_tratamiento_medicamento = models.ForeignKey(
+        TratamientoMedicamento,
+        on_delete=models.CASCADE,
+        related_name='tomas_programadas',
+        db_column='id_tratamiento_medicamento'
+    )
+    # Copia del paciente del tratamiento, para consultar el día de un paciente con un solo índice
+    id_paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, db_column='id_paciente')
+    fecha_hora = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'TOMAS_PROGRAMADAS'
+        verbose_name = 'Toma Programada'
+        verbose_name_plural = 'Tomas Programadas'
+        ordering = ['fecha_hora']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['id_tratamiento_medicamento', 'fecha_hora'],
+                name='toma_unica_por_linea_y_hora'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['id_paciente', 'fecha_hora']),
+        ]
+    
+    def __str__(self):
+        return f"Toma {self.fecha_hora:%Y-%m-%d %H:%M} - {self.id_tratamiento_medicamento}"
+
+
+class RegistroToma(models.Model):
+    """
+    Registro de solo inserción de una toma hecha u omitida, por el paciente o por
+    un cuidador autorizado. Los resúmenes de HistorialAdherencia se calculan a
+    partir de estos registros.
+    """
+    ESTADO_CHOICES = [
+        ('tomada', 'Tomada'),
+        ('omitida', 'Omitida'),
+    ]
+    
+    id_registro = models.AutoField(primary_key=True)
+    # Si la toma se regenera o se borra, el registro se conserva con sus datos copiados
+    id_toma = models.OneToOneField(
+        TomaProgramada,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='registro',
+        db_column='id_toma'
+    )
+    id_paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, db_column='id_paciente')
+    id_tratamiento = models.ForeignKey(Tratamiento, on_delete=models.CASCADE, db_column='id_tratamiento')
+    id_tratamiento_medicamento = models.ForeignKey(
+        TratamientoMedicamento,
+        on_delete=models.CASCADE,
+        db_column='id_tratamiento_medicamento'
+    )
+    registrado_por = models.ForeignKey(Usuario, on_delete=models.CASCADE, db_column='registrado_por')
+    estado = models.CharField(max_length=7, choices=ESTADO_CHOICES)
+    fecha_hora_programada = models.DateTimeField()
+    fecha_hora_toma = models.DateTimeField(null=True, blank=True)
+    tardia = models.BooleanField(default=False)
+    notas = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'REGISTRO_TOMAS'
+        verbose_name = 'Registro de Toma'
+        verbose_name_plural = 'Registros de Tomas'
+        indexes = [
+            models.Index(fields=['id_tratamiento', 'fecha_hora_programada']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_estado_display()} - {self.fecha_hora_programada:%Y-%m-%d %H:%M} - {self.id_paciente}"
+
+
+class ProgresoProceso(models.Model):
+    """Posición guardada de un proceso por lotes (marca de agua, último bloque terminado)"""
+    nombre = models.CharField(max_length=100, primary_key=True)
+    posicion = models.BigIntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'PROGRESO_PROCESOS'
+        verbose_name = 'Progreso de Proceso'
+        verbose_name_plural = 'Progreso de Procesos'
+    
+    def __str__(self):
+        return f"{self.nombre}: {self.posicion}"
+
+
+class EtiquetaFDA(models.Model):
+    """
+    Copia persistente de las etiquetas de OpenFDA, para que la caché sobreviva
+    reinicios. Un `resultado` nulo registra que la FDA no tiene ese medicamento.
+    """
+    id_etiqueta = models.AutoField(primary_key=True)
+    nombre_normalizado = models.CharField(max_length=150, unique=True)
+    resultado = models.JSONField(null=True, blank=True)
+    fecha_obtencion = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'ETIQUETAS_FDA'
+        verbose_name = 'Etiqueta FDA'
+        verbose_name_plural = 'Etiquetas FDA'
+    
+    def __str__(self):
+        return f"Etiqueta FDA - {self.nombre_normalizado}"
+
+
+class Traduccion(models.Model):
+    """Memo persistente de traducciones, identificadas por el hash del texto original"""
+    id_traduccion = models.AutoField(primary_key=True)
+    hash_texto = models.CharField(max_length=64, unique=True)
+    idioma_origen = models.CharField(max_length=10)
+    idioma_destino = models.CharField(max_length=10)
+    texto_traducido = models.TextField()
+    fecha_creacion = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'TRADUCCIONES'
+        verbose_name = 'Traducción'
+        verbose_name_plural = 'Traducciones'
+    
+    def __str__(self):
+        return f"Traducción {self.idioma_origen}->{self.idioma_destino} ({self.hash_texto[:8]})"
+
+
+class SesionUsuario(models.Model):
+    """
+    Sesión abierta en el login. El token opaco solo se guarda como hash SHA-256;
+    la validación pasa primero por la caché (ver appweb/sesiones.py).
+    """
+    id_sesion = models.AutoField(primary_key=True)
+    id_usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, db_column='id_usuario')
+    token_hash = models.CharField(max_length=64, unique=True)
+    fecha_creacion = models.DateTimeField(default=timezone.now)
+    fecha_expiracion = models.DateTimeField()
+    revocada = models.BooleanField(default=False)
+    
+    class Meta:
+        db_table = 'SESIONES'
+        verbose_name = 'Sesión'
+        verbose_name_plural = 'Sesiones'
+    
+    def __str__(self):
+        return f"Sesión de {self.id_usuario_id} ({self.token_hash[:8]})"
@@ -0,0 +1,213 @@
+"""
+Despacho de notificaciones programadas.
+
+`despachar_lote()` reclama un lote de notificaciones `pendiente` cuyo momento de
+envío (fecha_hora_programada menos anticipacion_minutos) ya llegó, usando
+SELECT ... FOR UPDATE SKIP LOCKED para que varios procesos puedan despachar a la
+vez sin repetir filas. El lote se marca como `enviada` y se confirma antes de
+entregarlo, de modo que un proveedor lento no retiene los bloqueos; las que el
+backend no entrega pasan luego a `fallida`. Si el proceso muere entre ambos pasos,
+esas notificaciones quedan como enviadas sin haberse entregado (a lo sumo una vez).
+
+Cada lote se entrega por canal a los backends configurados en
+NOTIFICACIONES_BACKENDS (ruta a una clase con el método `enviar(notificaciones)`,
+que recibe la lista de notificaciones de su canal y devuelve el conjunto de ids
+que se entregaron).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mass_mail
+from django.db import transaction
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import contadores
+from .eventos import publicar_notificaciones
+from .models import Notificacion
+
+BACKENDS_POR_DEFECTO = {
+    'app': 'appweb.notificaciones.BackendApp',
+    'email': 'appweb.notificaciones.BackendEmail',
+    'sms': 'appweb.notificaciones.BackendRegistro',
+    'push': 'appweb.notificaciones.BackendRegistro',
+}
+
+# Intervalo de repetición cuando la notificación no indica `intervalo_minutos` en datos_adicionales
+INTERVALO_REPETICION_MINUTOS = 24 * 60
+
+
+# ==================== BACKENDS ====================
+
+class BackendApp:
+    """Notificaciones dentro de la aplicación: se publican a los clientes conectados"""
+    def enviar(self, notificaciones):
+        # Las que no tenían fecha programada ya se publicaron al crearse
+        publicar_notificaciones([n for n in notificaciones if n.fecha_hora_programada is not None])
+        return {n.id_notificacion for n in notificaciones}
+
+
+class BackendEmail:
+    """Envía todos los correos del lote por una sola conexión (EMAIL_BACKEND de Django)"""
+    def enviar(self, notificaciones):
+        remitente = getattr(settings, 'DEFAULT_FROM_EMAIL', None)
+        con_correo = [n for n in notificaciones if n.id_usuario_destino.email]
+        mensajes = [
+            (n.titulo, n.mensaje, remitente, [n.id_usuario_destino.email])
+            for n in con_correo
+        ]
+        send_mass_mail(mensajes, fail_silently=False)
+        return {n.id_notificacion for n in con_correo}
+
+
+class BackendRegistro:
+    """Canal sin proveedor configurado: solo deja constancia en el log"""
+    def enviar(self, notificaciones):
+        for n in notificaciones:
+            print(f"[{n.canal_envio}] {n.titulo} -> {n.id_usuario_destino.email}")
+        return {n.id_notificacion for n in notificaciones}
+
+
+_backends = {}
+
+
+def obtener_backend(canal):
+    rutas = {**BACKENDS_POR_DEFECTO, **getattr(settings, 'NOTIFICACIONES_BACKENDS', {})}
+    ruta = rutas[canal]
+    if ruta not in _backends:
+        _backends[ruta] = import_string(ruta)()
+    return _backends[ruta]
+
+
+# ==================== DESPACHO ====================
+
+def momento_envio(notificacion):
+    """Fecha programada menos la anticipación (None si la notificación no tiene fecha)"""
+    if notificacion.fecha_hora_programada is None:
+        return None
+    return notificacion.fecha_hora_programada - timedelta(minutes=notificacion.anticipacion_minutos or 0)
+
+
+def notificaciones_vencidas(ahora):
+    """Notificaciones pendientes cuyo momento de envío ya llegó, o sin fecha programada"""
+    anticipacion_maxima = timedelta(minutes=getattr(settings, 'NOTIFICACIONES_ANTICIPACION_MAXIMA', 24 * 60))
+    anticipacion = ExpressionWrapper(
+        Coalesce(F('anticipacion_minutos'), 0) * Value(timedelta(minutes=1)),
+        output_field=DurationField()
+    )
+    anticipada = ExpressionWrapper(Value(ahora) + anticipacion, output_field=DateTimeField())
+    return Notificacion.objects.filter(
+        # El rango acotado usa el índice (fecha_hora_programada, estado); la anticipación se aplica después
+        Q(fecha_hora_programada__isnull=True) |
+        (Q(fecha_hora_programada__lte=ahora + anticipacion_maxima) & Q(fecha_hora_programada__lte=anticipada)),
+        estado='pendiente',
+    )
+
+
+def siguiente_ocurrencia(notificacion, ahora):
+    """
+    Copia pendiente de una notificación `repetir` para el siguiente intervalo
+    posterior a `ahora` (datos_adicionales['intervalo_minutos'], por defecto un día).
+    Devuelve None si no corresponde repetirla.
+    """
+    if notificacion.fecha_hora_programada is None:
+        return None
+    linea = notificacion.id_tratamiento_medicamento
+    if linea is not None and not linea.activo:
+        return None
+
+    datos = notificacion.datos_adicionales or {}
+    try:
+        intervalo = timedelta(minutes=int(datos.get('intervalo_minutos', INTERVALO_REPETICION_MINUTOS)))
+    except (TypeError, ValueError):
+        intervalo = timedelta(minutes=INTERVALO_REPETICION_MINUTOS)
+    if intervalo <= timedelta(0):
+        return None
+
+    siguiente = notificacion.fecha_hora_programada + intervalo
+    if siguiente <= ahora:
+        # Las ocurrencias perdidas (worker detenido) no se envían todas juntas
+        saltos = (ahora - siguiente) // intervalo + 1
+        siguiente += intervalo * saltos
+
+    copia = Notificacion(**{
+        campo.attname: getattr(notificacion, campo.attname)
+        for campo in Notificacion._meta.concrete_fields
+        if not campo.primary_key
+    })
+    copia.estado = 'pendiente'
+    copia.fecha_hora_programada = siguiente
+    copia.fecha_creacion = ahora
+    copia.fecha_envio = None
+    copia.fecha_lectura = None
+    return copia
+
+
+def despachar_lote(tamano_lote=100):
+    """
+    Reclama y envía un lote de notificaciones vencidas. Devuelve las métricas del
+    lote: reclamadas, enviadas, fallidas, repetidas y el retraso (segundos) respecto
+    del momento programado.
+    """
+    metricas = {'reclamadas': 0, 'enviadas': 0, 'fallidas': 0, 'repetidas': 0,
+                'retraso_promedio': 0.0, 'retraso_maximo': 0.0}
+
+    # 1. Reclamar: el lote pasa a `enviada` y se confirma antes de hablar con los proveedores
+    with transaction.atomic():
+        ahora = timezone.now()
+        lote = list(
+            notificaciones_vencidas(ahora)
+            .select_related('id_usuario_destino', 'id_tratamiento_medicamento')
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('fecha_hora_programada', 'id_notificacion')[:tamano_lote]
+        )
+        if not lote:
+            return metricas
+
+        ids = {n.id_notificacion for n in lote}
+        # pendiente -> enviada no cambia el contador de no leídas
+        Notificacion.objects.filter(pk__in=ids).update(estado='enviada', fecha_envio=ahora)
+        for notificacion in lote:
+            notificacion.estado, notificacion.fecha_envio = 'enviada', ahora
+
+        siguientes = [
+            copia for copia in (siguiente_ocurrencia(n, ahora) for n in lote if n.repetir)
+            if copia is not None
+        ]
+        Notificacion.objects.bulk_create(siguientes)
+        contadores.registrar_creadas(siguientes)
+
+    # 2. Entregar, sin bloqueos abiertos
+    por_canal = {}
+    for notificacion in lote:
+        por_canal.setdefault(notificacion.canal_envio, []).append(notificacion)
+
+    enviadas = set()
+    for canal, notificaciones in por_canal.items():
+        try:
+            enviadas |= set(obtener_backend(canal).enviar(notificaciones))
+        except Exception as e:
+            print(f"Error al despachar notificaciones por '{canal}': {e}")
+
+    # 3. Las no entregadas pasan a `fallida` (salvo que ya se hayan leído)
+    ahora_envio = timezone.now()
+    enviadas &= ids
+    fallidas = ids - enviadas
+    if fallidas:
+        Notificacion.objects.filter(pk__in=fallidas).marcar_como_fallidas()
+
+    retrasos = [
+        max(0.0, (ahora_envio - momento).total_seconds())
+        for momento in (momento_envio(n) for n in lote) if momento is not None
+    ]
+    metricas.update(
+        reclamadas=len(lote),
+        enviadas=len(enviadas),
+        fallidas=len(fallidas),
+        repetidas=len(siguientes),
+        retraso_promedio=sum(retrasos) / len(retrasos) if retrasos else 0.0,
+        retraso_maximo=max(retrasos, default=0.0),
+    )
+    return metricas
@@ -0,0 +1,219 @@
+"""
+Caché de etiquetas de OpenFDA.
+
+Las etiquetas se guardan por nombre comercial normalizado en dos niveles: la caché
+de Django (rápida) y la tabla ETIQUETAS_FDA (sobrevive reinicios). Una etiqueta
+vencida se sigue sirviendo durante OPENFDA_CACHE_STALE segundos mientras se
+revalida en segundo plano, y las consultas simultáneas por el mismo medicamento
+comparten una sola llamada a api.fda.gov.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import EtiquetaFDA
+
+
+class ErrorOpenFDA(requests.exceptions.RequestException):
+    """OpenFDA respondió con un estado distinto de 200 o 404"""
+
+
+def normalizar_nombre(nombre):
+    return ' '.join(nombre.split()).lower()
+
+
+def _configuracion(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+def _clave_cache(nombre_normalizado):
+    digest = hashlib.sha1(nombre_normalizado.encode('utf-8')).hexdigest()
+    return f'openfda:etiqueta:{digest}'
+
+
+def _ttl(entrada):
+    if entrada['resultado'] is None:
+        return _configuracion('OPENFDA_CACHE_TTL_NO_ENCONTRADO', 60 * 60)
+    return _configuracion('OPENFDA_CACHE_TTL', 60 * 60 * 24)
+
+
+def _guardar_en_cache(nombre_normalizado, entrada):
+    tiempo_vida = _ttl(entrada) + _configuracion('OPENFDA_CACHE_STALE', 60 * 60 * 24 * 7)
+    cache.set(_clave_cache(nombre_normalizado), entrada, tiempo_vida)
+
+
+# ==================== SINGLE-FLIGHT ====================
+
+class _Vuelo:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+_vuelos = {}
+_vuelos_lock = threading.Lock()
+
+
+def _un_solo_vuelo(clave, funcion):
+    """
+    Ejecuta `funcion` una sola vez por `clave` aunque la pidan varios hilos a la vez;
+    los demás esperan y reciben el mismo resultado (o la misma excepción).
+    """
+    with _vuelos_lock:
+        vuelo = _vuelos.get(clave)
+        lider = vuelo is None
+        if lider:
+            vuelo = _vuelos[clave] = _Vuelo()
+
+    if not lider:
+        vuelo.evento.wait()
+        if vuelo.error is not None:
+            raise vuelo.error
+        return vuelo.resultado
+
+    try:
+        vuelo.resultado = funcion()
+        return vuelo.resultado
+    except Exception as e:
+        vuelo.error = e
+        raise
+    finally:
+        with _vuelos_lock:
+            del _vuelos[clave]
+        vuelo.evento.set()
+
+
+def _en_vuelo(clave):
+    with _vuelos_lock:
+        return clave in _vuelos
+
+
+# ==================== CONSULTA A OPENFDA ====================
+
+def consultar_openfda(nombre_normalizado):
+    """
+    Llama a OpenFDA y devuelve el primer resultado de la etiqueta, o None si el
+    medicamento no existe. Lanza ErrorOpenFDA (o la excepción de requests) si falla.
+    """
+    url = f'{_configuracion("OPENFDA_URL", "https://api.fda.gov/drug/label.json")}?search=openfda.brand_name:"{nombre_normalizado}"&limit=1'
+    response = requests.get(url, timeout=_configuracion('OPENFDA_TIMEOUT', 10))
+
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise ErrorOpenFDA(f'OpenFDA respondió {response.status_code}')
+
+    resultados = response.json().get('results')
+    return resultados[0] if resultados else None
+
+
+def _refrescar(nombre_normalizado):
+    """Consulta OpenFDA y actualiza ambos niveles de caché"""
+    resultado = consultar_openfda(nombre_normalizado)
+    entrada = {'resultado': resultado, 'obtenido': time.time()}
+
+    try:
+        EtiquetaFDA.objects.update_or_create(
+            nombre_normalizado=nombre_normalizado,
+            defaults={'resultado': resultado, 'fecha_obtencion': timezone.now()}
+        )
+    except DatabaseError as e:
+        # La tabla es solo el segundo nivel de caché: la etiqueta ya se obtuvo
+        print(f"Error al guardar etiqueta FDA '{nombre_normalizado}': {e}")
+    _guardar_en_cache(nombre_normalizado, entrada)
+    return entrada
+
+
+def _revalidar_en_segundo_plano(nombre_normalizado):
+    clave = _clave_cache(nombre_normalizado)
+    if _en_vuelo(clave):
+        return
+
+    # Entre procesos, solo uno revalida cada etiqueta (cache.add es atómico)
+    clave_bloqueo = f'{clave}:revalidando'
+    if not cache.add(clave_bloqueo, True, _configuracion('OPENFDA_TIMEOUT', 10) * 3):
+        return
+
+    def tarea():
+        try:
+            _un_solo_vuelo(clave, lambda: _refrescar(nombre_normalizado))
+        except Exception as e:
+            print(f"Error al revalidar etiqueta FDA '{nombre_normalizado}': {e}")
+        finally:
+            cache.delete(clave_bloqueo)
+            connection.close()
+
+    threading.Thread(target=tarea, daemon=True).start()
+
+
+def _leer_entrada(nombre_normalizado):
+    entrada = cache.get(_clave_cache(nombre_normalizado))
+    if entrada is not None:
+        return entrada
+
+    etiqueta = EtiquetaFDA.objects.filter(nombre_normalizado=nombre_normalizado).first()
+    if etiqueta is None:
+        return None
+
+    entrada = {'resultado': etiqueta.resultado, 'obtenido': etiqueta.fecha_obtencion.timestamp()}
+    _guardar_en_cache(nombre_normalizado, entrada)
+    return entrada
+
+
+def obtener_etiqueta(nombre):
+    """
+    Devuelve la etiqueta de OpenFDA del medicamento (el dict de `results[0]`)
+    o None si la FDA no lo tiene, pasando por la caché.
+    """
+    nombre_normalizado = normalizar_nombre(nombre)
+    entrada = _leer_entrada(nombre_normalizado)
+
+    if entrada is not None:
+        edad = time.time() - entrada['obtenido']
+        if edad < _ttl(entrada):
+            return entrada['resultado']
+        if edad < _ttl(entrada) + _configuracion('OPENFDA_CACHE_STALE', 60 * 60 * 24 * 7):
+            _revalidar_en_segundo_plano(nombre_normalizado)
+            return entrada['resultado']
+
+    entrada = _un_solo_vuelo(
+        _clave_cache(nombre_normalizado),
+        lambda: _refrescar(nombre_normalizado)
+    )
+    return entrada['resultado']
+
+
+def obtener_etiquetas(nombres):
+    """
+    Obtiene las etiquetas de varios medicamentos en paralelo (un hilo por nombre,
+    hasta OPENFDA_MAX_CONCURRENCIA). Devuelve {nombre: etiqueta o None}; un nombre
+    cuya consulta falló queda con la excepción en lugar de la etiqueta.
+    """
+    def obtener(nombre):
+        try:
+            return obtener_etiqueta(nombre)
+        except requests.exceptions.RequestException as e:
+            return e
+
+    def obtener_en_hilo(nombre):
+        try:
+            return obtener(nombre)
+        finally:
+            # Cada hilo del pool abre su propia conexión a la base de datos
+            connection.close()
+
+    nombres = list(dict.fromkeys(nombres))
+    if len(nombres) <= 1:
+        return {nombre: obtener(nombre) for nombre in nombres}
+
+    hilos = min(len(nombres), _configuracion('OPENFDA_MAX_CONCURRENCIA', 8))
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        return dict(zip(nombres, ejecutor.map(obtener_en_hilo, nombres)))
@@ -0,0 +1,91 @@
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PaginacionCursorPK(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre la llave primaria AutoField del modelo.
+
+    Solo se activa cuando el cliente envía `limite` o `cursor`; sin ellos se devuelve
+    la lista completa como siempre, para no romper a los clientes existentes.
+    El cuerpo de la respuesta no cambia: el siguiente cursor viaja en las cabeceras
+    `X-Siguiente-Cursor` y `Link`. Como el cursor es la última llave entregada, cada
+    página es un `WHERE pk > cursor ORDER BY pk LIMIT n` y su costo no depende de la
+    profundidad.
+    """
+    cursor_query_param = 'cursor'
+    limite_query_param = 'limite'
+    limite_por_defecto = 50
+    limite_maximo = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        parametros = request.query_params
+        if self.cursor_query_param not in parametros and self.limite_query_param not in parametros:
+            return None
+
+        self.request = request
+        self.limite = self.obtener_limite(parametros)
+        cursor = self.obtener_cursor(parametros)
+
+        queryset = queryset.order_by('pk')
+        if cursor is not None:
+            queryset = queryset.filter(pk__gt=cursor)
+
+        filas = list(queryset[:self.limite + 1])
+        hay_siguiente = len(filas) > self.limite
+        filas = filas[:self.limite]
+        self.siguiente_cursor = filas[-1].pk if hay_siguiente else None
+        return filas
+
+    def obtener_limite(self, parametros):
+        valor = parametros.get(self.limite_query_param)
+        if valor is None:
+            return self.limite_por_defecto
+        try:
+            limite = int(valor)
+        except (TypeError, ValueError):
+            raise ValidationError({self.limite_query_param: 'Debe ser un número entero.'})
+        if limite < 1:
+            raise ValidationError({self.limite_query_param: 'Debe ser mayor que cero.'})
+        return min(limite, self.limite_maximo)
+
+    def obtener_cursor(self, parametros):
+        valor = parametros.get(self.cursor_query_param)
+        if not valor:
+            return None
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            raise ValidationError({self.cursor_query_param: 'Cursor inválido.'})
+
+    def get_siguiente_url(self):
+        if self.siguiente_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limite_query_param, self.limite)
+        return replace_query_param(url, self.cursor_query_param, self.siguiente_cursor)
+
+    def get_encabezados(self):
+        if self.siguiente_cursor is None:
+            return {}
+        return {
+            'X-Siguiente-Cursor': str(self.siguiente_cursor),
+            'Link': f'<{self.get_siguiente_url()}>; rel="next"',
+        }
+
+    def get_paginated_response(self, data):
+        return Response(data, headers=self.get_encabezados())
+
+
+def listar_paginado(request, queryset, serializer_class, view=None):
+    """Serializa `queryset` aplicando PaginacionCursorPK si el cliente la pidió"""
+    paginador = PaginacionCursorPK()
+    pagina = paginador.paginate_queryset(queryset, request, view=view)
+    if pagina is None:
+        serializer = serializer_class(queryset, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    serializer = serializer_class(pagina, many=True)
+    return paginador.get_paginated_response(serializer.data)
@@ -0,0 +1,125 @@
+"""
+Creación de recetas médicas (Tratamiento + TratamientoMedicamento + aviso al paciente).
+
+Los médicos, pacientes y medicamentos de todas las recetas de una petición se
+cargan con un in_bulk por modelo (ReferenciasReceta) y los usa la validación de
+CrearRecetaSerializer; `crear_recetas()` inserta tratamientos, líneas y
+notificaciones con un bulk_create por tabla dentro de una sola transacción.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+
+from . import contadores
+from .eventos import publicar_notificaciones
+from .models import Medicamento, Medico, Notificacion, Paciente, Tratamiento, TratamientoMedicamento
+from .tomas import generar_tomas
+
+
+def _ids(valores):
+    ids = set()
+    for valor in valores:
+        try:
+            ids.add(int(valor))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+class ReferenciasReceta:
+    """Médicos y pacientes (con su usuario) y medicamentos citados en una lista de recetas sin validar"""
+
+    def __init__(self, recetas):
+        recetas = [r for r in recetas if isinstance(r, dict)]
+        lineas = [
+            linea for r in recetas
+            for linea in (r.get('medicamentos') if isinstance(r.get('medicamentos'), list) else [])
+            if isinstance(linea, dict)
+        ]
+        self.medicos = Medico.objects.select_related('id_usuario').in_bulk(_ids(r.get('id_medico') for r in recetas))
+        self.pacientes = Paciente.objects.select_related('id_usuario').in_bulk(_ids(r.get('id_paciente') for r in recetas))
+        self.medicamentos = Medicamento.objects.in_bulk(_ids(linea.get('id_medicamento') for linea in lineas))
+
+
+def crear_recetas(recetas):
+    """
+    Crea las recetas (validated_data de CrearRecetaSerializer, con 'medico',
+    'paciente' y el 'medicamento' de cada línea ya resueltos) en una transacción.
+    Devuelve los tratamientos creados, cada uno con sus líneas en `lineas_receta`.
+    """
+    with transaction.atomic():
+        tratamientos = Tratamiento.objects.bulk_create([
+            Tratamiento(
+                id_paciente=datos['paciente'],
+                id_medico=datos['medico'],
+                diagnostico=datos['diagnostico'],
+                fecha_inicio=datos['fecha_emision'],
+                fecha_fin=datos['fecha_emision'] + timedelta(days=datos['vigencia_dias']),
+                duracion_dias=datos['vigencia_dias'],
+                tipo_tratamiento='Receta Médica',
+                objetivo_terapeutico=datos.get('instrucciones', ''),
+                estado='activo',
+                observaciones=''
+            )
+            for datos in recetas
+        ])
+
+        lineas = []
+        for tratamiento, datos in zip(tratamientos, recetas):
+            tratamiento.lineas_receta = [
+                TratamientoMedicamento(
+                    id_tratamiento=tratamiento,
+                    id_medicamento=linea['medicamento'],
+                    dosis=linea['dosis'],
+                    frecuencia=linea['frecuencia'],
+                    via_administracion=linea['via_administracion'],
+                    duracion_dias=linea['duracion_dias'],
+                    horarios=linea.get('horarios', []),
+                    instrucciones_especiales=linea.get('instrucciones_especiales', ''),
+                    activo=True
+                )
+                for linea in datos['medicamentos']
+            ]
+            lineas.extend(tratamiento.lineas_receta)
+        TratamientoMedicamento.objects.bulk_create(lineas, batch_size=1000)
+
+        notificaciones = [
+            Notificacion(
+                id_usuario_destino=tratamiento.id_paciente.id_usuario,
+                tipo_notificacion='mensaje_medico',
+                titulo='Nueva Receta Médica',
+                mensaje=f'El Dr. {tratamiento.id_medico.id_usuario.nombre} {tratamiento.id_medico.id_usuario.apellido} ha emitido una nueva receta.',
+                estado='pendiente'
+            )
+            for tratamiento in tratamientos
+        ]
+        Notificacion.objects.bulk_create(notificaciones)
+
+        # bulk_create no emite post_save: tomas, contadores y publicación se hacen aquí
+        generar_tomas(TratamientoMedicamento.objects.filter(pk__in=[linea.pk for linea in lineas]))
+        contadores.registrar_creadas(notificaciones)
+        publicar_notificaciones(notificaciones)
+
+    return tratamientos
+
+
+def receta_a_dict(tratamiento):
+    usuario_paciente = tratamiento.id_paciente.id_usuario
+    usuario_medico = tratamiento.id_medico.id_usuario
+    return {
+        'id_tratamiento': tratamiento.id_tratamiento,
+        'paciente': f"{usuario_paciente.nombre} {usuario_paciente.apellido}",
+        'medico': f"Dr. {usuario_medico.nombre} {usuario_medico.apellido}",
+        'diagnostico': tratamiento.diagnostico,
+        'fecha_emision': tratamiento.fecha_inicio,
+        'fecha_vencimiento': tratamiento.fecha_fin,
+        'medicamentos': [
+            {
+                'id_tratamiento_medicamento': linea.id_tratamiento_medicamento,
+                'medicamento': linea.id_medicamento.nombre_comercial,
+                'dosis': linea.dosis,
+                'frecuencia': linea.frecuencia
+            }
+            for linea in tratamiento.lineas_receta
+        ]
+    }
@@ -1,11 +1,81 @@
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 from .models import (
     Usuario, Paciente, Medico, Medicamento, 
     Tratamiento, TratamientoMedicamento,
-    HistorialAdherencia, Notificacion, PacienteCuidador
+    HistorialAdherencia, Notificacion, PacienteCuidador, TomaProgramada,
+    RegistroToma
 )
+from .recetas import ReferenciasReceta
 
-class UsuarioSerializer(serializers.ModelSerializer):
+
+def arbol_de_rutas(valor):
+    """Convierte 'a.b,c' (parámetros ?expand= y ?fields=) en {'a': {'b': {}}, 'c': {}}"""
+    arbol = {}
+    for ruta in (valor or '').split(','):
+        nodo = arbol
+        for nombre in ruta.strip().split('.'):
+            if nombre:
+                nodo = nodo.setdefault(nombre, {})
+    return arbol
+
+
+def _subarbol(arbol, ruta):
+    for nombre in ruta:
+        arbol = arbol.get(nombre, {})
+    return arbol
+
+
+class ExpandibleMixin:
+    """
+    Si el contexto trae `expansiones` (lo agrega CamposExpandiblesMixin desde ?expand=),
+    los serializadores anidados solo se incluyen cuando se pidieron y el objeto queda
+    representado por su id; sin `expansiones` se serializa el árbol completo, como en
+    las APIView. `campos` (?fields=) limita los campos de cada nivel.
+    """
+    # select_related que necesitan los campos propios del serializador (no los anidados)
+    relaciones = ()
+
+    def _ruta(self):
+        ruta = []
+        nodo = self
+        while nodo.parent is not None:
+            if nodo.field_name:
+                ruta.append(nodo.field_name)
+            nodo = nodo.parent
+        return ruta[::-1]
+
+    def get_fields(self):
+        campos = super().get_fields()
+        expansiones = self.context.get('expansiones')
+        if expansiones is None:
+            return campos
+
+        ruta = self._ruta()
+        expandir = _subarbol(expansiones, ruta)
+        seleccion = _subarbol(self.context.get('campos') or {}, ruta)
+        for nombre, campo in list(campos.items()):
+            if isinstance(campo, serializers.BaseSerializer) and nombre not in expandir:
+                del campos[nombre]
+            elif seleccion and nombre not in seleccion:
+                del campos[nombre]
+        return campos
+
+    @classmethod
+    def rutas_select_related(cls, expansiones, prefijo=''):
+        """Rutas de select_related para serializar con `expansiones`"""
+        rutas = [prefijo + relacion for relacion in cls.relaciones]
+        for nombre, subarbol in expansiones.items():
+            campo = cls._declared_fields.get(nombre)
+            if not isinstance(campo, ExpandibleMixin):
+                raise ValidationError({'expand': f"'{nombre}' no se puede expandir en {cls.Meta.model.__name__}"})
+            ruta = prefijo + campo.source.replace('.', '__')
+            rutas.append(ruta)
+            rutas.extend(type(campo).rutas_select_related(subarbol, ruta + '__'))
+        return rutas
+
+
+class UsuarioSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo Usuario"""
     class Meta:
         model = Usuario
@@ -19,8 +89,9 @@ class UsuarioSerializer(serializers.ModelSerializer):
             'password_hash': {'write_only': True}
         }
 
-class PacienteSerializer(serializers.ModelSerializer):
+class PacienteSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo Paciente"""
+    relaciones = ('id_usuario',)  # nombre_completo
     usuario = UsuarioSerializer(source='id_usuario', read_only=True)
     nombre_completo = serializers.SerializerMethodField()
     
@@ -37,8 +108,9 @@ class PacienteSerializer(serializers.ModelSerializer):
     def get_nombre_completo(self, obj):
         return f"{obj.id_usuario.nombre} {obj.id_usuario.apellido}"
 
-class MedicoSerializer(serializers.ModelSerializer):
+class MedicoSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo Medico"""
+    relaciones = ('id_usuario',)  # nombre_completo
     usuario = UsuarioSerializer(source='id_usuario', read_only=True)
     nombre_completo = serializers.SerializerMethodField()
     
@@ -54,7 +126,7 @@ class MedicoSerializer(serializers.ModelSerializer):
     def get_nombre_completo(self, obj):
         return f"Dr. {obj.id_usuario.nombre} {obj.id_usuario.apellido}"
 
-class MedicamentoSerializer(serializers.ModelSerializer):
+class MedicamentoSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo Medicamento"""
     class Meta:
         model = Medicamento
@@ -66,7 +138,7 @@ class MedicamentoSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id_medicamento']
 
-class TratamientoSerializer(serializers.ModelSerializer):
+class TratamientoSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo Tratamiento"""
     paciente = PacienteSerializer(source='id_paciente', read_only=True)
     medico = MedicoSerializer(source='id_medico', read_only=True)
@@ -81,7 +153,7 @@ class TratamientoSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id_tratamiento', 'fecha_creacion']
 
-class TratamientoMedicamentoSerializer(serializers.ModelSerializer):
+class TratamientoMedicamentoSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo TratamientoMedicamento"""
     tratamiento = TratamientoSerializer(source='id_tratamiento', read_only=True)
     medicamento = MedicamentoSerializer(source='id_medicamento', read_only=True)
@@ -96,7 +168,34 @@ class TratamientoMedicamentoSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id_tratamiento_medicamento']
 
-class NotificacionSerializer(serializers.ModelSerializer):
+class TomaProgramadaSerializer(ExpandibleMixin, serializers.ModelSerializer):
+    """Serializador de solo lectura para las tomas generadas desde los horarios"""
+    relaciones = ('id_tratamiento_medicamento__id_medicamento',)
+    id_medicamento = serializers.IntegerField(source='id_tratamiento_medicamento.id_medicamento_id', read_only=True)
+    medicamento = serializers.CharField(source='id_tratamiento_medicamento.id_medicamento.nombre_comercial', read_only=True)
+    dosis = serializers.CharField(source='id_tratamiento_medicamento.dosis', read_only=True)
+    via_administracion = serializers.CharField(source='id_tratamiento_medicamento.via_administracion', read_only=True)
+    instrucciones_especiales = serializers.CharField(
+        source='id_tratamiento_medicamento.instrucciones_especiales', read_only=True
+    )
+    
+    class Meta:
+        model = TomaProgramada
+        fields = [
+            'id_toma', 'id_tratamiento_medicamento', 'id_paciente', 'fecha_hora',
+            'id_medicamento', 'medicamento', 'dosis', 'via_administracion',
+            'instrucciones_especiales'
+        ]
+        read_only_fields = fields
+
+class RegistroTomaSerializer(ExpandibleMixin, serializers.ModelSerializer):
+    """Serializador de solo lectura para los registros de tomas"""
+    class Meta:
+        model = RegistroToma
+        fields = '__all__'
+        read_only_fields = [campo.name for campo in RegistroToma._meta.fields]
+
+class NotificacionSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo Notificacion unificado"""
     usuario_origen = UsuarioSerializer(source='id_usuario_origen', read_only=True)
     usuario_destino = UsuarioSerializer(source='id_usuario_destino', read_only=True)
@@ -118,7 +217,7 @@ class NotificacionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id_notificacion', 'fecha_creacion', 'fecha_envio', 'fecha_lectura']
 
-class HistorialAdherenciaSerializer(serializers.ModelSerializer):
+class HistorialAdherenciaSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo HistorialAdherencia"""
     paciente = PacienteSerializer(source='id_paciente', read_only=True)
     tratamiento = TratamientoSerializer(source='id_tratamiento', read_only=True)
@@ -128,7 +227,7 @@ class HistorialAdherenciaSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['id_historial']
 
-class PacienteCuidadorSerializer(serializers.ModelSerializer):
+class PacienteCuidadorSerializer(ExpandibleMixin, serializers.ModelSerializer):
     """Serializador para el modelo PacienteCuidador"""
     class Meta:
         model = PacienteCuidador
@@ -137,6 +236,17 @@ class PacienteCuidadorSerializer(serializers.ModelSerializer):
 
 # Serializadores para creación combinada
 
+def email_registrado(serializer, email):
+    """
+    La importación masiva pasa en el contexto 'emails_registrados' (un conjunto
+    consultado una vez por lote); si no, se consulta la base de datos.
+    """
+    registrados = serializer.context.get('emails_registrados')
+    if registrados is not None:
+        return email in registrados
+    return Usuario.objects.filter(email=email).exists()
+
+
 class CrearMedicoSerializer(serializers.Serializer):
     """Serializador para crear médico con usuario"""
     # Datos del usuario
@@ -155,7 +265,7 @@ class CrearMedicoSerializer(serializers.Serializer):
     certificaciones = serializers.CharField()
     
     def validate_email(self, value):
-        if Usuario.objects.filter(email=value).exists():
+        if email_registrado(self, value):
             raise serializers.ValidationError("Este correo electrónico ya está registrado.")
         return value
     
@@ -186,7 +296,7 @@ class CrearPacienteSerializer(serializers.Serializer):
     telefono_emergencia = serializers.CharField(max_length=20, required=False, allow_blank=True)
     
     def validate_email(self, value):
-        if Usuario.objects.filter(email=value).exists():
+        if email_registrado(self, value):
             raise serializers.ValidationError("Este correo electrónico ya está registrado.")
         return value
 
@@ -212,17 +322,38 @@ class CrearRecetaSerializer(serializers.Serializer):
     vigencia_dias = serializers.IntegerField(min_value=1, max_value=180, default=30)
     medicamentos = MedicamentoRecetaSerializer(many=True)
     
+    def referencias(self):
+        """
+        Médicos, pacientes y medicamentos de todas las recetas de la petición, cargados
+        una vez (la vista puede pasarlos en el contexto como 'referencias')
+        """
+        if 'referencias' not in self.context:
+            datos = self.root.initial_data
+            self.context['referencias'] = ReferenciasReceta(datos if isinstance(datos, list) else [datos])
+        return self.context['referencias']
+    
     def validate_medicamentos(self, value):
         if not value:
             raise serializers.ValidationError("Debe agregar al menos un medicamento.")
-        return value
+        medicamentos = self.referencias().medicamentos
+        faltantes = sorted({m['id_medicamento'] for m in value if m['id_medicamento'] not in medicamentos})
+        if faltantes:
+            raise serializers.ValidationError(f"Los medicamentos {faltantes} no existen.")
+        return [{**m, 'medicamento': medicamentos[m['id_medicamento']]} for m in value]
     
     def validate_id_medico(self, value):
-        if not Medico.objects.filter(id_medico=value).exists():
+        if value not in self.referencias().medicos:
             raise serializers.ValidationError("El médico no existe.")
         return value
     
     def validate_id_paciente(self, value):
-        if not Paciente.objects.filter(id_paciente=value).exists():
+        if value not in self.referencias().pacientes:
             raise serializers.ValidationError("El paciente no existe.")
-        return value
\ No newline at end of file
+        return value
+    
+    def validate(self, attrs):
+        # Los objetos ya cargados viajan en validated_data para no volver a buscarlos
+        referencias = self.referencias()
+        attrs['medico'] = referencias.medicos[attrs['id_medico']]
+        attrs['paciente'] = referencias.pacientes[attrs['id_paciente']]
+        return attrs
\ No newline at end of file
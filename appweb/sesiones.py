@@ -0,0 +1,115 @@
+"""
+Sesiones con token opaco.
+
+El login crea una SesionUsuario y devuelve un token aleatorio; el cliente lo envía
+en la cabecera `Authorization: Token <token>`. La base de datos solo guarda el hash
+SHA-256 del token.
+
+Validar un token recorre tres niveles: un LRU en memoria del proceso (pocos segundos,
+SESION_CACHE_LOCAL_TTL), la caché compartida (SESION_CACHE_TTL) y, si ambos fallan,
+la tabla SESIONES junto con el usuario, que es el único momento en que se vuelve a
+comprobar Usuario.activo. Al revocar se marca la fila como revocada y se borra la
+entrada de la caché compartida; otros procesos pueden aceptar el token, como mucho,
+hasta que venza su entrada local.
+"""
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .memo import MemoLRU
+from .models import SesionUsuario
+from .serializers import UsuarioSerializer
+
+PREFIJO_CACHE = 'sesion:'
+
+memo = MemoLRU(getattr(settings, 'SESION_MEMO_CAPACIDAD', 10000))
+
+
+def _hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def token_de_request(request):
+    """Token de la cabecera `Authorization: Token <token>` (None si no viene)"""
+    partes = request.headers.get('Authorization', '').split()
+    if len(partes) == 2 and partes[0].lower() == 'token':
+        return partes[1]
+    return None
+
+
+def _guardar(token_hash, datos):
+    """Guarda la sesión validada en la caché compartida y en el LRU local"""
+    restante = datos['expira'] - time.time()
+    if restante <= 0:
+        return
+    cache.set(PREFIJO_CACHE + token_hash, datos, min(getattr(settings, 'SESION_CACHE_TTL', 300), restante))
+    memo.set(token_hash, (datos, time.monotonic() + min(getattr(settings, 'SESION_CACHE_LOCAL_TTL', 10), restante)))
+
+
+def crear_sesion(usuario):
+    """Abre una sesión para `usuario` y devuelve (token, datos de la sesión)"""
+    token = secrets.token_urlsafe(32)
+    sesion = SesionUsuario.objects.create(
+        id_usuario=usuario,
+        token_hash=_hash(token),
+        fecha_expiracion=timezone.now() + timedelta(seconds=getattr(settings, 'SESION_DURACION', 60 * 60 * 12))
+    )
+    datos = {'usuario': dict(UsuarioSerializer(usuario).data), 'expira': sesion.fecha_expiracion.timestamp()}
+    _guardar(sesion.token_hash, datos)
+    return token, datos
+
+
+def validar(token):
+    """Datos de la sesión ({'usuario', 'expira'}) o None si el token no es válido"""
+    if not token:
+        return None
+    token_hash = _hash(token)
+
+    local = memo.get(token_hash)
+    if local is not None:
+        datos, vence = local
+        if time.monotonic() < vence and time.time() < datos['expira']:
+            return datos
+        memo.delete(token_hash)
+
+    datos = cache.get(PREFIJO_CACHE + token_hash)
+    if datos is None:
+        sesion = SesionUsuario.objects.select_related('id_usuario').filter(
+            token_hash=token_hash, revocada=False, fecha_expiracion__gt=timezone.now()
+        ).first()
+        if sesion is None or not sesion.id_usuario.activo:
+            return None
+        datos = {'usuario': dict(UsuarioSerializer(sesion.id_usuario).data), 'expira': sesion.fecha_expiracion.timestamp()}
+    _guardar(token_hash, datos)
+    return datos
+
+
+def _olvidar(hashes):
+    cache.delete_many([PREFIJO_CACHE + token_hash for token_hash in hashes])
+    for token_hash in hashes:
+        memo.delete(token_hash)
+
+
+def revocar(token):
+    """Cierra la sesión del token; devuelve False si no existía o ya estaba cerrada"""
+    token_hash = _hash(token)
+    revocadas = SesionUsuario.objects.filter(token_hash=token_hash, revocada=False).update(revocada=True)
+    _olvidar([token_hash])
+    return bool(revocadas)
+
+
+def revocar_sesiones_usuario(usuario_id, excepto=None):
+    """Cierra todas las sesiones abiertas del usuario, salvo la del token `excepto`"""
+    sesiones = SesionUsuario.objects.filter(id_usuario=usuario_id, revocada=False)
+    if excepto:
+        sesiones = sesiones.exclude(token_hash=_hash(excepto))
+    hashes = list(sesiones.values_list('token_hash', flat=True))
+    if hashes:
+        SesionUsuario.objects.filter(token_hash__in=hashes).update(revocada=True)
+        _olvidar(hashes)
+    return len(hashes)
@@ -1,4 +1,4 @@
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.hashers import make_password
 from django.utils import timezone
@@ -42,5 +42,70 @@ def create_default_admin(sender, **kwargs):
     print(f"🔑 Password: {admin_password}")
 
 
+@receiver(post_save, sender='appweb.Medicamento')
+@receiver(post_delete, sender='appweb.Medicamento')
+def invalidar_catalogo_medicamentos(sender, **kwargs):
+    # Los índices de búsqueda y las respuestas del catálogo se rehacen con la nueva versión
+    from .busqueda import catalogo_modificado
+    catalogo_modificado()
 
 
+@receiver(post_save, sender='appweb.Usuario')
+def actualizar_texto_busqueda_paciente(sender, instance, created, **kwargs):
+    # El texto de búsqueda del paciente incluye nombre y apellido del usuario
+    if created or instance.tipo_usuario != 'paciente':
+        return
+
+    from .models import Paciente
+
+    pacientes = list(Paciente.objects.filter(id_usuario=instance))
+    for paciente in pacientes:
+        paciente.texto_busqueda = paciente.construir_texto_busqueda(instance)
+    Paciente.objects.bulk_update(pacientes, ['texto_busqueda'])
+
+
+@receiver(post_save, sender='appweb.TratamientoMedicamento')
+def generar_tomas_linea(sender, instance, **kwargs):
+    # Solo se regeneran las tomas si cambió algo que las determina (ver tomas.firma_linea)
+    from .models import TratamientoMedicamento
+    from .tomas import generar_tomas
+    generar_tomas(TratamientoMedicamento.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender='appweb.Tratamiento')
+def generar_tomas_tratamiento(sender, instance, created, **kwargs):
+    # Las fechas y el estado del tratamiento también definen las tomas de sus líneas
+    if created:
+        return
+
+    from .models import TratamientoMedicamento
+    from .tomas import generar_tomas
+    generar_tomas(TratamientoMedicamento.objects.filter(id_tratamiento=instance))
+
+
+@receiver(post_save, sender='appweb.Notificacion')
+def actualizar_contador_no_leidas(sender, instance, created, **kwargs):
+    from . import contadores
+
+    despues = (instance.id_usuario_destino_id, instance.estado)
+    if created:
+        contadores.registrar_cambio(None, despues)
+        if instance.fecha_hora_programada is None:
+            # Las programadas se publican cuando el despachador las entrega
+            from .eventos import publicar_notificaciones
+            publicar_notificaciones([instance])
+    elif hasattr(instance, '_estado_original'):
+        contadores.registrar_cambio((instance._destino_original, instance._estado_original), despues)
+    else:
+        # Instancia que no se leyó de la base: no se sabe el estado anterior
+        contadores.invalidar([instance.id_usuario_destino_id])
+    instance._estado_original, instance._destino_original = instance.estado, instance.id_usuario_destino_id
+
+
+@receiver(post_delete, sender='appweb.Notificacion')
+def descontar_notificacion_eliminada(sender, instance, **kwargs):
+    from . import contadores
+
+    estado = getattr(instance, '_estado_original', instance.estado)
+    destino = getattr(instance, '_destino_original', instance.id_usuario_destino_id)
+    contadores.registrar_cambio((destino, estado), None)
@@ -1,3 +1,1458 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import warnings
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import adherencia, contadores, eventos, importacion, notificaciones, openfda, sesiones, tomas, traduccion
+
+from .models import (
+    Usuario, Paciente, Medico, Medicamento,
+    Tratamiento, TratamientoMedicamento,
+    HistorialAdherencia, Notificacion, EtiquetaFDA, TomaProgramada,
+    PacienteCuidador, RegistroToma, ProgresoProceso, ContadorNotificaciones,
+    SesionUsuario
+)
+
+
+# ==================== DATOS DE PRUEBA ====================
+
+def crear_usuario(tipo_usuario, email, nombre='Ana', apellido='Pérez'):
+    return Usuario.objects.create(
+        email=email,
+        password_hash='x',
+        nombre=nombre,
+        apellido=apellido,
+        telefono='000',
+        fecha_nacimiento=date(1990, 1, 1),
+        tipo_usuario=tipo_usuario,
+    )
+
+
+def crear_paciente(sufijo, **kwargs):
+    usuario = crear_usuario('paciente', f'paciente{sufijo}@test.com', **kwargs)
+    return Paciente.objects.create(
+        id_usuario=usuario,
+        numero_identificacion=f'ID-{sufijo}',
+        grupo_sanguineo='O+',
+        alergias='',
+        enfermedades_cronicas='',
+        direccion='Calle 1',
+    )
+
+
+def crear_medico(sufijo):
+    usuario = crear_usuario('medico', f'medico{sufijo}@test.com', nombre='Luis', apellido='Núñez')
+    return Medico.objects.create(
+        id_usuario=usuario,
+        especialidad='General',
+        numero_colegiado=f'COL-{sufijo}',
+        institucion='Hospital',
+        anos_experiencia=5,
+        consultorio='101',
+        certificaciones='',
+    )
+
+
+def crear_medicamento(sufijo, nombre_comercial='Aspirina', nombre_generico='aspirin'):
+    return Medicamento.objects.create(
+        nombre_comercial=nombre_comercial,
+        nombre_generico=nombre_generico,
+        laboratorio='Bayer',
+        concentracion='500mg',
+        via_administracion='oral',
+        efectos_secundarios='',
+        contraindicaciones='',
+        codigo_barra=f'CB-{sufijo}',
+    )
+
+
+def crear_tratamiento(paciente, medico, estado='activo', tipo_tratamiento='Receta Médica'):
+    return Tratamiento.objects.create(
+        id_paciente=paciente,
+        id_medico=medico,
+        diagnostico='Dx',
+        fecha_inicio=date.today(),
+        fecha_fin=date.today() + timedelta(days=30),
+        duracion_dias=30,
+        tipo_tratamiento=tipo_tratamiento,
+        objetivo_terapeutico='',
+        estado=estado,
+        observaciones='',
+    )
+
+
+def crear_tratamiento_medicamento(tratamiento, medicamento, horarios=None):
+    return TratamientoMedicamento.objects.create(
+        id_tratamiento=tratamiento,
+        id_medicamento=medicamento,
+        dosis='1',
+        frecuencia='cada 8 horas',
+        via_administracion='oral',
+        duracion_dias=30,
+        horarios=horarios if horarios is not None else ['08:00', '16:00'],
+        instrucciones_especiales='',
+    )
+
+
+class DatosClinicosMixin:
+    """Crea tratamientos completos (paciente, médico, medicamento, notificación, historial)"""
+    contador = 0
+
+    def crear_filas(self, cantidad):
+        for _ in range(cantidad):
+            DatosClinicosMixin.contador += 1
+            n = DatosClinicosMixin.contador
+            paciente = crear_paciente(n)
+            medico = crear_medico(n)
+            medicamento = crear_medicamento(n)
+            tratamiento = crear_tratamiento(paciente, medico)
+            tm = crear_tratamiento_medicamento(tratamiento, medicamento)
+            Notificacion.objects.create(
+                id_usuario_origen=medico.id_usuario,
+                id_usuario_destino=self.destino,
+                id_tratamiento_medicamento=tm,
+                tipo_notificacion='recordatorio_medicamento',
+                titulo='Recordatorio',
+                mensaje='Tomar medicamento',
+            )
+            HistorialAdherencia.objects.create(
+                id_paciente=paciente,
+                id_tratamiento=tratamiento,
+                clasificacion_adherencia='baja',
+            )
+            self.ultimo_paciente = paciente
+            self.ultimo_medico = medico
+            self.ultimo_tratamiento = tratamiento
+
+
+# ==================== PRESUPUESTO DE CONSULTAS ====================
+
+class PresupuestoConsultasTestCase(DatosClinicosMixin, TestCase):
+    """
+    Verifica que los endpoints de listado ejecuten un número constante de consultas,
+    sin importar cuántas filas devuelvan.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.destino = crear_usuario('paciente', 'destino@test.com')
+
+    def contar_consultas(self, url):
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.ultima_respuesta = response.json()
+        return len(contexto.captured_queries)
+
+    def assertPresupuestoConsultas(self, url, presupuesto):
+        """La consulta no crece con las filas y no supera el presupuesto"""
+        self.crear_filas(2)
+        pocas = self.contar_consultas(url(self) if callable(url) else url)
+        self.crear_filas(5)
+        muchas = self.contar_consultas(url(self) if callable(url) else url)
+        self.assertEqual(pocas, muchas, f'{url}: {pocas} consultas con 2 filas, {muchas} con 7')
+        self.assertLessEqual(muchas, presupuesto)
+
+    def filas_respondidas(self):
+        datos = self.ultima_respuesta
+        return len(datos['data'] if isinstance(datos, dict) else datos)
+
+    def assertPresupuestoFiltrado(self, url, presupuesto):
+        """Como assertPresupuestoConsultas, pero con varias filas que pasan el filtro del mismo paciente y médico"""
+        self.crear_filas(1)
+        paciente, medico = self.ultimo_paciente, self.ultimo_medico
+        pocas = self.contar_consultas(url(self))
+        filas = self.filas_respondidas()
+        for i in range(5):
+            tratamiento = crear_tratamiento(paciente, medico)
+            for j in range(2):
+                crear_tratamiento_medicamento(tratamiento, crear_medicamento(f'filtro{paciente.pk}-{i}{j}'))
+        muchas = self.contar_consultas(url(self))
+        self.assertEqual(self.filas_respondidas(), filas + 5)
+        self.assertEqual(pocas, muchas, f'{url(self)}: {pocas} consultas con {filas} filas, {muchas} con {filas + 5}')
+        self.assertLessEqual(muchas, presupuesto)
+
+    def test_tratamientos_listado(self):
+        self.assertPresupuestoConsultas('/api/tratamientos/', 1)
+
+    def test_tratamientos_activos(self):
+        self.assertPresupuestoConsultas('/api/tratamientos/activos/', 1)
+
+    def test_tratamientos_por_paciente(self):
+        self.assertPresupuestoFiltrado(
+            lambda t: f'/api/tratamientos/por_paciente/?paciente_id={t.ultimo_paciente.id_paciente}', 1
+        )
+
+    def test_tratamientos_por_medico(self):
+        self.assertPresupuestoFiltrado(
+            lambda t: f'/api/tratamientos/por_medico/?medico_id={t.ultimo_medico.id_medico}', 1
+        )
+
+    def test_recetas_por_paciente(self):
+        self.assertPresupuestoFiltrado(
+            lambda t: f'/api/receta/listar/?paciente_id={t.ultimo_paciente.id_paciente}&incluir_medicamentos=true', 2
+        )
+
+    def test_recetas_por_medico(self):
+        self.assertPresupuestoFiltrado(
+            lambda t: f'/api/receta/listar/?medico_id={t.ultimo_medico.id_medico}&incluir_medicamentos=true', 2
+        )
+
+    def test_tratamiento_medicamentos(self):
+        self.assertPresupuestoConsultas('/api/tratamiento-medicamentos/', 1)
+
+    def test_historial_adherencia_baja(self):
+        self.assertPresupuestoConsultas('/api/historial-adherencia/adherencia_baja/', 1)
+
+    def test_notificaciones_no_leidas(self):
+        self.assertPresupuestoConsultas(
+            lambda t: f'/api/notificaciones/no_leidas/?usuario_id={t.destino.id_usuario}', 1
+        )
+
+    def test_notificaciones_expandidas(self):
+        self.assertPresupuestoConsultas(
+            lambda t: (f'/api/notificaciones/no_leidas/?usuario_id={t.destino.id_usuario}'
+                       '&expand=usuario_origen,tratamiento_medicamento.tratamiento.paciente.usuario'), 1
+        )
+
+
+# ==================== RESPUESTAS COMPACTAS (?expand= / ?fields=) ====================
+
+class CamposExpandiblesTestCase(DatosClinicosMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.destino = crear_usuario('paciente', 'compacta@test.com')
+        self.crear_filas(1)
+
+    def test_por_defecto_relaciones_como_ids(self):
+        fila = self.client.get('/api/notificaciones/').json()[0]
+        self.assertIn('id_tratamiento_medicamento', fila)
+        self.assertNotIn('tratamiento_medicamento', fila)
+        self.assertNotIn('usuario_destino', fila)
+
+    def test_expande_solo_lo_pedido(self):
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get('/api/notificaciones/?expand=tratamiento_medicamento.tratamiento.paciente')
+        self.assertEqual(len(contexto.captured_queries), 1)
+        # Ni el médico ni el medicamento se piden: no entran al JOIN
+        self.assertNotIn('"MEDICOS"', contexto.captured_queries[0]['sql'])
+        self.assertNotIn('"MEDICAMENTOS"', contexto.captured_queries[0]['sql'])
+
+        tratamiento = response.json()[0]['tratamiento_medicamento']['tratamiento']
+        self.assertNotIn('medicamento', response.json()[0]['tratamiento_medicamento'])
+        self.assertNotIn('medico', tratamiento)
+        self.assertNotIn('usuario', tratamiento['paciente'])
+        self.assertEqual(tratamiento['paciente']['nombre_completo'], 'Ana Pérez')
+
+    def test_fields_limita_los_campos(self):
+        response = self.client.get('/api/tratamientos/?fields=id_tratamiento,estado,paciente.nombre_completo&expand=paciente')
+        self.assertEqual(response.json()[0], {
+            'id_tratamiento': self.ultimo_tratamiento.id_tratamiento,
+            'estado': 'activo',
+            'paciente': {'nombre_completo': 'Ana Pérez'},
+        })
+
+    def test_expansion_desconocida(self):
+        response = self.client.get('/api/notificaciones/?expand=tratamiento_medicamento.inexistente')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expand', response.json())
+
+
+# ==================== DASHBOARDS ====================
+
+class DashboardTestCase(DatosClinicosMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.destino = crear_usuario('paciente', 'tablero@test.com')
+        self.crear_filas(2)
+        HistorialAdherencia.objects.filter(id_tratamiento=self.ultimo_tratamiento).update(
+            fecha_inicio_periodo=adherencia.inicio_periodo(timezone.now()), porcentaje_adherencia=40
+        )
+
+    def test_admin(self):
+        with self.assertNumQueries(4):
+            resumen = self.client.get('/api/dashboard/admin/').json()
+        # Incluye el administrador que crea la señal post_migrate
+        self.assertEqual(resumen['usuarios_por_tipo'], {'admin': 1, 'paciente': 3, 'medico': 2})
+        self.assertEqual(resumen['total_usuarios'], 6)
+        self.assertEqual(resumen['tratamientos_por_estado'], {'activo': 2})
+        self.assertEqual(resumen['pacientes_adherencia_baja'], 1)
+        self.assertEqual(resumen['adherencia_promedio'], 40.0)
+        self.assertEqual(resumen['notificaciones_no_leidas'], 2)
+
+        # Dentro del TTL se sirve desde la caché
+        with self.assertNumQueries(0):
+            self.client.get('/api/dashboard/admin/')
+
+    def test_medico(self):
+        crear_tratamiento(self.ultimo_paciente, self.ultimo_medico, estado='finalizado')
+        resumen = self.client.get(f'/api/dashboard/medico/{self.ultimo_medico.id_medico}/').json()
+        self.assertEqual(resumen['tratamientos_por_estado'], {'activo': 1, 'finalizado': 1})
+        self.assertEqual(resumen['pacientes_activos'], 1)
+        self.assertEqual(resumen['pacientes_adherencia_baja'], 1)
+        self.assertEqual(self.client.get('/api/dashboard/medico/999999/').status_code, 404)
+
+
+# ==================== HISTORIAL DEL PACIENTE ====================
+
+class HistorialPacienteTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.paciente = crear_paciente('hist')
+        medico = crear_medico('hist')
+        for i in range(3):
+            tratamiento = crear_tratamiento(self.paciente, medico)
+            for j in range(2):
+                crear_tratamiento_medicamento(tratamiento, crear_medicamento(f'hist{i}{j}'))
+            HistorialAdherencia.objects.create(
+                id_paciente=self.paciente, id_tratamiento=tratamiento,
+                fecha_inicio_periodo=date.today(), porcentaje_adherencia=92.5, clasificacion_adherencia='alta',
+            )
+        self.antiguo = crear_tratamiento(self.paciente, medico, estado='finalizado')
+        Tratamiento.objects.filter(pk=self.antiguo.pk).update(
+            fecha_inicio=date(2020, 1, 1), fecha_fin=date(2020, 2, 1)
+        )
+        Notificacion.objects.create(
+            id_usuario_destino=self.paciente.id_usuario, tipo_notificacion='mensaje_medico',
+            titulo='Control', mensaje='...',
+        )
+        self.url = f'/api/paciente/historial/{self.paciente.id_paciente}/'
+
+    def test_consultas_fijas(self):
+        # paciente, tratamientos, líneas, adherencia y notificaciones
+        with self.assertNumQueries(5):
+            historial = self.client.get(self.url).json()
+        self.assertEqual(len(historial['tratamientos']), 4)
+        self.assertEqual(len(historial['tratamientos'][0]['medicamentos']), 2)
+        self.assertEqual(len(historial['tratamientos'][0]['adherencia']), 1)
+        self.assertEqual(historial['notificaciones'][0]['titulo'], 'Control')
+
+    def test_rango_de_fechas(self):
+        historial = self.client.get(self.url, {'desde': '2020-01-15', 'hasta': '2020-12-31'}).json()
+        self.assertEqual([t['id_tratamiento'] for t in historial['tratamientos']], [self.antiguo.id_tratamiento])
+        self.assertEqual(historial['notificaciones'], [])
+        self.assertEqual(self.client.get(self.url, {'desde': 'ayer'}).status_code, 400)
+
+    def test_stream_devuelve_el_mismo_documento(self):
+        completo = self.client.get(self.url).json()
+        response = self.client.get(self.url, {'stream': 'true'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), completo)
+
+    async def test_stream_por_asgi_es_asincrono(self):
+        completo = (await self.async_client.get(self.url)).json()
+        response = await self.async_client.get(self.url, {'stream': 'true'})
+        self.assertTrue(response.is_async)
+        self.assertEqual(json.loads(b''.join([parte async for parte in response])), completo)
+
+
+# ==================== PAGINACIÓN POR CURSOR ====================
+
+class PaginacionCursorTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.pacientes = [crear_paciente(f'pag{i}') for i in range(5)]
+
+    def test_sin_parametros_devuelve_lista_completa(self):
+        response = self.client.get('/api/paciente/listar/')
+        self.assertEqual(len(response.json()), 5)
+        self.assertNotIn('X-Siguiente-Cursor', response)
+
+    def test_recorre_paginas_con_cursor(self):
+        response = self.client.get('/api/paciente/listar/?limite=2')
+        ids = [p['id_paciente'] for p in response.json()]
+        while 'X-Siguiente-Cursor' in response:
+            response = self.client.get(f"/api/paciente/listar/?limite=2&cursor={response['X-Siguiente-Cursor']}")
+            ids += [p['id_paciente'] for p in response.json()]
+        self.assertEqual(ids, [p.id_paciente for p in self.pacientes])
+
+    def test_cursor_invalido(self):
+        response = self.client.get('/api/usuarios/activos/?cursor=abc')
+        self.assertEqual(response.status_code, 400)
+
+
+# ==================== RECETAS ====================
+
+class ListarRecetasTestCase(DatosClinicosMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.destino = crear_usuario('paciente', 'destino-recetas@test.com')
+
+    def test_conteo_y_lineas_con_consultas_constantes(self):
+        self.crear_filas(3)
+        crear_tratamiento_medicamento(self.ultimo_tratamiento, crear_medicamento('extra'))
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get('/api/receta/listar/?incluir_medicamentos=true')
+        self.assertEqual(len(contexto.captured_queries), 2)
+        recetas = {r['id_tratamiento']: r for r in response.json()['data']}
+        receta = recetas[self.ultimo_tratamiento.id_tratamiento]
+        self.assertEqual(receta['medicamentos_count'], 2)
+        self.assertEqual(len(receta['medicamentos']), 2)
+
+
+class CrearRecetaTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico('receta')
+        self.pacientes = [crear_paciente(f'receta{i}') for i in range(3)]
+        self.medicamentos = [crear_medicamento(f'receta{i}') for i in range(3)]
+
+    def receta(self, paciente, medicamentos=None):
+        return {
+            'id_medico': self.medico.id_medico,
+            'id_paciente': paciente.id_paciente,
+            'diagnostico': 'Gripe',
+            'fecha_emision': str(date.today()),
+            'vigencia_dias': 10,
+            'medicamentos': [
+                {
+                    'id_medicamento': m.id_medicamento,
+                    'dosis': '1',
+                    'frecuencia': 'cada 8 horas',
+                    'via_administracion': 'oral',
+                    'duracion_dias': 10,
+                    'horarios': ['08:00'],
+                }
+                for m in (medicamentos if medicamentos is not None else self.medicamentos)
+            ],
+        }
+
+    def test_consultas_no_crecen_con_las_lineas(self):
+        for paciente in self.pacientes:
+            contadores.no_leidas(paciente.id_usuario_id)
+        conteos = []
+        for paciente, medicamentos in ((self.pacientes[0], self.medicamentos[:1]), (self.pacientes[1], self.medicamentos)):
+            with CaptureQueriesContext(connection) as contexto:
+                response = self.client.post('/api/receta/crear/', self.receta(paciente, medicamentos), format='json')
+            self.assertEqual(response.status_code, 201)
+            conteos.append(len(contexto.captured_queries))
+        self.assertEqual(conteos[0], conteos[1])
+
+        data = response.json()['data']
+        self.assertEqual(data['medico'], 'Dr. Luis Núñez')
+        self.assertEqual(len(data['medicamentos']), 3)
+        tratamiento = Tratamiento.objects.get(pk=data['id_tratamiento'])
+        self.assertEqual(tratamiento.tratamientomedicamento_set.count(), 3)
+        self.assertTrue(TomaProgramada.objects.filter(id_tratamiento_medicamento__id_tratamiento=tratamiento).exists())
+        self.assertEqual(contadores.no_leidas(self.pacientes[1].id_usuario_id), 1)
+
+    def test_medicamento_inexistente(self):
+        receta = self.receta(self.pacientes[0])
+        receta['medicamentos'][0]['id_medicamento'] = 999999
+        response = self.client.post('/api/receta/crear/', receta, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Tratamiento.objects.exists())
+
+    def test_lote(self):
+        recetas = [self.receta(p) for p in self.pacientes]
+        response = self.client.post('/api/receta/crear/', {'recetas': recetas}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['data']), 3)
+        self.assertEqual(TratamientoMedicamento.objects.count(), 9)
+        self.assertEqual(Notificacion.objects.filter(titulo='Nueva Receta Médica').count(), 3)
+
+    def test_lote_todo_o_nada(self):
+        recetas = [self.receta(p) for p in self.pacientes]
+        recetas[2]['id_paciente'] = 999999
+        response = self.client.post('/api/receta/crear/', {'recetas': recetas}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'][:2], [{}, {}])
+        self.assertFalse(Tratamiento.objects.exists())
+        self.assertFalse(Notificacion.objects.exists())
+
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportacionUsuariosTestCase(TestCase):
+    ENCABEZADO = 'email,nombre,apellido,telefono,fecha_nacimiento,genero,grupo_sanguineo,alergias,enfermedades_cronicas,direccion\n'
+
+    def csv_pacientes(self, emails):
+        return self.ENCABEZADO + ''.join(
+            f'{email},Ana,Gómez,000,1990-01-01,F,O+,ninguna,ninguna,Calle 1\n' for email in emails
+        )
+
+    @override_settings(IMPORTACION_PROCESOS=4)
+    def test_api_reporta_errores_sin_abortar(self):
+        # El endpoint hashea en el proceso de la petición aunque el comando use un pool
+        crear_usuario('paciente', 'existente@test.com')
+        contenido = self.csv_pacientes(['a@test.com', 'existente@test.com', 'b@test.com', 'a@test.com', 'c@test.com'])
+        contenido += 'd@test.com,Ana,Gómez,000,no-es-fecha,F,O+,x,x,Calle 1\n'
+        archivo = SimpleUploadedFile('pacientes.csv', contenido.encode())
+
+        response = self.client.post('/api/paciente/importar/', {'archivo': archivo, 'lote': 2})
+        self.assertEqual(response.status_code, 200)
+        lineas = [json.loads(l) for l in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([l['procesadas'] for l in lineas[:-1]], [2, 4, 6])
+        errores = [e['fila'] for l in lineas[:-1] for e in l['errores']]
+        self.assertEqual(errores, [2, 4, 6])
+        self.assertEqual(lineas[-1]['creadas'], 3)
+        self.assertEqual(lineas[-1]['con_errores'], 3)
+
+        paciente = Paciente.objects.select_related('id_usuario').get(id_usuario__email='c@test.com')
+        self.assertEqual(paciente.texto_busqueda, 'ana gomez')
+        self.assertTrue(check_password('123456', paciente.id_usuario.password_hash))
+
+    def test_consultas_por_lote_no_crecen_con_las_filas(self):
+        conteos = []
+        for prefijo, cantidad in (('x', 2), ('y', 8)):
+            archivo = StringIO(self.csv_pacientes([f'{prefijo}{i}@test.com' for i in range(cantidad)]))
+            with CaptureQueriesContext(connection) as contexto:
+                informes = list(importacion.importar(archivo, 'paciente', 'csv', tamano_lote=10, procesos=1))
+            self.assertEqual(informes[-1]['creadas'], cantidad)
+            conteos.append(len(contexto.captured_queries))
+        self.assertEqual(conteos[0], conteos[1])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportacionConPoolTestCase(TransactionTestCase):
+
+    def test_comando_jsonl_con_pool_de_procesos(self):
+        filas = [
+            {'email': f'medico{i}@test.com', 'nombre': 'Luis', 'apellido': 'Núñez', 'telefono': '000',
+             'fecha_nacimiento': '1980-01-01', 'numero_colegiado': f'C{i}', 'institucion': 'H',
+             'anos_experiencia': 3, 'consultorio': '1', 'certificaciones': 'ACLS', 'password': f'clave{i}'}
+            for i in range(3)
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as archivo:
+            archivo.write('\n'.join(json.dumps(f) for f in filas) + '\n{no es json\n')
+        self.addCleanup(os.remove, archivo.name)
+
+        salida, errores = StringIO(), StringIO()
+        with transaction.atomic():
+            call_command('importar_usuarios', 'medico', archivo.name, '--procesos', '2', stdout=salida, stderr=errores)
+            # El pool no cierra la conexión del proceso que importa
+            self.assertEqual(Medico.objects.count(), 3)
+
+        self.assertIn('Fila 4', errores.getvalue())
+        self.assertEqual(Medico.objects.count(), 3)
+        usuario = Usuario.objects.get(email='medico2@test.com')
+        self.assertEqual(usuario.tipo_usuario, 'medico')
+        self.assertTrue(check_password('clave2', usuario.password_hash))
+
+
+class ExportacionTestCase(DatosClinicosMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.destino = crear_usuario('paciente', 'destino-exportacion@test.com')
+
+    def descargar(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_consultas_constantes_y_columnas_planas(self):
+        conteos = []
+        for cantidad in (1, 4):
+            self.crear_filas(cantidad)
+            with CaptureQueriesContext(connection) as contexto:
+                _, contenido = self.descargar('/api/exportar/tratamiento_medicamentos/?formato=csv')
+            conteos.append(len(contexto.captured_queries))
+        self.assertEqual(conteos[0], conteos[1])
+
+        lineas = contenido.splitlines()
+        self.assertEqual(len(lineas), 6)
+        self.assertTrue(lineas[0].startswith('id_tratamiento_medicamento,id_tratamiento,id_medicamento,medicamento'))
+        self.assertIn('"[""08:00"", ""16:00""]"', lineas[1])
+
+    def test_exportacion_incremental_por_marca_de_agua(self):
+        self.crear_filas(2)
+        Tratamiento.objects.update(fecha_creacion=timezone.now() - timedelta(minutes=1))
+        response, contenido = self.descargar('/api/exportar/tratamientos/?formato=jsonl')
+        self.assertEqual(len(contenido.splitlines()), 2)
+        marca = response['X-Marca-Agua']
+
+        self.crear_filas(1)
+        response = self.client.get('/api/exportar/tratamientos/', {'formato': 'jsonl', 'desde': marca})
+        filas = [json.loads(l) for l in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([f['id_tratamiento'] for f in filas], [self.ultimo_tratamiento.id_tratamiento])
+
+    def test_adherencia_sin_fecha_calculo_solo_en_exportacion_completa(self):
+        self.crear_filas(1)
+        _, contenido = self.descargar('/api/exportar/adherencia/?formato=jsonl')
+        self.assertEqual(len(contenido.splitlines()), 1)
+        _, contenido = self.descargar('/api/exportar/adherencia/?formato=jsonl&desde=2000-01-01')
+        self.assertEqual(contenido, '')
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get('/api/exportar/usuarios/').status_code, 404)
+        self.assertEqual(self.client.get('/api/exportar/pacientes/?formato=xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/exportar/pacientes/?desde=ayer').status_code, 400)
+
+    async def test_por_asgi_se_envia_sin_acumular(self):
+        await sync_to_async(self.crear_filas)(3)
+        with warnings.catch_warnings(record=True) as avisos:
+            warnings.simplefilter('always')
+            response = await self.async_client.get('/api/exportar/pacientes/', {'formato': 'csv'})
+            self.assertTrue(response.is_async)
+            contenido = b''.join([parte async for parte in response]).decode()
+        self.assertEqual([str(a.message) for a in avisos if 'StreamingHttpResponse' in str(a.message)], [])
+        self.assertEqual(len(contenido.splitlines()), await Paciente.objects.acount() + 1)
+
+    def test_comando_incremental(self):
+        self.crear_filas(2)
+        salida = StringIO()
+        call_command('exportar_datos', 'pacientes', '--incremental', stdout=salida, stderr=StringIO())
+        self.assertEqual(len(salida.getvalue().splitlines()), 3)
+        self.assertTrue(ProgresoProceso.objects.get(nombre='exportacion_pacientes').posicion)
+
+        salida = StringIO()
+        call_command('exportar_datos', 'pacientes', '--incremental', stdout=salida, stderr=StringIO())
+        self.assertEqual(len(salida.getvalue().splitlines()), 1)
+
+
+# ==================== AUTENTICACIÓN ====================
+
+ARGON2_BARATO = {'time_cost': 1, 'memory_cost': 8, 'parallelism': 1}
+
+
+@override_settings(
+    PASSWORD_HASHERS=['appweb.hashers.Argon2Configurable', 'django.contrib.auth.hashers.MD5PasswordHasher'],
+    ARGON2_COSTO=ARGON2_BARATO,
+    ULTIMA_CONEXION_GRANULARIDAD=300,
+)
+class LoginTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.paciente = crear_paciente('login')
+        self.usuario = self.paciente.id_usuario
+        Usuario.objects.filter(pk=self.usuario.pk).update(password_hash=make_password('secreta'))
+
+    def login(self, password='secreta'):
+        return self.client.post('/api/auth/login/', {'email': self.usuario.email, 'password': password}, format='json')
+
+    def test_una_lectura_con_perfil_y_conexion_reciente(self):
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        # SELECT del usuario con su perfil + INSERT de la sesión
+        self.assertEqual([q['sql'].split()[0] for q in contexto.captured_queries], ['SELECT', 'INSERT'])
+        self.assertEqual(response.json()['datos_adicionales']['id_paciente'], self.paciente.id_paciente)
+
+    def test_conexion_antigua_actualiza_solo_ultima_conexion(self):
+        antes = timezone.now() - timedelta(hours=1)
+        Usuario.objects.filter(pk=self.usuario.pk).update(ultima_conexion=antes)
+        with CaptureQueriesContext(connection) as contexto:
+            self.assertEqual(self.login().status_code, 200)
+        updates = [q['sql'] for q in contexto.captured_queries if q['sql'].startswith('UPDATE "USUARIOS"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"nombre"', updates[0])
+        self.usuario.refresh_from_db()
+        self.assertGreater(self.usuario.ultima_conexion, antes)
+
+    def test_rehash_de_hash_con_otro_algoritmo_o_costo(self):
+        Usuario.objects.filter(pk=self.usuario.pk).update(
+            password_hash=make_password('secreta', hasher='md5')
+        )
+        self.assertEqual(self.login().status_code, 200)
+        self.usuario.refresh_from_db()
+        self.assertTrue(self.usuario.password_hash.startswith('argon2$'))
+        self.assertIn('t=1,', self.usuario.password_hash)
+
+        with override_settings(ARGON2_COSTO={**ARGON2_BARATO, 'time_cost': 2}):
+            self.assertEqual(self.login().status_code, 200)
+        self.usuario.refresh_from_db()
+        self.assertIn('t=2,', self.usuario.password_hash)
+
+    def test_password_incorrecta_no_escribe(self):
+        with CaptureQueriesContext(connection) as contexto:
+            self.assertEqual(self.login('otra').status_code, 401)
+        self.assertEqual(len(contexto.captured_queries), 1)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['appweb.hashers.Argon2Configurable'],
+    ARGON2_COSTO=ARGON2_BARATO,
+)
+class SesionesTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        sesiones.memo.clear()
+        self.client = APIClient()
+        self.usuario = crear_usuario('medico', 'sesion@test.com')
+        Usuario.objects.filter(pk=self.usuario.pk).update(password_hash=make_password('secreta'))
+
+    def login(self):
+        response = self.client.post('/api/auth/login/', {'email': 'sesion@test.com', 'password': 'secreta'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['token']
+
+    def post(self, url, token=None, **datos):
+        cabeceras = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        return self.client.post(url, datos, format='json', **cabeceras)
+
+    def test_verificacion_en_cache_sin_consultas(self):
+        token = self.login()
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.post('/api/auth/verificar-sesion/', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['usuario']['id_usuario'], self.usuario.id_usuario)
+        self.assertEqual(len(contexto.captured_queries), 0)
+
+        # Con la caché vencida se consulta la base una vez y se vuelve a guardar
+        sesiones.memo.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as contexto:
+            self.assertEqual(self.post('/api/auth/verificar-sesion/', token).status_code, 200)
+            self.assertEqual(self.post('/api/auth/verificar-sesion/', token).status_code, 200)
+        self.assertEqual(len(contexto.captured_queries), 1)
+
+    def test_usuario_inactivo_al_vencer_la_cache(self):
+        token = self.login()
+        Usuario.objects.filter(pk=self.usuario.pk).update(activo=False)
+        self.assertEqual(self.post('/api/auth/verificar-sesion/', token).status_code, 200)
+        sesiones.memo.clear()
+        cache.clear()
+        self.assertEqual(self.post('/api/auth/verificar-sesion/', token).status_code, 401)
+
+    def test_login_usuario_inactivo(self):
+        Usuario.objects.filter(pk=self.usuario.pk).update(activo=False)
+        response = self.client.post('/api/auth/login/', {'email': 'sesion@test.com', 'password': 'secreta'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['error'], 'Usuario inactivo')
+        self.assertFalse(SesionUsuario.objects.filter(id_usuario=self.usuario).exists())
+
+    def test_usuario_id_del_cliente_no_basta(self):
+        self.login()
+        self.assertEqual(self.post('/api/auth/verificar-sesion/', usuario_id=self.usuario.id_usuario).status_code, 401)
+        self.assertEqual(self.post('/api/auth/logout/', usuario_id=self.usuario.id_usuario).status_code, 401)
+        self.assertEqual(self.post('/api/auth/verificar-sesion/', 'inventado').status_code, 401)
+
+    def test_logout_revoca_el_token(self):
+        token = self.login()
+        self.assertEqual(self.post('/api/auth/logout/', token).status_code, 200)
+        self.assertEqual(self.post('/api/auth/verificar-sesion/', token).status_code, 401)
+        self.assertEqual(self.post('/api/auth/logout/', token).status_code, 401)
+
+    def test_cambio_de_password_revoca_las_demas_sesiones(self):
+        actual, otra = self.login(), self.login()
+        response = self.post('/api/auth/cambiar-password/', actual, password_actual='secreta', password_nueva='nueva')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.post('/api/auth/verificar-sesion/', actual).status_code, 200)
+        self.assertEqual(self.post('/api/auth/verificar-sesion/', otra).status_code, 401)
+
+    def test_cambio_de_password_usa_el_usuario_de_la_sesion(self):
+        otro = crear_usuario('paciente', 'otro-sesion@test.com')
+        Usuario.objects.filter(pk=otro.pk).update(password_hash=make_password('ajena'))
+        datos = {'usuario_id': otro.id_usuario, 'password_actual': 'ajena', 'password_nueva': 'robada'}
+        self.assertEqual(self.post('/api/auth/cambiar-password/', **datos).status_code, 401)
+
+        # Con una sesión propia, usuario_id se ignora: la contraseña actual no es la del token
+        response = self.post('/api/auth/cambiar-password/', self.login(), **datos)
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(check_password('ajena', Usuario.objects.get(pk=otro.pk).password_hash))
+
+
+# ==================== OPENFDA ====================
+
+class StubOpenFDA:
+    """Servidor HTTP local que reemplaza a api.fda.gov en las pruebas"""
+
+    def __init__(self, etiquetas, demora=0):
+        self.etiquetas = etiquetas
+        self.demora = demora
+        self.consultas = []
+        stub = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.consultas.append(self.path)
+                time.sleep(stub.demora)
+                nombre = next((n for n in stub.etiquetas if f'%22{n}%22' in self.path or f'"{n}"' in self.path), None)
+                if nombre is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                cuerpo = json.dumps({'results': [stub.etiquetas[nombre]]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    # El cliente dejó de esperar (prueba de timeout)
+                    pass
+
+        self.servidor = ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+        self.url = f'http://127.0.0.1:{self.servidor.server_address[1]}/drug/label.json'
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+class CacheOpenFDATestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.stub = StubOpenFDA({
+            'aspirin': {'openfda': {'brand_name': ['Aspirin']}, 'drug_interactions': ['Avoid warfarin.']},
+        })
+        self.configuracion = override_settings(OPENFDA_URL=self.stub.url)
+        self.configuracion.enable()
+
+    def tearDown(self):
+        self.configuracion.disable()
+        self.stub.cerrar()
+
+    def test_etiqueta_se_cachea_por_nombre_normalizado(self):
+        self.assertEqual(openfda.obtener_etiqueta('aspirin')['openfda']['brand_name'], ['Aspirin'])
+        openfda.obtener_etiqueta('  ASPIRIN ')
+        self.assertEqual(len(self.stub.consultas), 1)
+
+    def test_sobrevive_a_la_cache_gracias_a_la_tabla(self):
+        openfda.obtener_etiqueta('aspirin')
+        cache.clear()
+        self.assertIsNotNone(openfda.obtener_etiqueta('aspirin'))
+        self.assertEqual(len(self.stub.consultas), 1)
+
+    def test_cache_negativa_para_no_encontrados(self):
+        self.assertIsNone(openfda.obtener_etiqueta('inexistente'))
+        self.assertIsNone(openfda.obtener_etiqueta('inexistente'))
+        self.assertEqual(len(self.stub.consultas), 1)
+
+    def test_etiqueta_vencida_se_sirve_mientras_se_revalida(self):
+        openfda.obtener_etiqueta('aspirin')
+        with override_settings(OPENFDA_CACHE_TTL=0):
+            self.assertIsNotNone(openfda.obtener_etiqueta('aspirin'))
+        for _ in range(50):
+            if len(self.stub.consultas) == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(self.stub.consultas), 2)
+
+    def test_consultas_simultaneas_comparten_una_llamada(self):
+        self.stub.demora = 0.3
+        resultados = []
+
+        def consultar():
+            resultados.append(openfda.obtener_etiqueta('aspirin'))
+            connection.close()
+
+        hilos = [threading.Thread(target=consultar) for _ in range(5)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(len(resultados), 5)
+        self.assertEqual(len(self.stub.consultas), 1)
+        self.assertEqual(EtiquetaFDA.objects.count(), 1)
+
+    def test_matriz_de_interacciones_consulta_en_paralelo(self):
+        self.stub.etiquetas.update({
+            'warfarin': {'drug_interactions': ['Bleeding risk increases with aspirin. Monitor INR.']},
+            'ibuprofen': {'drug_interactions': ['No relevant data.']},
+        })
+        self.stub.demora = 0.3
+        inicio = time.monotonic()
+        response = APIClient().get('/api/medicamento/matriz-interacciones/?medicamentos=aspirin,warfarin,ibuprofen,nada')
+        self.assertLess(time.monotonic() - inicio, 0.9)
+        self.assertEqual(len(self.stub.consultas), 4)
+
+        datos = response.json()
+        self.assertEqual(datos['no_encontrados'], ['nada'])
+        self.assertTrue(datos['matriz']['aspirin']['warfarin'])
+        self.assertTrue(datos['matriz']['warfarin']['aspirin'])
+        self.assertFalse(datos['matriz']['ibuprofen']['aspirin'])
+        self.assertEqual(len(datos['datos']), 2)
+
+    @override_settings(OPENFDA_TIMEOUT=0.1)
+    def test_verificar_interacciones_con_openfda_caido(self):
+        self.stub.demora = 0.5
+        response = APIClient().get('/api/medicamento/verificar-interacciones/?med1=aspirin&med2=warfarin')
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.json()['error'], 'Timeout al conectar con OpenFDA')
+
+    @override_settings(OPENFDA_TIMEOUT=0.1)
+    def test_matriz_separa_errores_de_no_encontrados(self):
+        self.stub.demora = 0.5
+        response = APIClient().get('/api/medicamento/matriz-interacciones/?medicamentos=aspirin,warfarin')
+        self.assertEqual(response.status_code, 200)
+        datos = response.json()
+        self.assertEqual(datos['no_encontrados'], [])
+        self.assertEqual(
+            datos['errores'],
+            [{'medicamento': nombre, 'error': 'Timeout al conectar con OpenFDA'} for nombre in ('aspirin', 'warfarin')]
+        )
+
+
+
+# ==================== TRADUCCIÓN ====================
+
+class TraductorFalso:
+    """Backend de traducción local: antepone el idioma destino y registra cada lote"""
+    lotes = []
+
+    def traducir(self, textos, origen, destino):
+        TraductorFalso.lotes.append(list(textos))
+        return [f'[{destino}] {texto}' for texto in textos]
+
+
+@override_settings(TRADUCCION_BACKEND='appweb.tests.TraductorFalso')
+class TraduccionTestCase(TestCase):
+
+    def setUp(self):
+        TraductorFalso.lotes = []
+        traduccion.memo.clear()
+
+    def test_lote_en_una_sola_llamada(self):
+        resultado = traduccion.traducir_lote(['Warning', 'No disponible', 'Dose', 'Warning'])
+        self.assertEqual(resultado, ['[es] Warning', 'No disponible', '[es] Dose', '[es] Warning'])
+        self.assertEqual(TraductorFalso.lotes, [['Warning', 'Dose']])
+
+    def test_memo_en_proceso_y_persistente(self):
+        traduccion.traducir_texto('Do not exceed the dose.')
+        traduccion.traducir_texto('Do not exceed the dose.')
+        traduccion.memo.clear()
+        self.assertEqual(traduccion.traducir_texto('Do not exceed the dose.'), '[es] Do not exceed the dose.')
+        self.assertEqual(len(TraductorFalso.lotes), 1)
+
+    def test_textos_largos_se_fragmentan(self):
+        texto = 'Sentence number one. ' * 400
+        traduccion.traducir_texto(texto)
+        self.assertGreater(len(TraductorFalso.lotes[0]), 1)
+        self.assertTrue(all(len(f) <= traduccion.MAX_CHARS for f in TraductorFalso.lotes[0]))
+
+
+# ==================== BÚSQUEDA DE INTERACCIONES ====================
+
+class BuscadorTerminosTestCase(TestCase):
+
+    def test_menciones_en_una_pasada_con_limites_de_palabra(self):
+        from .interacciones import BuscadorTerminos, TextoIndexado
+        texto = TextoIndexado('Avoid Aspirinate. Concomitant use of Warfarin and aspirin raises bleeding risk. Monitor.')
+        buscador = BuscadorTerminos({'aspirin': ['aspirin'], 'warfarin': ['warfarin'], 'heparin': ['heparin']})
+        menciones = buscador.buscar(texto)
+        self.assertEqual(set(menciones), {'aspirin', 'warfarin'})
+        self.assertEqual(
+            texto.fragmento(menciones['aspirin']),
+            'Concomitant use of Warfarin and aspirin raises bleeding risk.'
+        )
+
+
+# ==================== BÚSQUEDA DE MEDICAMENTOS ====================
+
+class BuscarMedicamentoTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        crear_medicamento('7501', 'Ibuprofeno MK', 'ibuprofen')
+        crear_medicamento('7502', 'Aspirina', 'acetylsalicylic acid')
+        crear_medicamento('7503', 'Buscapina', 'hioscina')
+
+    def nombres(self, url):
+        return [m['nombre_comercial'] for m in self.client.get(url).json()]
+
+    def test_prefijo_primero_y_tolerancia_a_errores(self):
+        self.assertEqual(self.nombres('/api/medicamentos/buscar/?q=ibupro'), ['Ibuprofeno MK'])
+        self.assertEqual(self.nombres('/api/medicamentos/buscar/?q=aspirna')[0], 'Aspirina')
+        self.assertEqual(self.nombres('/api/medicamentos/buscar/?q=asp&limite=1'), ['Aspirina'])
+
+    def test_codigo_de_barras_exacto(self):
+        self.assertEqual(self.nombres('/api/medicamentos/buscar/?codigo_barra=CB-7503'), ['Buscapina'])
+
+    def test_indice_se_invalida_al_guardar(self):
+        self.assertEqual(self.nombres('/api/medicamentos/buscar/?q=paracet'), [])
+        crear_medicamento('7504', 'Paracetamol', 'acetaminophen')
+        self.assertEqual(self.nombres('/api/medicamentos/buscar/?q=paracet'), ['Paracetamol'])
+
+
+class CatalogoMedicamentosTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.medicamento = crear_medicamento('8801', 'Ibuprofeno MK', 'ibuprofen')
+        crear_medicamento('8802', 'Aspirina', 'acetylsalicylic acid')
+
+    def test_cache_y_etag(self):
+        primera = self.client.get('/api/medicamentos/')
+        self.assertEqual(len(primera.json()), 2)
+        etag = primera['ETag']
+
+        # Catálogo sin cambios: ni consultas ni serialización
+        with self.assertNumQueries(0):
+            segunda = self.client.get('/api/medicamentos/')
+        self.assertEqual(segunda.content, primera.content)
+        self.assertEqual(segunda['ETag'], etag)
+        with self.assertNumQueries(0):
+            no_modificada = self.client.get('/api/medicamentos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(no_modificada.status_code, 304)
+
+        crear_medicamento('8803', 'Buscapina', 'hioscina')
+        tercera = self.client.get('/api/medicamentos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(tercera.status_code, 200)
+        self.assertEqual(len(tercera.json()), 3)
+        self.assertNotEqual(tercera['ETag'], etag)
+
+    def test_clave_solo_con_parametros_reconocidos(self):
+        self.client.get('/api/medicamentos/')
+        # Parámetros desconocidos no crean entradas nuevas
+        with self.assertNumQueries(0):
+            self.client.get('/api/medicamentos/', {'x': '1', 'relleno': 'abc'})
+
+        primera = self.client.get('/api/medicamentos/?fields=nombre_comercial,id_medicamento')
+        self.assertEqual(set(primera.json()[0]), {'id_medicamento', 'nombre_comercial'})
+        with self.assertNumQueries(0):
+            segunda = self.client.get('/api/medicamentos/?fields=id_medicamento,nombre_comercial,nada&y=2')
+        self.assertEqual(segunda.content, primera.content)
+
+        self.client.get('/api/medicamentos/', {'limite': 1000})
+        with self.assertNumQueries(0):
+            self.client.get('/api/medicamentos/', {'limite': 500})
+
+        # Las páginas por cursor no se guardan
+        self.client.get('/api/medicamentos/', {'cursor': 1})
+        with self.assertNumQueries(1):
+            self.client.get('/api/medicamentos/', {'cursor': 1})
+
+    def test_detalle_y_actualizacion_en_bloque(self):
+        url = f'/api/medicamentos/{self.medicamento.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # update() no emite señales, pero también cambia la versión del catálogo
+        Medicamento.objects.filter(pk=self.medicamento.pk).update(laboratorio='Genérico')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['laboratorio'], 'Genérico')
+
+
+# ==================== BÚSQUEDA DE PACIENTES ====================
+
+class BuscarPacientesTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        crear_paciente('b1', nombre='José', apellido='Núñez')
+        crear_paciente('b2', nombre='Josefina', apellido='Ramos')
+        crear_paciente('b3', nombre='María', apellido='Pérez')
+
+    def nombres(self, q):
+        response = self.client.get('/api/paciente/buscar/', {'q': q})
+        return [p['nombre_completo'] for p in response.json()]
+
+    def test_busqueda_sin_acentos(self):
+        self.assertEqual(self.nombres('jose nunez'), ['José Núñez'])
+        self.assertEqual(self.nombres('PEREZ'), ['María Pérez'])
+
+    def test_identificacion_exacta_primero(self):
+        self.assertEqual(self.nombres('id-b3'), ['María Pérez'])
+
+    def test_texto_se_actualiza_al_editar_usuario(self):
+        usuario = Usuario.objects.get(email='pacienteb3@test.com')
+        usuario.apellido = 'Gómez'
+        usuario.save()
+        self.assertEqual(self.nombres('gomez'), ['María Gómez'])
+
+
+# ==================== DESPACHO DE NOTIFICACIONES ====================
+
+class BackendFalso:
+    """Registra los lotes recibidos; las notificaciones con titulo 'falla' no se entregan"""
+    lotes = []
+    # Savepoints abiertos al enviar: el lote se entrega fuera de la transacción que lo reclama
+    savepoints = []
+
+    def enviar(self, lote):
+        BackendFalso.lotes.append([n.id_notificacion for n in lote])
+        BackendFalso.savepoints.append(len(connection.savepoint_ids))
+        return {n.id_notificacion for n in lote if n.titulo != 'falla'}
+
+
+@override_settings(NOTIFICACIONES_BACKENDS={
+    'app': 'appweb.tests.BackendFalso',
+    'email': 'appweb.tests.BackendFalso',
+})
+class DespachoNotificacionesTestCase(TestCase):
+
+    def setUp(self):
+        BackendFalso.lotes = []
+        BackendFalso.savepoints = []
+        notificaciones._backends.clear()
+        self.usuario = crear_usuario('paciente', 'despacho@test.com')
+        self.ahora = timezone.now()
+
+    def crear(self, minutos, titulo='Tomar', **kwargs):
+        return Notificacion.objects.create(
+            id_usuario_destino=self.usuario,
+            tipo_notificacion='recordatorio_medicamento',
+            titulo=titulo,
+            mensaje='...',
+            fecha_hora_programada=self.ahora + timedelta(minutes=minutos),
+            **kwargs
+        )
+
+    def test_despacha_solo_vencidas_en_bloque(self):
+        vencida = self.crear(-5)
+        anticipada = self.crear(10, anticipacion_minutos=15, canal_envio='email')
+        futura = self.crear(60)
+        fallida = self.crear(-1, titulo='falla')
+
+        # Reclamo: SAVEPOINT + SELECT del lote + UPDATE a enviada + RELEASE
+        # Fallidas: SAVEPOINT + SELECT ... FOR UPDATE + UPDATE + contador + RELEASE
+        with self.assertNumQueries(9):
+            metricas = notificaciones.despachar_lote()
+        self.assertEqual(BackendFalso.savepoints, [len(connection.savepoint_ids)] * 2)
+
+        self.assertEqual(metricas['reclamadas'], 3)
+        self.assertEqual(metricas['enviadas'], 2)
+        self.assertEqual(metricas['fallidas'], 1)
+        self.assertGreaterEqual(metricas['retraso_maximo'], 5 * 60)
+        self.assertEqual(len(BackendFalso.lotes), 2)  # un lote por canal
+
+        estados = dict(Notificacion.objects.values_list('id_notificacion', 'estado'))
+        self.assertEqual(estados[vencida.pk], 'enviada')
+        self.assertEqual(estados[anticipada.pk], 'enviada')
+        self.assertEqual(estados[futura.pk], 'pendiente')
+        self.assertEqual(estados[fallida.pk], 'fallida')
+        self.assertIsNotNone(Notificacion.objects.get(pk=vencida.pk).fecha_envio)
+
+        self.assertEqual(notificaciones.despachar_lote()['reclamadas'], 0)
+
+    def test_repetir_programa_siguiente_ocurrencia(self):
+        self.crear(-5, repetir=True, datos_adicionales={'intervalo_minutos': 60})
+
+        metricas = notificaciones.despachar_lote()
+
+        self.assertEqual(metricas['repetidas'], 1)
+        siguiente = Notificacion.objects.get(estado='pendiente')
+        self.assertTrue(siguiente.repetir)
+        self.assertEqual(siguiente.fecha_hora_programada, self.ahora + timedelta(minutes=55))
+
+
+# ==================== TOMAS PROGRAMADAS ====================
+
+@override_settings(TOMAS_VENTANA_DIAS=3)
+class TomasProgramadasTestCase(TestCase):
+
+    def setUp(self):
+        self.paciente = crear_paciente('t1')
+        tratamiento = crear_tratamiento(self.paciente, crear_medico('t1'))
+        self.linea = crear_tratamiento_medicamento(tratamiento, crear_medicamento('t1'), horarios=['08:00', '20:00'])
+
+    def test_se_generan_al_crear_la_linea(self):
+        self.assertEqual(self.linea.tomas_programadas.count(), 6)
+        self.linea.refresh_from_db()
+        self.assertEqual(self.linea.tomas_generadas_hasta, date.today() + timedelta(days=2))
+
+    def test_lineas_sin_cambios_no_se_tocan(self):
+        self.assertEqual(tomas.generar_tomas()['lineas'], 0)
+
+        # Al día siguiente solo se agrega el día nuevo de la ventana
+        resumen = tomas.generar_tomas(hoy=date.today() + timedelta(days=1))
+        self.assertEqual(resumen, {'lineas': 1, 'regeneradas': 0, 'creadas': 2, 'borradas': 0})
+
+    def test_cambio_de_horarios_regenera_tomas_futuras(self):
+        self.linea.horarios = [{'hora': '12:00'}]
+        self.linea.save()
+
+        manana = date.today() + timedelta(days=1)
+        horas = set(
+            self.linea.tomas_programadas.filter(fecha_hora__date=manana).values_list('fecha_hora__hour', flat=True)
+        )
+        self.assertEqual(horas, {12})
+
+        self.linea.activo = False
+        self.linea.save()
+        self.assertFalse(self.linea.tomas_programadas.filter(fecha_hora__gte=timezone.now()).exists())
+
+    def test_vista_de_hoy_en_una_consulta(self):
+        client = APIClient()
+        with self.assertNumQueries(1):
+            response = client.get('/api/tomas-programadas/hoy/', {'paciente_id': self.paciente.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['medicamento'] for t in response.json()], ['Aspirina', 'Aspirina'])
+        self.assertLess(response.json()[0]['fecha_hora'], response.json()[1]['fecha_hora'])
+
+
+# ==================== REGISTRO DE TOMAS Y ADHERENCIA ====================
+
+@override_settings(TOMAS_VENTANA_DIAS=1, ADHERENCIA_MARGEN_SEGUNDOS=0)
+class AdherenciaIncrementalTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.paciente = crear_paciente('a1')
+        self.medico = crear_medico('a1')
+        self.tratamiento = crear_tratamiento(self.paciente, self.medico)
+        # Cuatro tomas hoy, todas ya vencidas
+        ahora = timezone.localtime()
+        horarios = [(ahora - timedelta(minutes=m)).strftime('%H:%M') for m in (1, 2, 3, 4)]
+        if ahora.hour == 0 and ahora.minute < 5:
+            self.skipTest('Las tomas de prueba deben caer en el mismo día')
+        crear_tratamiento_medicamento(self.tratamiento, crear_medicamento('a1'), horarios=horarios)
+        self.tomas = list(TomaProgramada.objects.order_by('fecha_hora'))
+
+    def registrar(self, toma, usuario, **datos):
+        return self.client.post(
+            f'/api/tomas-programadas/{toma.pk}/registrar/',
+            {'usuario_id': usuario.pk, **datos}, format='json'
+        )
+
+    def test_permisos_de_registro(self):
+        cuidador = crear_usuario('cuidador', 'cuidador@test.com')
+        relacion = PacienteCuidador.objects.create(
+            id_paciente=self.paciente, id_usuario=cuidador, fecha_asignacion=date.today(),
+            estado_relacion='activa', nivel_acceso='completo', puede_registrar_tomas=False,
+            parentesco='Hijo', disponibilidad='Tardes',
+        )
+        self.assertEqual(self.registrar(self.tomas[0], cuidador).status_code, 403)
+
+        relacion.puede_registrar_tomas = True
+        relacion.save()
+        self.assertEqual(self.registrar(self.tomas[0], cuidador).status_code, 201)
+        self.assertEqual(self.registrar(self.tomas[0], self.paciente.id_usuario).status_code, 409)
+
+    def test_agregacion_incremental_y_alertas(self):
+        usuario = self.paciente.id_usuario
+        for toma in self.tomas[:3]:
+            self.registrar(toma, usuario)
+
+        self.assertEqual(adherencia.agregar_registros()['registros'], 3)
+        historial = HistorialAdherencia.objects.get()
+        self.assertEqual((historial.tomas_programadas, historial.tomas_realizadas), (4, 3))
+        self.assertEqual(historial.clasificacion_adherencia, 'media')
+        self.assertEqual(Notificacion.objects.filter(tipo_notificacion='adherencia_baja').count(), 0)
+
+        # Sin registros nuevos no se vuelve a leer nada más que la marca de agua
+        with self.assertNumQueries(4):
+            self.assertEqual(adherencia.agregar_registros()['registros'], 0)
+
+        historial.clasificacion_adherencia = 'alta'
+        historial.save()
+        self.registrar(self.tomas[3], usuario, estado='omitida')
+        resumen = adherencia.agregar_registros()
+        self.assertEqual(resumen, {'registros': 1, 'periodos': 1, 'alertas': 2})
+        self.assertEqual(HistorialAdherencia.objects.get().tomas_realizadas, 3)
+        destinatarios = set(
+            Notificacion.objects.filter(tipo_notificacion='adherencia_baja').values_list('id_usuario_destino', flat=True)
+        )
+        self.assertEqual(destinatarios, {usuario.pk, self.medico.id_usuario_id})
+
+    def test_marca_de_agua_se_detiene_antes_de_un_registro_reciente(self):
+        for toma in self.tomas[:3]:
+            self.registrar(toma, self.paciente.id_usuario)
+        registros = list(RegistroToma.objects.order_by('id_registro'))
+
+        # El registro del medio todavía está dentro del margen: no se salta ninguno detrás de él
+        RegistroToma.objects.filter(pk=registros[1].pk).update(fecha_creacion=timezone.now() + timedelta(hours=1))
+        self.assertEqual(adherencia.agregar_registros()['registros'], 1)
+        self.assertEqual(ProgresoProceso.objects.get(nombre=adherencia.CLAVE_MARCA).posicion, registros[0].pk)
+
+        RegistroToma.objects.filter(pk=registros[1].pk).update(fecha_creacion=timezone.now() - timedelta(hours=1))
+        self.assertEqual(adherencia.agregar_registros()['registros'], 2)
+        self.assertEqual(HistorialAdherencia.objects.get().tomas_realizadas, 3)
+
+    def test_recalculo_completo_reanuda_desde_el_progreso(self):
+        for toma in self.tomas[:2]:
+            self.registrar(toma, self.paciente.id_usuario)
+
+        # Una ejecución interrumpida que ya había pasado a este paciente no lo vuelve a procesar
+        ProgresoProceso.objects.create(nombre='adherencia_recalculo', posicion=self.paciente.pk + 1)
+        call_command('recalcular_adherencia', procesos=1, stdout=StringIO())
+        self.assertFalse(HistorialAdherencia.objects.exists())
+        self.assertEqual(ProgresoProceso.objects.get(nombre='adherencia_recalculo').posicion, 0)
+
+        call_command('recalcular_adherencia', procesos=1, tamano_bloque=1, stdout=StringIO())
+        historial = HistorialAdherencia.objects.get()
+        self.assertEqual((historial.tomas_programadas, historial.tomas_realizadas), (4, 2))
+        self.assertEqual(historial.clasificacion_adherencia, 'media')
+
+
+# ==================== CONTADOR DE NO LEÍDAS ====================
+
+class ContadorNotificacionesTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.usuario = crear_usuario('paciente', 'contador@test.com')
+
+    def crear(self, estado='pendiente'):
+        return Notificacion.objects.create(
+            id_usuario_destino=self.usuario, tipo_notificacion='mensaje_sistema',
+            titulo='Hola', mensaje='...', estado=estado,
+        )
+
+    def contador(self):
+        response = self.client.get('/api/notificaciones/contador/', {'usuario_id': self.usuario.pk})
+        return response.json()['no_leidas']
+
+    def test_se_reconstruye_y_luego_se_mantiene(self):
+        primera = self.crear()
+        self.crear(estado='leida')
+
+        # Sin fila todavía: se crea con un COUNT
+        self.assertEqual(self.contador(), 1)
+        self.crear(estado='enviada')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.contador(), 2)
+
+        self.client.post(f'/api/notificaciones/{primera.pk}/marcar_leida/')
+        self.assertEqual(self.contador(), 1)
+
+        Notificacion.objects.filter(estado='enviada').get().delete()
+        self.assertEqual(self.contador(), 0)
+
+    def test_marcar_leida_dos_veces_descuenta_una(self):
+        notificacion = self.crear()
+        self.crear()
+        self.assertEqual(self.contador(), 2)
+
+        # Dos peticiones que leyeron la misma notificación antes de que cualquiera la marcara
+        primera, segunda = Notificacion.objects.get(pk=notificacion.pk), Notificacion.objects.get(pk=notificacion.pk)
+        self.assertTrue(primera.marcar_como_leida())
+        self.assertFalse(segunda.marcar_como_leida())
+        self.assertEqual(self.contador(), 1)
+        self.assertFalse(segunda.marcar_como_enviada())
+        self.assertEqual(Notificacion.objects.get(pk=notificacion.pk).estado, 'leida')
+
+    def test_reconstruir_corrige_desviaciones(self):
+        self.crear()
+        self.contador()
+        ContadorNotificaciones.objects.update(no_leidas=7)
+        call_command('reconstruir_contadores', stdout=StringIO())
+        self.assertEqual(self.contador(), 1)
+
+    def test_marcar_leidas_en_bloque(self):
+        otro = crear_usuario('paciente', 'otro-contador@test.com')
+        pendientes = [self.crear() for _ in range(3)]
+        self.crear(estado='enviada')
+        self.crear(estado='leida')
+        ajena = Notificacion.objects.create(
+            id_usuario_destino=otro, tipo_notificacion='mensaje_sistema', titulo='Hola', mensaje='...'
+        )
+        self.assertEqual(self.contador(), 4)
+
+        response = self.client.post(
+            '/api/notificaciones/marcar_leidas/', {'ids': [pendientes[0].pk, pendientes[1].pk]}, format='json'
+        )
+        self.assertEqual(response.json()['actualizadas'], 2)
+        self.assertEqual(self.contador(), 2)
+
+        # Por filtro: las ya leídas y las de otros usuarios no se tocan
+        response = self.client.post('/api/notificaciones/marcar_leidas/', {'usuario_id': self.usuario.pk}, format='json')
+        self.assertEqual(response.json()['actualizadas'], 2)
+        self.assertEqual(self.contador(), 0)
+        self.assertFalse(Notificacion.objects.filter(id_usuario_destino=self.usuario).exclude(estado='leida').exists())
+        ajena.refresh_from_db()
+        self.assertEqual(ajena.estado, 'pendiente')
+
+        self.assertEqual(self.client.post('/api/notificaciones/marcar_leidas/', {}, format='json').status_code, 400)
+        response = self.client.post('/api/notificaciones/marcar_leidas/', {'ids': ['x']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_marcar_enviadas_en_bloque(self):
+        pendiente = self.crear()
+        fallida = self.crear(estado='fallida')
+        leida = self.crear(estado='leida')
+        self.assertEqual(self.contador(), 1)
+
+        # Solo pasan a enviada las pendientes: las leídas no vuelven a sumar al contador
+        response = self.client.post('/api/notificaciones/marcar_enviadas/', {'usuario_id': self.usuario.pk}, format='json')
+        self.assertEqual(response.json()['actualizadas'], 1)
+        pendiente.refresh_from_db()
+        self.assertEqual(pendiente.estado, 'enviada')
+        self.assertIsNotNone(pendiente.fecha_envio)
+        leida.refresh_from_db()
+        self.assertEqual(leida.estado, 'leida')
+        fallida.refresh_from_db()
+        self.assertEqual(fallida.estado, 'fallida')
+        self.assertEqual(self.contador(), 1)
+
+
+# ==================== NOTIFICACIONES EN TIEMPO REAL ====================
+
+@override_settings(
+    NOTIFICACIONES_BROKER='appweb.eventos.BrokerMemoria',
+    NOTIFICACIONES_STREAM_HEARTBEAT=0.05,
+    NOTIFICACIONES_STREAM_DURACION=0.3,
+)
+class StreamNotificacionesTestCase(TestCase):
+
+    def setUp(self):
+        eventos._broker = None
+        cache.clear()
+        sesiones.memo.clear()
+        self.usuario = crear_usuario('paciente', 'stream@test.com')
+        self.token, _ = sesiones.crear_sesion(self.usuario)
+
+    def crear(self, titulo):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notificacion.objects.create(
+                id_usuario_destino=self.usuario, tipo_notificacion='mensaje_medico',
+                titulo=titulo, mensaje='...',
+            )
+
+    async def test_publica_las_notificaciones_nuevas(self):
+        response = await self.async_client.get('/api/notificaciones/stream/', {'token': self.token})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        flujo = response.streaming_content
+
+        self.assertEqual(await anext(flujo), b'retry: 5000\n\n')
+        self.assertIn(b'"no_leidas": 0', await anext(flujo))
+
+        notificacion = await sync_to_async(self.crear)('Nueva receta')
+        evento = await asyncio.wait_for(anext(flujo), 2)
+        self.assertIn(f'id: {notificacion.pk}'.encode(), evento)
+        self.assertIn('Nueva receta'.encode(), evento)
+
+        # Al cumplirse la duración de la conexión se cancela la suscripción
+        restantes = [parte async for parte in flujo]
+        self.assertIn(b': ping\n\n', restantes)
+        self.assertEqual(eventos.obtener_broker().suscripciones, {})
+
+    async def test_reenvia_lo_posterior_a_last_event_id(self):
+        primera = await sync_to_async(self.crear)('Primera')
+        await sync_to_async(self.crear)('Segunda')
+
+        response = await self.async_client.get(
+            '/api/notificaciones/stream/',
+            headers={'Authorization': f'Token {self.token}', 'Last-Event-ID': str(primera.pk)}
+        )
+        flujo = response.streaming_content
+        await anext(flujo)
+        self.assertIn(b'"no_leidas": 2', await anext(flujo))
+        self.assertIn(b'Segunda', await anext(flujo))
+
+    async def test_requiere_sesion(self):
+        otro = await sync_to_async(crear_usuario)('paciente', 'otro-stream@test.com')
+        response = await self.async_client.get('/api/notificaciones/stream/', {'usuario_id': otro.pk})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/notificaciones/stream/', {'token': 'no-existe'})
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,172 @@
+"""
+Generación de las tomas programadas (TOMAS_PROGRAMADAS).
+
+`generar_tomas()` expande TratamientoMedicamento.horarios en una toma por día y
+horario, desde hoy hasta TOMAS_VENTANA_DIAS días adelante. Cada línea guarda la
+firma de lo que determina sus tomas (horarios, activo, duración y fechas/estado
+del tratamiento) y hasta qué día ya se generaron: si la firma no cambió solo se
+agregan los días nuevos de la ventana; si cambió se borran sus tomas futuras y se
+vuelven a generar.
+"""
+import hashlib
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TomaProgramada, TratamientoMedicamento
+
+TAMANO_LOTE = 500
+
+
+def _ventana_dias():
+    return getattr(settings, 'TOMAS_VENTANA_DIAS', 14)
+
+
+def parsear_horarios(horarios):
+    """
+    Horas del día de un campo `horarios`. Acepta una lista de 'HH:MM' (o 'HH:MM:SS')
+    o de objetos con la clave 'hora'; ignora los valores que no se entienden.
+    """
+    if isinstance(horarios, (str, dict)):
+        horarios = [horarios]
+    horas = set()
+    for valor in horarios or []:
+        if isinstance(valor, dict):
+            valor = valor.get('hora')
+        if not isinstance(valor, str):
+            continue
+        try:
+            horas.add(time.fromisoformat(valor.strip()))
+        except ValueError:
+            continue
+    return sorted(horas)
+
+
+def firma_linea(linea):
+    tratamiento = linea.id_tratamiento
+    datos = [
+        linea.horarios, linea.activo, linea.duracion_dias,
+        tratamiento.id_paciente_id, tratamiento.fecha_inicio, tratamiento.fecha_fin, tratamiento.estado,
+    ]
+    return hashlib.sha1(json.dumps(datos, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def dias_linea(linea):
+    """Primer y último día en que la línea tiene tomas, o None si no tiene"""
+    tratamiento = linea.id_tratamiento
+    if not linea.activo or tratamiento.estado != 'activo':
+        return None
+    inicio = tratamiento.fecha_inicio
+    fin = tratamiento.fecha_fin
+    if linea.duracion_dias and linea.duracion_dias > 0:
+        fin = min(fin, inicio + timedelta(days=linea.duracion_dias - 1))
+    return (inicio, fin) if inicio <= fin else None
+
+
+def _tomas_de_linea(linea, desde, hasta, no_antes_de=None):
+    dias = dias_linea(linea)
+    horas = parsear_horarios(linea.horarios)
+    if dias is None or not horas:
+        return []
+
+    zona = timezone.get_current_timezone()
+    dia = max(desde, dias[0])
+    ultimo = min(hasta, dias[1])
+    tomas = []
+    while dia <= ultimo:
+        for hora in horas:
+            fecha_hora = timezone.make_aware(datetime.combine(dia, hora), zona)
+            if no_antes_de is None or fecha_hora >= no_antes_de:
+                tomas.append(TomaProgramada(
+                    id_tratamiento_medicamento_id=linea.id_tratamiento_medicamento,
+                    id_paciente_id=linea.id_tratamiento.id_paciente_id,
+                    fecha_hora=fecha_hora,
+                ))
+        dia += timedelta(days=1)
+    return tomas
+
+
+def _procesar_lote(lineas, hoy, limite, ahora, resumen):
+    regenerar = []
+    nuevas = []
+    actualizadas = []
+
+    for linea in lineas:
+        firma = firma_linea(linea)
+        if firma != linea.firma_horario:
+            if linea.firma_horario:
+                # Cambió la línea: sus tomas futuras se reemplazan, las pasadas quedan como historial
+                regenerar.append(linea.id_tratamiento_medicamento)
+                nuevas.extend(_tomas_de_linea(linea, hoy, limite, no_antes_de=ahora))
+            else:
+                nuevas.extend(_tomas_de_linea(linea, hoy, limite))
+        elif linea.tomas_generadas_hasta is None or linea.tomas_generadas_hasta < limite:
+            desde = hoy
+            if linea.tomas_generadas_hasta is not None:
+                desde = max(hoy, linea.tomas_generadas_hasta + timedelta(days=1))
+            nuevas.extend(_tomas_de_linea(linea, desde, limite))
+        else:
+            continue
+
+        linea.firma_horario = firma
+        linea.tomas_generadas_hasta = limite
+        actualizadas.append(linea)
+
+    if not actualizadas:
+        return
+
+    with transaction.atomic():
+        if regenerar:
+            resumen['borradas'] += TomaProgramada.objects.filter(
+                id_tratamiento_medicamento__in=regenerar, fecha_hora__gte=ahora
+            ).delete()[0]
+        TomaProgramada.objects.bulk_create(nuevas, batch_size=1000, ignore_conflicts=True)
+        TratamientoMedicamento.objects.bulk_update(
+            actualizadas, ['firma_horario', 'tomas_generadas_hasta']
+        )
+
+    resumen['lineas'] += len(actualizadas)
+    resumen['regeneradas'] += len(regenerar)
+    resumen['creadas'] += len(nuevas)
+
+
+def generar_tomas(lineas=None, hoy=None, ventana_dias=None):
+    """
+    Mantiene las tomas de la ventana [hoy, hoy + ventana_dias). `lineas` es un
+    queryset de TratamientoMedicamento; por defecto, las de tratamientos que no
+    terminaron. Devuelve un resumen con las líneas tocadas y las tomas creadas/borradas.
+    """
+    ahora = timezone.now()
+    hoy = hoy or timezone.localdate()
+    limite = hoy + timedelta(days=(ventana_dias or _ventana_dias()) - 1)
+    if lineas is None:
+        lineas = TratamientoMedicamento.objects.filter(id_tratamiento__fecha_fin__gte=hoy)
+
+    resumen = {'lineas': 0, 'regeneradas': 0, 'creadas': 0, 'borradas': 0}
+    lote = []
+    for linea in lineas.select_related('id_tratamiento').iterator(chunk_size=TAMANO_LOTE):
+        lote.append(linea)
+        if len(lote) >= TAMANO_LOTE:
+            _procesar_lote(lote, hoy, limite, ahora, resumen)
+            lote = []
+    if lote:
+        _procesar_lote(lote, hoy, limite, ahora, resumen)
+    return resumen
+
+
+def tomas_del_dia(paciente_id, dia=None):
+    """Tomas de un paciente en un día (rango sobre el índice (id_paciente, fecha_hora))"""
+    dia = dia or timezone.localdate()
+    zona = timezone.get_current_timezone()
+    inicio = timezone.make_aware(datetime.combine(dia, time.min), zona)
+    fin = timezone.make_aware(datetime.combine(dia + timedelta(days=1), time.min), zona)
+    return TomaProgramada.objects.select_related(
+        'id_tratamiento_medicamento__id_medicamento'
+    ).filter(
+        id_paciente=paciente_id,
+        fecha_hora__gte=inicio,
+        fecha_hora__lt=fin,
+    ).order_by('fecha_hora')
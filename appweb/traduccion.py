@@ -0,0 +1,192 @@
+"""
+Traducción de textos de OpenFDA con memo por contenido.
+
+Cada fragmento se identifica por el hash de (idioma origen, idioma destino, texto)
+y se busca primero en un LRU en memoria y luego en la tabla TRADUCCIONES,
+compartida entre workers. Solo los fragmentos que no están en ninguno de los dos
+niveles se envían al backend de traducción, todos juntos en un lote.
+
+El backend se elige con TRADUCCION_BACKEND (ruta a una clase con el método
+`traducir(textos, origen, destino)`), lo que permite usar un traductor falso en
+las pruebas.
+"""
+import hashlib
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .memo import MemoLRU
+from .models import Traduccion
+
+# Límite seguro por fragmento (Google Translate gratis soporta ~5000 caracteres)
+MAX_CHARS = 4500
+
+
+class TraductorGoogle:
+    """
+    Backend por defecto (deep-translator). Agrupa varios fragmentos en una sola
+    petición separándolos con líneas en blanco; si la respuesta no conserva los
+    separadores, traduce ese grupo fragmento por fragmento.
+    """
+    separador = '\n\n'
+
+    def traducir(self, textos, origen, destino):
+        from deep_translator import GoogleTranslator
+
+        traductor = GoogleTranslator(source=origen, target=destino)
+        traducidos = []
+        for grupo in self._agrupar(textos):
+            if len(grupo) == 1:
+                traducidos.append(traductor.translate(grupo[0]))
+                continue
+            resultado = traductor.translate(self.separador.join(grupo)) or ''
+            partes = [parte.strip() for parte in resultado.split(self.separador)]
+            if len(partes) != len(grupo):
+                partes = [traductor.translate(texto) for texto in grupo]
+            traducidos.extend(partes)
+        return traducidos
+
+    def _agrupar(self, textos):
+        grupo, largo = [], 0
+        for texto in textos:
+            # Un fragmento que ya contiene el separador va solo en su petición
+            if self.separador in texto:
+                if grupo:
+                    yield grupo
+                    grupo, largo = [], 0
+                yield [texto]
+                continue
+            if grupo and largo + len(self.separador) + len(texto) > MAX_CHARS:
+                yield grupo
+                grupo, largo = [], 0
+            grupo.append(texto)
+            largo += len(texto) + len(self.separador)
+        if grupo:
+            yield grupo
+
+
+# ==================== MEMO ====================
+
+memo = MemoLRU(getattr(settings, 'TRADUCCION_MEMO_CAPACIDAD', 2048))
+
+_backends = {}
+
+
+def obtener_backend():
+    ruta = getattr(settings, 'TRADUCCION_BACKEND', 'appweb.traduccion.TraductorGoogle')
+    if ruta not in _backends:
+        _backends[ruta] = import_string(ruta)()
+    return _backends[ruta]
+
+
+def hash_fragmento(fragmento, origen, destino):
+    return hashlib.sha256(f'{origen}:{destino}:{fragmento}'.encode('utf-8')).hexdigest()
+
+
+def dividir_en_fragmentos(texto):
+    """Divide textos largos en fragmentos de hasta MAX_CHARS, cortando en puntos o saltos de línea"""
+    if len(texto) <= MAX_CHARS:
+        return [texto]
+
+    fragmentos = []
+    texto_restante = texto
+    while len(texto_restante) > 0:
+        if len(texto_restante) <= MAX_CHARS:
+            fragmento = texto_restante
+            texto_restante = ""
+        else:
+            # Buscar un punto o salto de línea para dividir de forma natural
+            punto_corte = texto_restante[:MAX_CHARS].rfind('. ')
+            if punto_corte == -1:
+                punto_corte = texto_restante[:MAX_CHARS].rfind('\n')
+            if punto_corte == -1:
+                punto_corte = MAX_CHARS
+
+            fragmento = texto_restante[:punto_corte + 1]
+            texto_restante = texto_restante[punto_corte + 1:]
+        fragmento = fragmento.strip()
+        if fragmento:
+            fragmentos.append(fragmento)
+    return fragmentos
+
+
+def _traducir_fragmentos(fragmentos, origen, destino):
+    """Devuelve {fragmento: traducción} pasando por el LRU, la tabla y, al final, el backend"""
+    hashes = {fragmento: hash_fragmento(fragmento, origen, destino) for fragmento in fragmentos}
+    traducciones = {}
+
+    pendientes = []
+    for fragmento, clave in hashes.items():
+        valor = memo.get(clave)
+        if valor is None:
+            pendientes.append(fragmento)
+        else:
+            traducciones[fragmento] = valor
+
+    if pendientes:
+        guardadas = dict(
+            Traduccion.objects.filter(
+                hash_texto__in=[hashes[f] for f in pendientes]
+            ).values_list('hash_texto', 'texto_traducido')
+        )
+        faltantes = []
+        for fragmento in pendientes:
+            valor = guardadas.get(hashes[fragmento])
+            if valor is None:
+                faltantes.append(fragmento)
+            else:
+                memo.set(hashes[fragmento], valor)
+                traducciones[fragmento] = valor
+
+        if faltantes:
+            traducidos = obtener_backend().traducir(faltantes, origen, destino)
+            nuevas = []
+            for fragmento, valor in zip(faltantes, traducidos):
+                if not valor:
+                    continue
+                memo.set(hashes[fragmento], valor)
+                traducciones[fragmento] = valor
+                nuevas.append(Traduccion(
+                    hash_texto=hashes[fragmento],
+                    idioma_origen=origen,
+                    idioma_destino=destino,
+                    texto_traducido=valor
+                ))
+            Traduccion.objects.bulk_create(nuevas, ignore_conflicts=True)
+
+    return traducciones
+
+
+def traducir_lote(textos, idioma_destino='es', idioma_origen='en'):
+    """
+    Traduce una lista de textos con una sola llamada al backend para todos los
+    fragmentos que no estén en memo. Si la traducción falla se devuelven los
+    textos originales.
+    """
+    resultado = list(textos)
+    por_traducir = [
+        (posicion, dividir_en_fragmentos(texto))
+        for posicion, texto in enumerate(textos)
+        if texto and texto != 'No disponible'
+    ]
+    if not por_traducir:
+        return resultado
+
+    unicos = list(dict.fromkeys(f for _, fragmentos in por_traducir for f in fragmentos))
+    try:
+        traducciones = _traducir_fragmentos(unicos, idioma_origen, idioma_destino)
+    except Exception as e:
+        print(f"Error al traducir: {e}")
+        return resultado
+
+    for posicion, fragmentos in por_traducir:
+        resultado[posicion] = ' '.join(traducciones.get(f, f) for f in fragmentos)
+    return resultado
+
+
+def traducir_texto(texto, idioma_destino='es'):
+    """
+    Traduce texto de inglés a español.
+    Divide textos largos en fragmentos para evitar límites de la API
+    """
+    return traducir_lote([texto], idioma_destino)[0]
@@ -88,14 +88,109 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.getenv("REDIS_URL"):
+    # Caché compartida entre workers (requiere el paquete `redis`)
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL"),
+    }
+
+
+# OpenFDA
+OPENFDA_URL = os.getenv("OPENFDA_URL", "https://api.fda.gov/drug/label.json")
+OPENFDA_TIMEOUT = 10
+# Consultas simultáneas a OpenFDA al verificar varios medicamentos
+OPENFDA_MAX_CONCURRENCIA = 8
+# Segundos que una etiqueta se considera fresca
+OPENFDA_CACHE_TTL = int(os.getenv("OPENFDA_CACHE_TTL", 60 * 60 * 24))
+# Segundos que se recuerda que un medicamento no existe en la FDA
+OPENFDA_CACHE_TTL_NO_ENCONTRADO = int(os.getenv("OPENFDA_CACHE_TTL_NO_ENCONTRADO", 60 * 60))
+# Segundos adicionales en que una etiqueta vencida se sirve mientras se revalida
+OPENFDA_CACHE_STALE = int(os.getenv("OPENFDA_CACHE_STALE", 60 * 60 * 24 * 7))
+
+# Segundos que se guarda en caché cada respuesta de /api/medicamentos/ (se invalida con
+# la versión del catálogo al escribir un medicamento)
+MEDICAMENTOS_CATALOGO_CACHE_TTL = int(os.getenv("MEDICAMENTOS_CATALOGO_CACHE_TTL", 60 * 60))
+
+# Segundos que se guardan los conteos de /api/dashboard/ (ver appweb/estadisticas.py)
+DASHBOARD_CACHE_TTL = 30
+
+# Procesos para hashear contraseñas en `manage.py importar_usuarios` (1 = sin pool;
+# --procesos lo cambia por ejecución); el endpoint siempre hashea en la petición
+IMPORTACION_PROCESOS = 1
+
+# Traducción de etiquetas (ver appweb/traduccion.py)
+TRADUCCION_BACKEND = 'appweb.traduccion.TraductorGoogle'
+TRADUCCION_MEMO_CAPACIDAD = 2048
+
+# Despacho de notificaciones (manage.py despachar_notificaciones, ver appweb/notificaciones.py)
+# Backend por canal; los canales no listados usan los de BACKENDS_POR_DEFECTO
+NOTIFICACIONES_BACKENDS = {}
+# Anticipación máxima (minutos) que se considera al buscar notificaciones vencidas
+NOTIFICACIONES_ANTICIPACION_MAXIMA = 24 * 60
+# Pub/sub de las notificaciones en tiempo real (ver appweb/eventos.py)
+NOTIFICACIONES_BROKER = 'appweb.eventos.BrokerMemoria'
+if os.getenv("REDIS_URL"):
+    REDIS_URL = os.getenv("REDIS_URL")
+    NOTIFICACIONES_BROKER = 'appweb.eventos.BrokerRedis'
+# Segundos entre comentarios de keep-alive en /api/notificaciones/stream/
+NOTIFICACIONES_STREAM_HEARTBEAT = 15
+# Segundos que dura cada conexión al stream antes de que el navegador reconecte
+NOTIFICACIONES_STREAM_DURACION = 300
+
+# Días hacia adelante para los que se generan tomas programadas (manage.py generar_tomas)
+TOMAS_VENTANA_DIAS = 14
+
+# Adherencia (manage.py agregar_adherencia, ver appweb/adherencia.py)
+# Minutos después de la hora programada a partir de los cuales una toma cuenta como tardía
+ADHERENCIA_TOLERANCIA_MINUTOS = 60
+# Antigüedad mínima (segundos) de un registro para que el agregador lo procese
+ADHERENCIA_MARGEN_SEGUNDOS = 5
+
 PASSWORD_HASHERS = [
-    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'appweb.hashers.Argon2Configurable',
     'django.contrib.auth.hashers.PBKDF2PasswordHasher',
     'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
     'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
     'django.contrib.auth.hashers.ScryptPasswordHasher',
 ]
 
+# Costo de Argon2 (appweb/hashers.py); medir con manage.py medir_costo_password.
+# Al cambiarlo, cada contraseña se rehashea en el siguiente login.
+ARGON2_COSTO = {
+    'time_cost': int(os.getenv("ARGON2_TIME_COST", 2)),
+    'memory_cost': int(os.getenv("ARGON2_MEMORY_COST", 102400)),
+    'parallelism': int(os.getenv("ARGON2_PARALLELISM", 8)),
+}
+
+# Login: ultima_conexion solo se escribe si tiene más de estos segundos
+ULTIMA_CONEXION_GRANULARIDAD = int(os.getenv("ULTIMA_CONEXION_GRANULARIDAD", 5 * 60))
+
+# Sesiones con token (ver appweb/sesiones.py)
+# Segundos de validez de un token desde el login
+SESION_DURACION = int(os.getenv("SESION_DURACION", 60 * 60 * 12))
+# Segundos que una sesión validada se guarda en la caché compartida (Usuario.activo
+# se vuelve a comprobar al vencer)
+SESION_CACHE_TTL = 5 * 60
+# Segundos que cada proceso la recuerda en memoria (demora máxima de una revocación
+# en los demás procesos)
+SESION_CACHE_LOCAL_TTL = 10
+
+
+REST_FRAMEWORK = {
+    # Paginación por cursor opcional: solo actúa con ?limite= o ?cursor=
+    'DEFAULT_PAGINATION_CLASS': 'appweb.paginacion.PaginacionCursorPK',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators